@@ -0,0 +1,238 @@
+import argparse
+import functools
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import pandas as pd
+import cache
+from log import log
+from utils import inteprete
+
+"""
+动作结果的磁盘缓存(按内容寻址), 用于调整配置后的增量执行。
+
+每个表都有一个指纹: 读取的表格以 cache.cache_key(路径、大小、修改时间、内容哈希) 作为指纹,
+动作的输出以 哈希(代码版本, 动作名, 动作参数, 输入表的指纹) 作为指纹, 所以指纹只取决于输入文件的内容
+和产生它的全部动作。缓存以输出的指纹为键, 调整配置后没有变化的前缀动作直接命中缓存,
+只有变化的动作及其之后的动作重新计算; 命中的结果在被使用时才读取, 用不到的中间表不会被读取。
+
+export 会写文件, 总是执行; 它就地修改输入表的列类型, 因此执行后输入表的指纹随之改变。
+
+    python action_cache.py list            # 查看缓存的动作结果
+    python action_cache.py purge           # 清空动作结果缓存
+    python action_cache.py purge --all     # 同时清空表格缓存(cache/excel)
+"""
+
+CACHE_DIR = "cache/actions"
+MAX_BYTES = 2 * 1024 ** 3
+# 动作的实现, 这些文件有修改时已有的缓存全部失效
+MODULES = ("logic.py", "tool.py", "rule_engine.py", "utils.py", "compact.py")
+
+
+def set_max_bytes(max_bytes: int):
+    """设置缓存的磁盘预算(字节)"""
+    global MAX_BYTES
+    MAX_BYTES = max_bytes
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """动作实现的版本: 源文件和 pandas 版本的哈希; 打包后没有源文件, 以可执行文件代替"""
+    h = hashlib.blake2b(pd.__version__.encode('utf-8'), digest_size=16)
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in MODULES:
+        path = os.path.join(base, name)
+        if not os.path.exists(path):
+            stat = os.stat(sys.executable)
+            h.update(f"{sys.executable}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+            break
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def step_key(action_name: str, details: dict, input_fingerprints: list):
+    """
+    动作的键。输入以指纹表示, 所以不包含 details 中的签名 "df";
+    参数按配置中的顺序序列化(不排序), 因为规则的顺序会影响结果
+    """
+    params = {k: v for k, v in details.items() if k != "df"}
+    parts = [code_version(), action_name, json.dumps(params, ensure_ascii=False, separators=(',', ':'), default=str)]
+    return hashlib.blake2b('\n'.join(parts + input_fingerprints).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def output_key(key: str, n: int, i: int):
+    """动作第 i 个输出的键, 只有一个输出时与动作的键相同"""
+    return key if n == 1 else hashlib.blake2b(f"{key}:{i}".encode('utf-8'), digest_size=16).hexdigest()
+
+
+def cache_file(key: str):
+    return os.path.join(CACHE_DIR, f"{key}.pkl")
+
+
+def contains(key: str):
+    return os.path.exists(cache_file(key))
+
+
+def touch(key: str):
+    """更新最近使用时间, 登记后尚未读取的结果不会先于其他结果被清理"""
+    os.utime(cache_file(key))
+
+
+def load(key: str):
+    """读取缓存的结果, 文件中先是元数据, 然后是 DataFrame"""
+    path = cache_file(key)
+    with open(path, 'rb') as f:
+        pickle.load(f)
+        df = pickle.load(f)
+    os.utime(path)  # 更新最近使用时间
+    return df
+
+
+def read_meta(path: str):
+    """只读取元数据, 不读取 DataFrame"""
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save(key: str, df: pd.DataFrame, meta: dict, keep=()):
+    """写入缓存, 写入后按磁盘预算清理(不清理 keep 中的键); 写入失败只记录警告"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = cache_file(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({**meta, "rows": df.shape[0], "columns": df.shape[1], "time": time.time()}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        cache.evict(MAX_BYTES, CACHE_DIR, {cache_file(k) for k in keep})
+    except Exception as e:
+        log(f"【结果缓存】写入失败 '{meta.get('label')}': {e}", level='warning')
+
+
+def clear():
+    """清空动作结果缓存"""
+    cache.evict(0, CACHE_DIR)
+
+
+class Results:
+    """
+    一次 action_loop 中各符号的指纹和尚未读取的结果。
+    read(path, {符号: 工作表}) 读取输入表格, 返回 {符号: DataFrame}(见 Logic.read_files);
+    tag 区分读取方式不同(例如压缩列类型)的输入表格。命中缓存的输出和输入表格都在 materialize 时才读取。
+    """
+    def __init__(self, read, tag=""):
+        self.read = read
+        self.tag = tag
+        self.fingerprints = {}  # 符号 -> 指纹
+        self.pending = {}  # 符号 -> 读取它的函数
+        self.pending_keys = {}  # 符号 -> 命中但尚未读取的结果的键, 写入新结果时不清理
+        self.hits, self.misses = 0, 0
+
+    def add_file(self, symbol: str, path: str, sheet=0):
+        self.fingerprints[symbol] = f"file{self.tag}:{cache.cache_key(path, sheet)}"
+        self.pending[symbol] = lambda: self.read(path, {symbol: sheet})[symbol]
+
+    def key(self, action_name: str, details: dict):
+        input = [i for i in inteprete(details["df"])[0] if i != "None"]
+        return step_key(action_name, details, [self.fingerprints.get(i, f"missing:{i}") for i in input])
+
+    @staticmethod
+    def outputs(details: dict):
+        return [i for i in inteprete(details["df"])[1] if i != "None"]
+
+    def restore(self, key: str, action_name: str, details: dict, df_dict: dict):
+        """动作的全部输出都已缓存时登记这些输出(不读取), 返回是否命中; export 总是执行"""
+        outputs = self.outputs(details)
+        if action_name == "export" or not outputs:
+            return False
+        keys = [output_key(key, len(outputs), i) for i in range(len(outputs))]
+        try:
+            for k in keys:
+                touch(k)
+        except FileNotFoundError:
+            return False
+        for symbol, k in zip(outputs, keys):
+            df_dict.pop(symbol, None)
+            self.fingerprints[symbol] = k
+            self.pending[symbol] = functools.partial(load, k)
+            self.pending_keys[symbol] = k
+        self.hits += 1
+        log(f"【结果缓存】命中 {action_name} '{details['df']}', 跳过执行", level='info')
+        return True
+
+    def materialize(self, details: dict, df_dict: dict):
+        """读取动作的输入中尚未读取的表"""
+        for symbol in inteprete(details["df"])[0]:
+            if symbol in self.pending:
+                df_dict[symbol] = self.pending.pop(symbol)()
+                self.pending_keys.pop(symbol, None)
+
+    def store(self, key: str, action_name: str, details: dict, df_dict: dict):
+        """动作执行后更新输出的指纹并写入缓存"""
+        if action_name == "export":
+            # 就地修改了输入表
+            for symbol in inteprete(details["df"])[0]:
+                self.fingerprints[symbol] = key
+            return
+        self.misses += 1
+        outputs = self.outputs(details)
+        for i, symbol in enumerate(outputs):
+            k = output_key(key, len(outputs), i)
+            self.fingerprints[symbol] = k
+            self.pending.pop(symbol, None)
+            self.pending_keys.pop(symbol, None)
+            save(k, df_dict[symbol], {"label": f"{action_name} '{details['df']}' -> {symbol}"},
+                 self.pending_keys.values())
+
+    def summary(self):
+        total = sum(size for _, size, _ in cache.entries(CACHE_DIR))
+        log(f"【结果缓存】命中 {self.hits} 个动作, 重新计算 {self.misses} 个, "
+            f"缓存大小 {total / 1024 ** 2:.1f} MB", level='info')
+
+
+def describe(items: list):
+    lines = []
+    for path, size, used in reversed(items):
+        try:
+            meta = read_meta(path)
+        except Exception as e:
+            meta = {"label": f"(无法读取: {e})"}
+        created = time.strftime('%Y-%m-%d %H:%M', time.localtime(meta["time"])) if "time" in meta else "-"
+        lines.append(f"{os.path.basename(path)[:12]}  {size / 1024 ** 2:8.2f} MB  "
+                     f"创建 {created}  使用 {time.strftime('%Y-%m-%d %H:%M', time.localtime(used))}  "
+                     f"{meta.get('rows', '-')}x{meta.get('columns', '-')}  {meta.get('label', '')}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查看或清空动作结果缓存")
+    parser.add_argument("command", choices=["list", "purge"])
+    parser.add_argument("--all", action="store_true", help="purge 时同时清空表格缓存")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        items = cache.entries(CACHE_DIR)
+        for line in describe(items):
+            print(line)
+        excel = cache.entries()
+        print(f"动作结果: {len(items)} 个, {sum(i[1] for i in items) / 1024 ** 2:.1f} MB ('{CACHE_DIR}'); "
+              f"表格缓存: {len(excel)} 个, {sum(i[1] for i in excel) / 1024 ** 2:.1f} MB ('{cache.CACHE_DIR}')")
+    else:
+        n = len(cache.entries(CACHE_DIR))
+        clear()
+        print(f"已清空动作结果缓存: {n} 个")
+        if args.all:
+            n = len(cache.entries())
+            cache.clear()
+            print(f"已清空表格缓存: {n} 个")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+"""
+命令行批处理: 不依赖界面(不导入 Qt 和 tkinter), 用 Logic.action_loop 执行 action_loop 配置。
+多组互不相关的输入在进程池中并行执行, 每个任务有自己的输出目录、日志和退出码。
+
+    # 单个任务, --set 把配置中的文件名绑定到路径
+    python batch.py config/loop.jsonc --set 表=data/店铺A.xlsx
+    # 配置中的一个文件名对应多个文件, 每个文件一个任务
+    python batch.py config/loop.jsonc --each 表 "data/店铺/*.xlsx" --processes 4
+    # 任务清单(jsonc): [{"name": "店铺A", "files": {"表": "data/a.xlsx"}, "options": {...}}, ...]
+    python batch.py config/loop.jsonc --manifest jobs.jsonc
+    # 也可以用 config/config.jsonc 中的功能名选择配置
+    python batch.py config/config.jsonc --func 处理 --set 表=data/a.xlsx
+
+每个任务在 <--out>/<任务名>/ 下执行: 导出的表格在其中的 data/ 目录, 日志为其中的 log.txt,
+磁盘缓存仍然共用当前目录下的 cache/excel 和 cache/actions。全部任务的退出码和耗时写入 <--out>/summary.json,
+有任务失败时本程序的退出码为 1。
+"""
+
+OUT_DIR = "batch_out"
+JOB_LOG = "log.txt"
+
+
+def load_config(fpath: str, func_name=None) -> dict:
+    """
+    读取 action_loop 配置, 返回 {"files": {文件名: 符号}, "actions": ..., "options": ...};
+    配置有误(见 config_check.py)时抛出 ValueError, 不启动任何任务
+    """
+    from config_check import read_config, describe
+
+    config, errors = read_config(fpath)
+    if func_name is not None:
+        if func_name not in config:
+            raise ValueError(f"'{fpath}' 中没有功能 '{func_name}', 可选: {', '.join(config)}")
+        if config[func_name].get("func") != "action_loop":
+            raise ValueError(f"功能 '{func_name}' 不是 action_loop")
+        fpath = config[func_name]["config"]
+        config, errors = read_config(fpath)
+    if "files" not in config or "actions" not in config:
+        raise ValueError(f"'{fpath}' 不是 action_loop 配置(缺少 files 或 actions), 可以用 --func 选择功能")
+    if errors:
+        raise ValueError(f"配置 '{fpath}' 有误:\n{describe(errors)}")
+    return {"files": config["files"], "actions": config["actions"], "options": config.get("options", {})}
+
+
+def parse_set(items: list) -> dict:
+    files = {}
+    for item in items:
+        if "=" not in item:
+            raise ValueError(f"--set 的格式应为 文件名=路径: '{item}'")
+        fname, path = item.split("=", 1)
+        files[fname.strip()] = path.strip()
+    return files
+
+
+def make_jobs(args, config: dict) -> list:
+    """根据命令行参数生成任务列表 [{"name", "files": {文件名: 路径}, "options"}, ...]"""
+    fixed = parse_set(args.set)
+    jobs = []
+    if args.manifest:
+        from jsonc import read_json
+        manifest = read_json(args.manifest)
+        if isinstance(manifest, dict):
+            manifest = [{"name": name, **job} for name, job in manifest.items()]
+        for i, job in enumerate(manifest):
+            jobs.append({"name": str(job.get("name", i + 1)), "files": {**fixed, **job.get("files", {})},
+                         "options": job.get("options", {})})
+    elif args.each:
+        fname, pattern = args.each
+        for path in sorted(glob.glob(pattern)):
+            jobs.append({"name": os.path.splitext(os.path.basename(path))[0], "files": {**fixed, fname: path},
+                         "options": {}})
+        if not jobs:
+            raise ValueError(f"没有文件匹配 '{pattern}'")
+    else:
+        jobs.append({"name": args.name or "job", "files": fixed, "options": {}})
+
+    names = set()
+    for job in jobs:
+        missing = [fname for fname in config["files"] if fname not in job["files"]]
+        if missing:
+            raise ValueError(f"任务 '{job['name']}' 缺少文件: {', '.join(missing)}")
+        if job["name"] in names:
+            raise ValueError(f"任务名重复: '{job['name']}'")
+        names.add(job["name"])
+        job["files"] = {fname: os.path.abspath(path) for fname, path in job["files"].items()}
+    return jobs
+
+
+def run_job(config: dict, job: dict, out_dir: str, cache_dir: str, action_cache_dir: str):
+    """
+    在子进程中执行一个任务, 返回 (任务名, 退出码, 耗时秒数, 日志路径, 错误信息)。
+    action_loop 出错时会 exit(1), 这里捕获 SystemExit 并把它的代码作为任务的退出码。
+    """
+    start = time.perf_counter()
+    job_dir = os.path.abspath(os.path.join(out_dir, job["name"]))
+    log_path = os.path.join(job_dir, JOB_LOG)
+    os.makedirs(os.path.join(job_dir, "data"), exist_ok=True)
+    os.chdir(job_dir)  # export 写入相对路径 data/, 每个任务一个目录, 互不覆盖
+
+    from log import setup_job_logger, log
+    setup_job_logger(log_path)
+
+    code, error = 0, None
+    try:
+        import cache
+        import action_cache
+        from logic import Logic
+        cache.CACHE_DIR = cache_dir
+        action_cache.CACHE_DIR = action_cache_dir
+
+        loop_config = {
+            "files": {fname: {"symbol": symbol, "path": job["files"][fname]} for fname, symbol in config["files"].items()},
+            "actions": config["actions"],
+            # 没有界面, 总是写出结果(忽略 preview)
+            "options": {**config["options"], **job["options"], "preview": False},
+        }
+        log(f"【批处理】任务 '{job['name']}' 开始, 文件: {job['files']}", level='info')
+        invalid = Logic.check_paths_validity([f["path"] for f in loop_config["files"].values()])
+        if invalid:
+            raise FileNotFoundError(f"文件不存在: {', '.join(invalid)}")
+        Logic.action_loop(loop_config)
+        log(f"【批处理】任务 '{job['name']}' 完成, 耗时 {time.perf_counter() - start:.1f} 秒", level='info')
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+        error = f"退出码 {code}, 详见日志"
+    except Exception as e:
+        code, error = 1, f"{type(e).__name__}: {e}"
+        log(f"【批处理】任务 '{job['name']}' 出错: {error}\n{traceback.format_exc()}", level='error')
+    return job["name"], code, time.perf_counter() - start, log_path, error
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量处理excel工具的命令行批处理(无界面)")
+    parser.add_argument("config", help="action_loop 配置文件, 或配合 --func 使用的 config/config.jsonc")
+    parser.add_argument("--func", help="config/config.jsonc 中的功能名")
+    parser.add_argument("--set", action="append", default=[], metavar="文件名=路径",
+                        help="把配置中的文件名绑定到路径, 可重复; 对所有任务生效")
+    parser.add_argument("--each", nargs=2, metavar=("文件名", "通配符"), help="通配符匹配的每个文件生成一个任务")
+    parser.add_argument("--manifest", help="任务清单(jsonc)")
+    parser.add_argument("--name", help="单个任务时的任务名")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="进程数")
+    parser.add_argument("--out", default=OUT_DIR, help="输出目录")
+    args = parser.parse_args(argv)
+
+    try:
+        config = load_config(args.config, args.func)
+        jobs = make_jobs(args, config)
+    except (ValueError, OSError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+    except SystemExit:
+        print(f"错误: 无法读取配置 '{args.config}'", file=sys.stderr)
+        return 2
+
+    out_dir = os.path.abspath(args.out)
+    import cache
+    import action_cache
+    cache_dir = os.path.abspath(cache.CACHE_DIR)
+    action_cache_dir = os.path.abspath(action_cache.CACHE_DIR)
+    processes = max(1, min(args.processes, len(jobs)))
+    print(f"共 {len(jobs)} 个任务, 进程数={processes}, 输出目录='{out_dir}'", flush=True)
+
+    summary = []
+    # spawn: 子进程不继承父进程的日志处理器和其他状态, 各平台行为一致
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(run_job, config, job, out_dir, cache_dir, action_cache_dir): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                name, code, seconds, log_path, error = future.result()
+            except Exception as e:
+                # 子进程异常退出(例如内存不足被杀死)
+                name, code, seconds, log_path, error = job["name"], 1, 0.0, None, f"{type(e).__name__}: {e}"
+            summary.append({"name": name, "exit_code": code, "seconds": round(seconds, 2), "log": log_path,
+                            "error": error, "files": job["files"]})
+            status = "完成" if code == 0 else "失败"
+            print(f"[{status}] {name}  退出码={code}  耗时={seconds:.1f}s  日志={log_path}"
+                  + (f"  {error}" if error else ""), flush=True)
+
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(sorted(summary, key=lambda x: x["name"]), f, ensure_ascii=False, indent=2)
+    failed = [item for item in summary if item["exit_code"] != 0]
+    print(f"成功 {len(summary) - len(failed)} 个, 失败 {len(failed)} 个", flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+"""
+性能基准: 生成模拟表格, 测量每个动作、compare_df、read_excel 和 write_excel(以及 csv 等导出格式)
+在不同行数下的耗时和内存峰值, 结果写入 JSON 并与保存的基准结果比较。
+
+    python bench.py                                  # 默认 10k, 100k, 1M 行
+    python bench.py --sizes 10000 100000 --cases rm_row compare_merge
+    python bench.py --save-baseline                  # 把本次结果保存为基准
+
+耗时取 --repeat 次中的最小值; 内存峰值用 tracemalloc 另外执行一次测量(numpy/pandas 的数据缓冲区也会被统计)。
+"""
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+RESULT_PATH = "bench/result.json"
+BASELINE_PATH = "bench/baseline.json"
+
+# 耗时随行数增长过快的用例, 超过该行数时跳过(--no-limit 取消限制)
+# compare_loop 逐组比较
+ROW_LIMITS = {"compare_loop": 10_000}
+
+# 模拟数据的取值
+COLORS = ["蓝色", "黑黄", "橙色", "灰色", "灰红", "红色", "绿色", "白色", "透明", "317"]
+ITEMS = ["喷壶", "水桶", "花盆", "铲子", "手套", "剪刀", "浇水壶", "园艺架", "种子", "营养土"]
+SPECS = ["500ml", "1L", "2L", "小号", "中号", "大号", "套装", "加厚款", ""]
+CITIES = ["北京", "上海", "广州", "深圳", "杭州", "成都", "武汉", "西安"]
+SHOPS = ["旗舰店", "专营店", "海外店"]
+
+
+######
+# 模拟数据
+######
+
+def make_df(n: int, dup_rate=0.1, seed=0) -> pd.DataFrame:
+    """
+    生成 n 行模拟数据。
+    MSKU 基数高: 约 dup_rate 比例的行与其他行的 MSKU 重复, 其余行的 MSKU 唯一;
+    仓库代码基数低且分布不均; 品名为中文文本; 数量为整数, 约 5% 为空。
+    """
+    rng = np.random.default_rng(seed)
+    n_unique = max(1, n - int(n * dup_rate))
+    msku = np.concatenate([np.arange(n_unique), rng.integers(0, n_unique, n - n_unique)])
+    rng.shuffle(msku)
+
+    weights = 1 / np.arange(1, 13)
+    warehouse = rng.choice([f"WH{i:02d}" for i in range(1, 13)], n, p=weights / weights.sum())
+
+    name = np.char.add(np.char.add(np.array(COLORS)[rng.integers(0, len(COLORS), n)],
+                                   np.array(ITEMS)[rng.integers(0, len(ITEMS), n)]),
+                       np.array(SPECS)[rng.integers(0, len(SPECS), n)])
+
+    quantity = rng.integers(1, 50, n).astype(float)
+    quantity[rng.random(n) < 0.05] = np.nan
+
+    city = np.array(CITIES, dtype=object)[rng.integers(0, len(CITIES), n)]
+    city[rng.random(n) < 0.1] = None
+
+    return pd.DataFrame({
+        "单号": np.char.add("OD", rng.integers(0, max(1, n // 3), n).astype(str)),
+        "MSKU": np.char.add("SKU", msku.astype(str)),
+        "仓库代码/Warehouse Code": warehouse,
+        "品名": name,
+        "数量": quantity,
+        "城市": city,
+        "店铺": rng.choice(SHOPS, n),
+    })
+
+
+def make_pair(n: int, diff_rate=0.01, dup_rate=0.1, seed=0):
+    """
+    生成一对用于比较的表: 第二个表中约 diff_rate 比例的行改了数量或品名,
+    另有约 diff_rate/2 比例的行被删除、diff_rate/2 比例的新行被加入。
+    """
+    rng = np.random.default_rng(seed + 1)
+    df1 = make_df(n, dup_rate, seed)
+    df2 = df1.copy()
+
+    changed = rng.random(n) < diff_rate
+    half = rng.random(n) < 0.5
+    df2.loc[changed & half, "数量"] = df2.loc[changed & half, "数量"] + 1
+    df2.loc[changed & ~half, "品名"] = df2.loc[changed & ~half, "品名"] + "(新)"
+
+    removed = rng.random(n) < diff_rate / 2
+    added = make_df(max(1, int(n * diff_rate / 2)), dup_rate, seed + 2)
+    added["MSKU"] = "NEW" + added["MSKU"]
+    df2 = pd.concat([df2[~removed], added], ignore_index=True)
+    return df1, df2
+
+
+######
+# 用例
+######
+
+def make_rules(n_rules: int, seed=0):
+    rng = np.random.default_rng(seed)
+    skus = rng.integers(0, 1000, n_rules)
+    return [f"SKU{i}$" for i in skus]
+
+
+def prepare(case: str, df: pd.DataFrame, pair, xlsx: str):
+    """返回 (说明, 无参函数); 准备工作(复制输入等)不计入耗时"""
+    import tool
+    from utils import compare_df, read_excel, write_excel, write_table
+
+    log_columns = ["MSKU", "品名", "数量"]
+    skus = make_rules(100)
+    if case == "fill":
+        data = df.copy()
+        return "按单号补充重复组缺失值", lambda: tool.fill(data, ["单号"], log_columns)
+    if case == "eq_sum":
+        data = df.copy()
+        return "按单号+MSKU删除重复行并累加数量", \
+            lambda: tool.eq_sum(data, ["单号"], ["MSKU"], ["数量"], log_columns)
+    if case == "rm_row":
+        data = df.copy()
+        rules = [{"MSKU": sku} for sku in skus] + [{"品名": "(?=.*喷壶)(?=.*(?:蓝|黑黄))", "城市": "北京"}]
+        return f"{len(rules)} 条删除规则", lambda: tool.rm_row(data, rules, log_columns)
+    if case == "add_row":
+        data = df.copy()
+        rules = {"品名": {"套装": [{"品名": "套装配件", "数量": 1}]}, "MSKU": {sku: [{"数量": 0}] for sku in skus[:20]}}
+        return "按品名和 20 个 MSKU 增加行", lambda: tool.add_row(data, rules, log_columns)
+    if case == "alter_val":
+        data = df.copy()
+        rules = {"MSKU": {sku: {"品名": f"新品名{i}", "MSKU": f"NEW{i}"} for i, sku in enumerate(skus)},
+                 "品名": {"喷壶": {"城市": "广州"}}}
+        return f"{len(skus) + 1} 条改值规则", lambda: tool.alter_val(data, rules, log_columns)
+    if case == "split":
+        data = df.copy()
+        rules = [{"仓库代码/Warehouse Code": "WH0[1-3]"}, {"品名": "花盆", "店铺": "海外"}]
+        return "按仓库和品名分仓(extract)", lambda: tool.split(data, rules, True, log_columns, "bench")
+    if case == "format":
+        data = df.copy()
+        rules = {"copy": [["sku", "MSKU"], ["数量", "数量"]], "constant": [["来源", "bench"]],
+                 "concat": [["地址", "城市", "店铺"]]}
+        return "复制、常量、拼接列", \
+            lambda: tool.format(data, rules, ["sku", "数量", "来源", "地址"], log_columns, "bench")
+    if case == "add_col":
+        data = df.copy()
+        rules = {"仓库代码/Warehouse Code": {"WPLA16": [{"品名": "(?=.*喷壶)(?=.*(?:蓝|黑黄|橙色|317|灰色|灰红)).*"}, {}],
+                                             "WPLA17": [{"品名": "水桶", "城市": "上海"}]}}
+        return "按品名规则填充仓库代码", lambda: tool.add_col(data, rules, log_columns, "bench")
+    if case == "concat_df":
+        data = [df, pair[1]]
+        return "纵向合并两个表", lambda: tool.concat_df(data, 0)
+    if case == "export":
+        data = df.copy()
+        return "设置列类型并写表", \
+            lambda: tool.export(data, {"str": ["数量"]}, "bench", "", ["单号"])
+    if case in ("compare_merge", "compare_loop"):
+        df1, df2 = pair[0].copy(), pair[1].copy()
+        engine = case.split("_")[1]
+        return f"按 MSKU 比较两个表, engine={engine}", lambda: compare_df(df1, df2, ["MSKU"], engine)
+    if case == "read_excel":
+        return "解析 xlsx(不使用缓存)", lambda: read_excel(xlsx, use_cache=False)
+    if case == "read_excel_cached":
+        read_excel(xlsx)  # 写入缓存
+        return "读取磁盘缓存", lambda: read_excel(xlsx)
+    if case == "write_excel":
+        return "写 xlsx", lambda: write_excel(df, "bench_write.xlsx")
+    if case == "write_excel_stream":
+        return "流式写 xlsx", lambda: write_excel(df, "bench_write_stream.xlsx", stream=True)
+    if case in ("write_csv", "write_parquet", "write_feather"):
+        fmt = case.split("_")[1]
+        return f"写 {fmt}(export 的 format)", lambda: write_table(df, f"bench_write.{fmt}", fmt)
+    raise ValueError(f"未知的用例: {case}")
+
+
+CASES = ["fill", "eq_sum", "rm_row", "add_row", "alter_val", "split", "format", "add_col", "concat_df", "export",
+         "compare_merge", "compare_loop", "read_excel", "read_excel_cached", "write_excel", "write_excel_stream",
+         "write_csv", "write_parquet", "write_feather"]
+
+
+######
+# 测量
+######
+
+def measure(fn, repeat=1, memory=True):
+    """返回 (最短耗时秒数, 内存峰值字节数 或 None)"""
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return min(seconds), peak
+
+
+def run(sizes: list, cases: list, repeat=1, memory=True, no_limit=False, seed=0):
+    from utils import write_excel
+
+    results = []
+    for n in sizes:
+        df = make_df(n, seed=seed)
+        pair = make_pair(n, seed=seed)
+        workdir = tempfile.mkdtemp(prefix="bench_")
+        cwd = os.getcwd()
+        os.chdir(workdir)  # export 和缓存都使用相对路径, 在临时目录中执行
+        try:
+            os.makedirs("data", exist_ok=True)
+            xlsx = "bench_input.xlsx"
+            if {"read_excel", "read_excel_cached"} & set(cases):
+                write_excel(df, xlsx, stream=True)
+            for case in cases:
+                if not no_limit and n > ROW_LIMITS.get(case, n):
+                    print(f"[跳过] {case} 行数={n} (超过 {ROW_LIMITS[case]} 行, --no-limit 取消限制)")
+                    continue
+                desc, fn = prepare(case, df, pair, xlsx)
+                try:
+                    seconds, peak = measure(fn, repeat, memory)
+                except Exception as e:
+                    # 记录错误并继续执行其他用例
+                    results.append({"case": case, "rows": n, "desc": desc, "error": f"{type(e).__name__}: {e}"})
+                    print(f"{case:<20} {n:>9} 行  出错: {type(e).__name__}: {e}", flush=True)
+                    continue
+                result = {"case": case, "rows": n, "desc": desc, "seconds": round(seconds, 4),
+                          "peak_mb": round(peak / 1024 ** 2, 2) if peak is not None else None}
+                results.append(result)
+                peak_text = f"{result['peak_mb']:>10.1f} MB" if peak is not None else ""
+                print(f"{case:<20} {n:>9} 行 {seconds:>9.3f} s {peak_text}  {desc}", flush=True)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare_baseline(results: list, baseline: list, threshold: float):
+    """与基准结果逐项比较, 耗时或内存峰值超过基准的 threshold 倍时记为退化"""
+    base = {(r["case"], r["rows"]): r for r in baseline}
+    comparison = []
+    for r in results:
+        b = base.get((r["case"], r["rows"]))
+        if b is None or "error" in r or "error" in b:
+            continue
+        item = {"case": r["case"], "rows": r["rows"], "seconds": r["seconds"], "baseline_seconds": b["seconds"],
+                "time_ratio": round(r["seconds"] / b["seconds"], 3) if b["seconds"] else None}
+        if r.get("peak_mb") is not None and b.get("peak_mb"):
+            item.update(peak_mb=r["peak_mb"], baseline_peak_mb=b["peak_mb"],
+                        mem_ratio=round(r["peak_mb"] / b["peak_mb"], 3))
+        item["regression"] = any(item.get(k) is not None and item[k] > threshold for k in ("time_ratio", "mem_ratio"))
+        comparison.append(item)
+    return comparison
+
+
+def environment():
+    info = {"time": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+            "platform": platform.platform(), "pandas": pd.__version__, "numpy": np.__version__}
+    try:
+        import subprocess
+        info["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                        check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        pass
+    return info
+
+
+def write_json(data, fpath: str):
+    os.makedirs(os.path.dirname(fpath) or ".", exist_ok=True)
+    with open(fpath, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量处理excel工具的性能基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="行数")
+    parser.add_argument("--cases", nargs="+", default=CASES, choices=CASES, metavar="CASE",
+                        help=f"要执行的用例, 可选: {', '.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=1, help="每个用例计时的次数, 取最小值")
+    parser.add_argument("--no-memory", action="store_true", help="不测量内存峰值")
+    parser.add_argument("--no-limit", action="store_true", help="不跳过超过行数限制的慢用例")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=RESULT_PATH, help="结果文件")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基准结果文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基准")
+    parser.add_argument("--threshold", type=float, default=1.2, help="超过基准多少倍记为退化")
+    parser.add_argument("--strict", action="store_true", help="有退化时返回非零退出码")
+    args = parser.parse_args(argv)
+
+    # 工具函数的日志会格式化表格并写文件, 基准测试时只保留警告和错误
+    from log import logger
+    logger.setLevel(logging.WARNING)
+
+    results = run(args.sizes, args.cases, args.repeat, not args.no_memory, args.no_limit, args.seed)
+    data = {"env": environment(), "results": results}
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        data["baseline_env"] = baseline.get("env")
+        data["comparison"] = compare_baseline(results, baseline["results"], args.threshold)
+        for item in data["comparison"]:
+            mem = f"  内存 x{item['mem_ratio']}" if "mem_ratio" in item else ""
+            flag = "  <-- 退化" if item["regression"] else ""
+            print(f"{item['case']:<20} {item['rows']:>9} 行  耗时 x{item['time_ratio']}{mem}{flag}")
+
+    write_json(data, args.out)
+    print(f"结果已写入 '{args.out}'")
+    if args.save_baseline:
+        write_json(data, args.baseline)
+        print(f"基准已保存到 '{args.baseline}'")
+
+    regressions = [item for item in data.get("comparison", []) if item["regression"]]
+    if regressions:
+        print(f"{len(regressions)} 项超过基准的 {args.threshold} 倍")
+    return 1 if args.strict and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
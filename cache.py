@@ -0,0 +1,124 @@
+import hashlib
+import os
+import pickle
+import threading
+import pandas as pd
+from log import log
+
+"""已解析表格的磁盘缓存"""
+# 缓存目录和磁盘预算, 超出预算时按最近使用时间(LRU)删除
+CACHE_DIR = "cache/excel"
+MAX_BYTES = 2 * 1024 ** 3
+
+# 计算内容哈希时读取的文件头、文件尾字节数
+# xlsx 是 zip 文件, 末尾的中央目录记录了每个成员的 CRC32, 所以文件尾足以反映内容的变化
+HEAD_BYTES = 64 * 1024
+TAIL_BYTES = 1024 * 1024
+
+
+def set_max_bytes(max_bytes: int):
+    """设置缓存的磁盘预算(字节)"""
+    global MAX_BYTES
+    MAX_BYTES = max_bytes
+
+
+def content_hash(fpath: str, size: int):
+    h = hashlib.blake2b(digest_size=16)
+    with open(fpath, 'rb') as f:
+        h.update(f.read(HEAD_BYTES))
+        if size > HEAD_BYTES:
+            f.seek(max(HEAD_BYTES, size - TAIL_BYTES))
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def cache_key(fpath: str, sheet_name=None):
+    """缓存键: 绝对路径、文件大小、修改时间、工作表名和内容哈希"""
+    fpath = os.path.abspath(fpath)
+    stat = os.stat(fpath)
+    sheet_name = sheet_name if sheet_name else 0
+    parts = [fpath, str(stat.st_size), str(stat.st_mtime_ns), repr(sheet_name), content_hash(fpath, stat.st_size)]
+    return hashlib.blake2b('\n'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def cache_file(key: str):
+    return os.path.join(CACHE_DIR, f"{key}.pkl")
+
+
+def load(fpath: str, sheet_name=None):
+    """读取缓存, 未命中时返回 None"""
+    try:
+        path = cache_file(cache_key(fpath, sheet_name))
+        if not os.path.exists(path):
+            return None
+        df = pd.read_pickle(path)
+        os.utime(path)  # 更新最近使用时间
+        log(f"读取缓存 '{fpath}' <- '{path}'", level='debug')
+        return df
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log(f"读取缓存失败 '{fpath}': {e}", level='warning')
+        return None
+
+
+def cached_size(fpath: str, sheet_name=None):
+    """返回缓存文件的字节数, 未缓存时返回 None"""
+    try:
+        return os.path.getsize(cache_file(cache_key(fpath, sheet_name)))
+    except OSError:
+        return None
+
+
+def save(fpath: str, df: pd.DataFrame, sheet_name=None):
+    """写入缓存, 写入后按磁盘预算清理"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = cache_file(cache_key(fpath, sheet_name))
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df.to_pickle(tmp_path, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        log(f"写入缓存 '{fpath}' -> '{path}'", level='debug')
+        evict()
+    except Exception as e:
+        log(f"写入缓存失败 '{fpath}': {e}", level='warning')
+
+
+def entries(cache_dir=None):
+    """返回 cache_dir(默认为 CACHE_DIR) 中的 [(路径, 字节数, 最近使用时间), ...], 按最近使用时间从旧到新排列"""
+    cache_dir = CACHE_DIR if cache_dir is None else cache_dir
+    if not os.path.isdir(cache_dir):
+        return []
+    result = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pkl'):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            result.append((path, stat.st_size, stat.st_mtime))
+    return sorted(result, key=lambda x: x[2])
+
+
+def evict(max_bytes=None, cache_dir=None, keep=()):
+    """删除 cache_dir(默认为 CACHE_DIR) 中最久未使用的缓存, 直到总大小不超过 max_bytes; keep 中的路径不删除"""
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    items = entries(cache_dir)
+    total = sum(size for _, size, _ in items)
+    for path, size, _ in items:
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            log(f"清理缓存 '{path}', 字节数={size}", level='debug')
+        except FileNotFoundError:
+            continue
+
+
+def clear():
+    """清空缓存"""
+    evict(0)
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+from log import log
+
+"""
+读取后压缩列类型(选项 compact):
+- 不同值较少的字符串列转为分类(category), 每个不同的值只存一次, 每行只存一个小整数编号
+- 整数列降为能容纳全部值的最小整数类型(整数的字符串与位数无关); 浮点列不降位: float32 转为字符串时与 float64 不同(例如 1e+08)
+
+动作中向这些列写入新的值之前调用 accept, 累加之前调用 widen, 拼接新行之后调用 restore,
+使结果与不压缩时相同, 并尽量保持压缩的类型。
+"""
+
+# 不同值的数量不超过行数的该比例时转为分类
+CATEGORY_RATIO = 0.5
+
+
+def is_compact(dtype):
+    return isinstance(dtype, pd.CategoricalDtype) or (dtype.kind in 'iu' and dtype.itemsize < 8)
+
+
+def compact_series(s: pd.Series):
+    """返回压缩后的列, 不能压缩时返回原列"""
+    if s.dtype.kind in 'iu' and s.dtype.itemsize > 1:
+        return pd.to_numeric(s, downcast='integer' if s.dtype.kind == 'i' else 'unsigned')
+    if s.dtype == object or isinstance(s.dtype, pd.StringDtype):
+        # 只转换纯字符串列: 分类会把 1 和 1.0 这类相等的值合并为一个类别
+        if s.shape[0] and s.nunique() <= s.shape[0] * CATEGORY_RATIO and \
+                pd.api.types.infer_dtype(s, skipna=True) == 'string':
+            return s.astype('category')
+    return s
+
+
+def compact_df(df: pd.DataFrame):
+    """返回压缩列类型后的 DataFrame 和被压缩的列 {列名: 新类型名}"""
+    data, changed = {}, {}
+    for i, column in enumerate(df.columns):
+        s = df.iloc[:, i]
+        new = compact_series(s)
+        if new is not s:
+            changed[column] = str(new.dtype) if not isinstance(new.dtype, pd.CategoricalDtype) else 'category'
+        data[i] = new
+    if not changed:
+        return df, changed
+    result = pd.DataFrame(data, index=df.index)
+    result.columns = df.columns
+    return result, changed
+
+
+def log_compact(symbol: str, before: int, after: int, changed: dict):
+    categories = [c for c, t in changed.items() if t == 'category']
+    numbers = [f"{c}:{t}" for c, t in changed.items() if t != 'category']
+    log(f"【压缩列类型】{symbol}: 内存 {before / 1024 ** 2:.2f} MB -> {after / 1024 ** 2:.2f} MB, "
+        f"分类列={categories}, 降位列={numbers}", level='info')
+
+
+def compact_frame(symbol: str, df: pd.DataFrame):
+    """压缩 df 的列类型并记录压缩前后的内存占用"""
+    before = int(df.memory_usage(deep=True).sum())
+    df, changed = compact_df(df)
+    log_compact(symbol, before, int(df.memory_usage(deep=True).sum()) if changed else before, changed)
+    return df
+
+
+def plain_dtype(dtype):
+    """分类列还原后的类型"""
+    return dtype.categories.dtype if isinstance(dtype, pd.CategoricalDtype) else dtype
+
+
+def expand(df: pd.DataFrame):
+    """把分类列还原为普通列(字符串处理、比较之前调用); 没有分类列时返回 df 本身"""
+    columns = [c for c, t in df.dtypes.items() if isinstance(t, pd.CategoricalDtype)]
+    if not columns:
+        return df
+    return df.astype({c: plain_dtype(df[c].dtype) for c in columns})
+
+
+def accept(df: pd.DataFrame, column, values):
+    """
+    在向 df[column] 写入 values 之前调用(就地修改 df): 分类列加入新的类别,
+    类型不同的新值则还原为普通列; 降位的数值列升为 64 位, 与不压缩时的行为一致
+    """
+    if column not in df.columns:
+        return
+    s = df[column]
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        new = [v for v in dict.fromkeys(values) if not pd.isna(v) and v not in s.cat.categories]
+        if not new:
+            return
+        if all(isinstance(v, str) for v in new) and pd.api.types.is_string_dtype(s.cat.categories.dtype):
+            df[column] = s.cat.add_categories(new)
+        else:
+            df[column] = s.astype(plain_dtype(s.dtype))
+    elif s.dtype.kind in 'iu' and s.dtype.itemsize < 8:
+        df[column] = s.astype(np.int64)
+
+
+def widen(df: pd.DataFrame, columns: list):
+    """把 columns 中压缩过的列还原(就地修改 df), 用于累加等可能溢出或依赖原类型的计算"""
+    for column in columns:
+        if column in df.columns and is_compact(df[column].dtype):
+            s = df[column]
+            df[column] = s.astype(plain_dtype(s.dtype) if isinstance(s.dtype, pd.CategoricalDtype) else np.int64)
+
+
+def restore(df: pd.DataFrame, like: pd.DataFrame):
+    """
+    拼接等操作会把分类列和降位的数值列变回普通列, 按 like 中的类型重新压缩 df 的这些列(就地修改 df)。
+    不能无损恢复的列保持原样。
+    """
+    for column, dtype in like.dtypes.items():
+        if column not in df.columns or df[column].dtype == dtype or not is_compact(dtype):
+            continue
+        s = df[column]
+        if isinstance(dtype, pd.CategoricalDtype):
+            if pd.api.types.infer_dtype(s, skipna=True) in ('string', 'empty'):
+                df[column] = s.astype('category')
+        elif s.dtype.kind in 'iu':
+            new = compact_series(s)
+            if new is not s:
+                df[column] = new
@@ -0,0 +1,261 @@
+import functools
+import hashlib
+import importlib.util
+import os
+import re
+import sys
+from log import log
+from sys import exit
+from jsonc import read_compiled
+
+"""
+配置的编译期检查, 不依赖 pandas, 界面启动时可以直接使用。
+
+在读取任何表格之前检查 action_loop 配置, 而不是执行到一半才因为缺少参数出错:
+- 动作的编号和代码, 以及每个动作必需的参数
+- 签名 df("输入,...->输出,..."): 格式和输入输出的数量; 输入必须是 files 中的符号或之前的动作的输出
+- 规则中的正则表达式能否编译(与 rule_engine 一样忽略大小写)
+read_config 把检查结果与解析结果一起缓存(见 jsonc.compile_json), 配置文件不变时不重复解析和检查。
+"""
+
+ACTION_NAMES = {"1": "fill", "2": "eq_sum", "3": "rm_row", "4": "add_row", "5": "alter_val",
+                "6": "split", "7": "format", "8": "add_col", "9": "export", "10": "concat_df"}
+# 每个动作必需的参数
+REQUIRED_KEYS = {
+    "fill": ("df", "by", "log_columns"),
+    "eq_sum": ("df", "by", "eq", "sum", "log_columns"),
+    "rm_row": ("df", "rm_rules", "log_columns"),
+    "add_row": ("df", "add_rules", "log_columns"),
+    "alter_val": ("df", "alter_rules", "log_columns"),
+    "split": ("df", "split_rules", "extract", "log_columns", "name"),
+    "format": ("df", "format_rules", "columns", "log_columns", "name"),
+    "add_col": ("df", "add_rules", "log_columns", "name"),
+    "export": ("df", "export_dtype", "name", "suffix", "count_cols"),
+    "concat_df": ("df", "axis"),
+}
+# 动作的规则参数
+RULE_KEYS = {"rm_row": "rm_rules", "add_row": "add_rules", "alter_val": "alter_rules", "split": "split_rules",
+             "format": "format_rules", "add_col": "add_rules"}
+# 值为列名列表的参数
+LIST_KEYS = ("by", "eq", "sum", "log_columns", "columns", "count_cols")
+# 签名中 (输入数量, 输出数量), None 表示不限
+SIGNATURES = {"split": (1, 2), "export": (1, None), "concat_df": (None, 1)}
+FUNCS = ("compare", "action_loop", "help")
+# export 的格式(也是文件的扩展名)
+EXPORT_FORMATS = ("xlsx", "csv", "parquet", "feather")
+# 需要 pyarrow 的格式
+ARROW_FORMATS = ("parquet", "feather")
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """检查规则的版本: 本文件的哈希, 修改检查规则后缓存的结果失效; 打包后没有源文件, 以可执行文件代替"""
+    path = os.path.abspath(__file__)
+    if not os.path.exists(path):
+        stat = os.stat(sys.executable)
+        return f"{sys.executable}:{stat.st_size}:{stat.st_mtime_ns}"
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def action_name(action_code: str):
+    """动作代码可以是编号或名字, 统一返回名字"""
+    return ACTION_NAMES.get(action_code, action_code)
+
+
+def defined_symbols(files: dict):
+    """files 中定义的 (符号集合, 符号前缀列表); files 可以是配置文件中的形式, 也可以是 {文件名: {"symbol", "path"}}"""
+    symbols, prefixes = set(), []
+    for v in files.values():
+        if isinstance(v, dict) and "symbol" in v and "path" in v:
+            v = v["symbol"]
+        if isinstance(v, str):
+            symbols.add(v)
+        elif isinstance(v, dict):
+            symbols.update(s for sheet, s in v.items() if sheet != "*")
+            if "*" in v:
+                prefixes.append(v["*"])
+    return symbols, prefixes
+
+
+def check_regex(regex, where: str, errors: list):
+    if not isinstance(regex, str):
+        errors.append(f"{where}: 正则应为字符串, 实际为 {regex!r}")
+        return
+    try:
+        re.compile(regex, flags=re.IGNORECASE)
+    except re.error as e:
+        errors.append(f"{where}: 正则 '{regex}' 有误: {e}")
+
+
+def check_and_rules(rules, where: str, errors: list):
+    """[{列名: 正则, ...}, ...], 同一个字典中的条件同时满足"""
+    if not isinstance(rules, list) or not all(isinstance(rule, dict) for rule in rules):
+        errors.append(f"{where}: 应为 [{{列名: 正则, ...}}, ...]")
+        return
+    for rule in rules:
+        for column, regex in rule.items():
+            check_regex(regex, f"{where} 列 '{column}'", errors)
+
+
+def check_rules(name: str, rules, where: str, errors: list):
+    """检查动作 name 的规则参数(见 RULE_KEYS)的结构和其中的正则"""
+    key = RULE_KEYS[name]
+    if name in ("rm_row", "split"):
+        check_and_rules(rules, f"{where} {key}", errors)
+    elif name in ("add_row", "alter_val"):
+        if not isinstance(rules, dict) or not all(isinstance(v, dict) for v in rules.values()):
+            errors.append(f"{where} {key}: 应为 {{列名: {{正则: ...}}}}")
+            return
+        for column, by_value in rules.items():
+            for regex, new in by_value.items():
+                check_regex(regex, f"{where} {key} 列 '{column}'", errors)
+                if name == "add_row" and not (isinstance(new, list) and all(isinstance(row, dict) for row in new)):
+                    errors.append(f"{where} {key} 列 '{column}' 正则 '{regex}': 新行应为 [{{列名: 值}}, ...]")
+                elif name == "alter_val" and not isinstance(new, dict):
+                    errors.append(f"{where} {key} 列 '{column}' 正则 '{regex}': 改值应为 {{列名: 值}}")
+    elif name == "add_col":
+        if not isinstance(rules, dict) or not all(isinstance(v, dict) for v in rules.values()):
+            errors.append(f"{where} add_rules: 应为 {{新列名: {{值: [{{列名: 正则}}, ...]}}}}")
+            return
+        for add_column, values in rules.items():
+            for value, and_rules in values.items():
+                check_and_rules(and_rules, f"{where} add_rules 列 '{add_column}' 值 '{value}'", errors)
+    elif name == "format":
+        if not isinstance(rules, dict):
+            errors.append(f"{where} format_rules: 应为 {{操作: [...]}}")
+            return
+        for action, items in rules.items():
+            kind = action.lower()
+            if kind not in ("copy", "constant", "concat", "none"):
+                errors.append(f"{where} format_rules: 未知的操作 '{action}', 可选 copy, constant, concat, None")
+            elif kind in ("copy", "constant") and not all(isinstance(i, list) and len(i) == 2 for i in items):
+                errors.append(f"{where} format_rules {action}: 每项应为 [列名, {'原列名' if kind == 'copy' else '值'}]")
+            elif kind == "concat" and not all(isinstance(i, list) and len(i) >= 2 for i in items):
+                errors.append(f"{where} format_rules {action}: 每项应为 [列名, 原列名, ...]")
+
+
+def check_signature(name: str, signature, where: str, available: set, prefixes: list, errors: list):
+    """检查签名, 返回输出的符号(签名有误时为空)"""
+    if not isinstance(signature, str) or signature.count("->") != 1:
+        errors.append(f"{where}: 签名 df 应为 \"输入,...->输出,...\", 实际为 {signature!r}")
+        return []
+    input, output = [[i.strip() for i in part.split(",")] for part in signature.split("->")]
+    n_input, n_output = SIGNATURES.get(name, (1, 1))
+    for kind, symbols, n in (("输入", input, n_input), ("输出", output, n_output)):
+        if "" in symbols:
+            errors.append(f"{where}: 签名 '{signature}' 中有空的{kind}")
+        elif n is not None and len(symbols) != n:
+            errors.append(f"{where}: 签名 '{signature}' 的{kind}应有 {n} 个, 实际为 {len(symbols)} 个")
+    for symbol in input:
+        if symbol and symbol not in available and not any(symbol.startswith(p) for p in prefixes):
+            errors.append(f"{where}: 输入 '{symbol}' 既不是 files 中的符号, 也不是之前的动作的输出")
+    return [i for i in output if i and i != "None"]
+
+
+@functools.lru_cache(maxsize=None)
+def has_pyarrow():
+    """是否安装了 pyarrow(只查找, 不导入)"""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def check_export_format(fmt, where: str, errors: list):
+    if fmt not in EXPORT_FORMATS:
+        errors.append(f"{where} 应为 {', '.join(EXPORT_FORMATS)} 之一, 实际为 {fmt!r}")
+    elif fmt in ARROW_FORMATS and not has_pyarrow():
+        errors.append(f"{where} 为 '{fmt}', 需要安装 pyarrow(pip install pyarrow)")
+
+
+def check_action_loop(config: dict) -> list:
+    """检查 action_loop 配置, 返回错误列表(没有错误时为空)"""
+    errors = []
+    files, actions = config.get("files"), config.get("actions")
+    if not isinstance(files, dict):
+        errors.append("files 应为 {文件名: 符号}")
+        files = {}
+    if not isinstance(actions, dict):
+        return errors + ["actions 应为 {编号: {动作代码: 参数}}"]
+    available, prefixes = defined_symbols(files)
+    options = config.get("options") or {}
+    if isinstance(options, dict):
+        check_export_format(options.get("export_format", "xlsx"), "选项 export_format", errors)
+
+    steps = []
+    for number, group in actions.items():
+        if not str(number).strip().lstrip("-").isdigit():
+            errors.append(f"动作编号 '{number}' 应为整数")
+        elif not isinstance(group, dict):
+            errors.append(f"动作 {number}: 应为 {{动作代码: 参数}}")
+        else:
+            steps.append((int(number), number, group))
+    # 与 Logic.get_actions 相同的执行顺序
+    for _, number, group in sorted(steps, key=lambda x: x[0]):
+        for action_code, details in group.items():
+            name = action_name(action_code)
+            where = f"动作 {number}.{action_code}"
+            if name not in REQUIRED_KEYS:
+                errors.append(f"{where}: 未知的动作代码, 可选 {', '.join(ACTION_NAMES)} 或 {', '.join(REQUIRED_KEYS)}")
+                continue
+            if not isinstance(details, dict):
+                errors.append(f"{where}: 参数应为字典")
+                continue
+            where = f"{where} '{details.get('df', '')}'"
+            missing = [key for key in REQUIRED_KEYS[name] if key not in details]
+            if missing:
+                errors.append(f"{where}: 缺少参数 {', '.join(missing)}")
+            for key in LIST_KEYS:
+                if key in details and not isinstance(details[key], list):
+                    errors.append(f"{where}: 参数 {key} 应为列名列表")
+            if "df" in details:
+                available.update(check_signature(name, details["df"], where, available, prefixes, errors))
+            if name == "export":
+                check_export_format(details.get("format", "xlsx"), f"{where}: 格式 format", errors)
+            if RULE_KEYS.get(name) in details:
+                check_rules(name, details[RULE_KEYS[name]], where, errors)
+    return errors
+
+
+def check_main(config: dict) -> list:
+    """检查主配置 config/config.jsonc: {功能名: {"func", "config"}}"""
+    errors = []
+    for func_name, details in config.items():
+        if not isinstance(details, dict):
+            errors.append(f"功能 '{func_name}': 应为 {{\"func\": ..., \"config\": ...}}")
+        elif details.get("func") not in FUNCS:
+            errors.append(f"功能 '{func_name}': func 应为 {', '.join(FUNCS)} 之一, 实际为 {details.get('func')!r}")
+        elif not isinstance(details.get("config"), str):
+            errors.append(f"功能 '{func_name}': 缺少配置文件路径 config")
+    return errors
+
+
+def compile_config(data) -> dict:
+    """编译(检查)一个配置文件的内容: action_loop 配置或主配置, 其他内容不检查"""
+    if not isinstance(data, dict):
+        return {"errors": ["配置应为 JSON 对象"]}
+    if "files" in data or "actions" in data:
+        return {"errors": check_action_loop(data)}
+    if data and all(isinstance(v, dict) and "func" in v for v in data.values()):
+        return {"errors": check_main(data)}
+    return {"errors": []}
+
+
+def read_config(fpath: str):
+    """读取并检查配置文件, 返回 (配置, 错误列表); 文件不变时使用缓存的解析和检查结果"""
+    # 检查结果与是否安装了 pyarrow 有关, 安装后缓存的结果失效
+    result = read_compiled(fpath, compile_config, f"{code_version()}:pyarrow={has_pyarrow()}")
+    return result["data"], result["errors"]
+
+
+def describe(errors: list, limit=20):
+    lines = [f"  {e}" for e in errors[:limit]]
+    if len(errors) > limit:
+        lines.append(f"  ... 共 {len(errors)} 处错误")
+    return "\n".join(lines)
+
+
+def validate(config: dict, name="action_loop"):
+    """检查 action_loop 配置, 有错误时记录全部错误并退出(在读取任何表格之前调用)"""
+    errors = check_action_loop(config)
+    if errors:
+        log(f"【检查配置】{name} 配置有误, 未执行任何动作:\n{describe(errors)}", level='error')
+        exit(1)
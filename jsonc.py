@@ -0,0 +1,94 @@
+import hashlib
+import json as std_json
+import os
+import json5 as json
+from log import log
+from sys import exit
+
+"""
+配置文件(JSONC)的读取, 不依赖 pandas, 界面启动时可以直接使用。
+
+json5 是纯 Python 的解析器, 较慢。解析(和编译)的结果以文件内容的哈希为键, 用标准 json 格式缓存在 cache/config,
+文件内容不变时不再用 json5 解析; 同一进程中文件的修改时间和大小不变时不再读取文件。
+"""
+
+CACHE_DIR = "cache/config"
+# 缓存文件的数量上限, 超出时删除最久未使用的
+MAX_ENTRIES = 64
+
+_compiled = {}  # 绝对路径 -> ((修改时间, 大小, 编译版本), 编译结果的 json 文本)
+
+
+def _cache_file(key: str):
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def _save(key: str, text: str):
+    """写入缓存, 失败只记录警告"""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = _cache_file(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        entries = sorted((e for e in os.scandir(CACHE_DIR) if e.name.endswith('.json')),
+                         key=lambda e: e.stat().st_mtime)
+        for entry in entries[:-MAX_ENTRIES]:
+            os.remove(entry.path)
+    except OSError as e:
+        log(f"【配置缓存】写入失败 '{key}': {e}", level='warning')
+
+
+def compile_json(fpath, compile=None, version=""):
+    """
+    读取并编译 JSONC 文件, 返回 (编译结果, 是否命中缓存)。编译结果为 {"data": 解析结果, **compile(解析结果)},
+    compile 的结果必须能用 json 序列化; version 表示 compile 的版本, 它改变时已有的缓存失效。
+    每次返回新的对象, 调用者可以修改。文件不存在或格式有误时抛出异常
+    """
+    path = os.path.abspath(fpath)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size, version)
+    item = _compiled.get(path)
+    if item is not None and item[0] == stamp:
+        return std_json.loads(item[1]), True
+
+    with open(path, 'rb') as file:
+        raw = file.read()
+    h = hashlib.blake2b(raw, digest_size=16)
+    h.update(f"\n{json.__version__}\n{version}".encode('utf-8'))
+    key = h.hexdigest()
+    try:
+        with open(_cache_file(key), 'r', encoding='utf-8') as f:
+            text = f.read()
+        result, hit = std_json.loads(text), True
+        os.utime(_cache_file(key))  # 更新最近使用时间
+    except (OSError, ValueError):
+        data = json.loads(raw.decode('utf-8'))
+        result, hit = {"data": data, **(compile(data) if compile else {})}, False
+        text = std_json.dumps(result, ensure_ascii=False)
+        _save(key, text)
+    _compiled[path] = (stamp, text)
+    return result, hit
+
+
+def read_compiled(fpath, compile=None, version="") -> dict:
+    """同 compile_json, 只返回编译结果; 文件不存在或格式有误时记录错误并退出"""
+    try:
+        result, hit = compile_json(fpath, compile, version)
+    except FileNotFoundError:
+        log(f"文件 '{fpath}' 未找到。", level='error')
+        exit(1)
+    except Exception as e:
+        log(f"文件 '{fpath}' 不是有效的JSON5格式。详细信息如下：{e}", level='error')
+        exit(1)
+    if hit:
+        log(f"读取文件 '{fpath}': 内容未修改, 使用缓存的解析结果", level='info')
+    else:
+        log(f"读取文件 '{fpath}': \n{result['data']}", level='info')
+    return result
+
+
+"""加载并解析JSONC配置文件"""
+def read_json(fpath)->dict:
+    return read_compiled(fpath)["data"]
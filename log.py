@@ -1,7 +1,8 @@
 import logging
 from sys import stdout
-import pandas as pd
 import os
+from datetime import datetime
+from itertools import count
 
 # 自定义过滤器类，用于限制只记录特定级别的日志
 class LogLevelFilter(logging.Filter):
@@ -11,25 +12,40 @@ class LogLevelFilter(logging.Filter):
     def filter(self, record):
         return record.levelno == self.level
 
+# pandas 在使用时才导入, 界面启动时不加载
 def apply_pd_settings():
+    import pandas as pd
     pd.set_option('display.max_rows', None)  # 显示所有行
     pd.set_option('display.max_columns', None)  # 显示所有列
     pd.set_option('display.width', None)  # 取消列宽限制
     pd.set_option('display.max_colwidth', None)  # 显示完整列内容 
 
 def restore_pd_settings():
+    import pandas as pd
     pd.reset_option('display.max_rows')
     pd.reset_option('display.max_columns')
     pd.reset_option('display.width')
     pd.reset_option('display.max_colwidth')
 
+# 日志记录器, 处理器由 setup_logger(界面)或 setup_job_logger(命令行批处理)添加, 导入时不创建任何文件
+logger = logging.getLogger('my_logger')
+formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s\n')
+
+
+def remove_handlers():
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
 def setup_logger():
     # 创建相关文件夹
     os.makedirs("data",exist_ok=True)
     os.makedirs("log", exist_ok=True)
     os.makedirs("config", exist_ok=True)
-    # 创建日志记录器
-    logger = logging.getLogger('my_logger')
+    # 重复调用时先移除之前的处理器
+    remove_handlers()
+    prune_rows_files()
     logger.setLevel(logging.INFO)  # 设置最低日志级别为DEBUG
     
     # 创建处理器并设置日志级别
@@ -43,8 +59,7 @@ def setup_logger():
     console_handler = logging.StreamHandler(stdout)
     console_handler.setLevel(logging.INFO)
     
-    # 创建格式化器并将它们添加到处理器
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s : %(message)s\n')
+    # 将格式化器添加到处理器
     simple_handler.setFormatter(formatter)
     standard_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
@@ -53,14 +68,20 @@ def setup_logger():
     logger.addHandler(simple_handler)
     logger.addHandler(standard_handler)
     logger.addHandler(console_handler)
-
-    # pandas 输出设置
-    apply_pd_settings()
     
     return logger
 
-# 配置日志记录器
-logger = setup_logger()
+
+def setup_job_logger(fpath: str, level=logging.INFO):
+    """批处理任务的日志: 只写入 fpath 一个文件(覆写), 不输出到控制台"""
+    os.makedirs(os.path.dirname(fpath) or ".", exist_ok=True)
+    remove_handlers()
+    prune_rows_files()
+    logger.setLevel(level)
+    handler = logging.FileHandler(fpath, mode='w', encoding="utf-8")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    return logger
 
 ######
 # 日志工具函数
@@ -87,17 +108,62 @@ def log(msg: str, level='info'):
         raise ValueError(f"未知的日志级别: {level}")
 
 
+# log_df 最多打印的行数, 超出的行只写入 log/rows 目录下的表格文件
+LOG_MAX_ROWS = 50
+LOG_ROWS_DIR = "log/rows"
+# log/rows 中保留的文件数, 设置日志时删除更早的
+LOG_ROWS_KEEP = 200
+_rows_file_id = count(1)
+
+
+def prune_rows_files(keep=None):
+    """删除 LOG_ROWS_DIR 中除最新的 keep 个以外的表格文件"""
+    keep = LOG_ROWS_KEEP if keep is None else keep
+    try:
+        files = sorted((e for e in os.scandir(LOG_ROWS_DIR) if e.name.endswith('.pkl')),
+                       key=lambda e: e.stat().st_mtime)
+        for entry in files[:max(len(files) - keep, 0)]:
+            os.remove(entry.path)
+    except OSError:
+        pass
+
+
+def log_enabled(level='info'):
+    """日志级别 level 是否启用; 未启用时调用者可以跳过只用于日志的计算"""
+    levelno = logging.getLevelName(level.upper())
+    if not isinstance(levelno, int):
+        raise ValueError(f"未知的日志级别: {level}")
+    return logger.isEnabledFor(levelno)
+
+
 # 打印 DataFrame
-def log_df(df: pd.DataFrame, prefix='DataFrame内容:', level='info'):
+def log_df(df: 'pd.DataFrame', prefix='DataFrame内容:', level='info'):
     """
     打印DataFrame的信息到日志文件中。
+    日志级别未启用时不做任何格式化; 行数超过 LOG_MAX_ROWS 时只打印前 LOG_MAX_ROWS 行和总行数,
+    完整的表格写入 LOG_ROWS_DIR 下的 pickle 文件, 可用 pd.read_pickle 读取。
     
     参数:
     df (pd.DataFrame): 要打印的DataFrame。
     level (str): 日志级别('debug', 'info', 'warning', 'error')。
     """
+    if not log_enabled(level):
+        return
+
     # 将DataFrame转换为字符串以便于日志记录
-    df_string = f'{prefix}\n{df.to_string()}'
+    if df.shape[0] <= LOG_MAX_ROWS:
+        df_string = f'{prefix}\n{df.to_string()}'
+    else:
+        # 文件名中包含进程号, 多个进程(批处理任务)同时写入时不会重名
+        fpath = os.path.join(LOG_ROWS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_"
+                                           f"{next(_rows_file_id)}.pkl")
+        try:
+            os.makedirs(LOG_ROWS_DIR, exist_ok=True)
+            df.to_pickle(fpath)
+        except Exception as e:
+            fpath = f"写入失败: {e}"
+        df_string = f'{prefix}\n{df.head(LOG_MAX_ROWS).to_string()}\n' \
+                    f'... 共 {df.shape[0]} 行, 仅显示前 {LOG_MAX_ROWS} 行, 完整内容见 {fpath}'
     log(df_string, level)
     
     
@@ -1,23 +1,51 @@
-from utils import read_excel, inteprete, compare_df
+from utils import read_excel, read_excel_chunks, read_excel_sheets, excel_sheet_info, inteprete, compare_df
 from tool import *
 from sys import exit
+import pandas as pd
 import os
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import cache
+import action_cache
+import compact
+import scheduler
+import profiler
+import config_check
+# 只逐行处理数据的动作, 可以分块流式执行
+ROW_LOCAL_ACTIONS = {"rm_row", "alter_val", "add_col", "split", "format", "add_row"}
+# 支持就地修改输入(inplace)的动作, 免复制模式下输入表不再被使用时不复制
+INPLACE_ACTIONS = {"fill", "eq_sum", "alter_val", "split", "add_col"}
 
-class Logic:
-    @staticmethod
-    def select_file():
-        """选择文件并返回文件路径"""
-        import tkinter.filedialog as filedialog
-        file_path = filedialog.askopenfilename(title="选择文件", initialdir="data")
-        return file_path
 
-    @staticmethod
-    def show_file_path(file_path):
-        """显示文件路径"""
-        import tkinter.messagebox as messagebox
-        if file_path:
-            messagebox.showinfo("文件选择", f"你选择的文件路径是: {file_path}")
+class Cancelled(Exception):
+    """任务被用户取消, 由进度回调在两个动作之间抛出"""
+
+
+def no_progress(done: int, total: int, msg: str = ""):
+    """默认的进度回调: 什么也不做。
+    进度回调 progress(已完成数, 总数, 说明) 在每个动作(或比较的每个阶段)之前调用,
+    可以抛出 Cancelled 来取消任务。
+    """
+
+class ExportPool:
+    """在后台线程中执行 export 的写入; wait 等待全部写完, 并记录写入时的异常"""
+    def __init__(self, threads: int):
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="export")
+        self.futures = []
+
+    def submit(self, fn, *args):
+        self.futures.append(self.pool.submit(fn, *args))
+
+    def wait(self):
+        if self.futures:
+            log(f"【写表】等待后台写入完成: {len(self.futures)} 个表", level='info')
+        self.pool.shutdown(wait=True)
+        for future in self.futures:
+            if future.exception() is not None:
+                log(f"【写表】后台写入出错: {future.exception()}", level='error')
+
 
+class Logic:
     @staticmethod
     def check_paths_validity(files_list):
         invalid_paths = []
@@ -27,77 +55,434 @@ class Logic:
         return invalid_paths
 
     @staticmethod
-    def compare(df1, df2, sort_columns):
+    def compare(df1, df2, sort_columns, engine="merge", progress=no_progress, profile=False):
+        """profile 为 True 时记录比较各阶段的耗时, 报告写入 log/(见 profiler.py)"""
         try:
-            df_eq, comparison = compare_df(df1, df2, sort_columns)
+            with profiler.run("compare", profile):
+                df_eq, comparison = compare_df(df1, df2, sort_columns, engine, progress)
             return df_eq, comparison
+        except Cancelled:
+            raise
         except Exception as e:
             log(f"【比较两个表格】未知错误: {e}", level="error")
             exit(1)
 
     @staticmethod
-    def action_loop(config: dict):
+    def compare_files(fpath1, fpath2, sort_columns, columns, write, options=None, progress=no_progress):
+        """分区比较两个表格文件(不把整表读入内存), 见 partition.compare_files"""
+        import partition
+        options = options if options else {}
+        try:
+            return partition.compare_files(fpath1, fpath2, sort_columns, columns, write,
+                                           n_partitions=options.get("partitions", 16),
+                                           processes=options.get("processes", 0),
+                                           engine=options.get("engine", "merge"),
+                                           chunksize=options.get("chunksize", 0) or 50000,
+                                           progress=progress)
+        except Cancelled:
+            raise
+        except Exception as e:
+            log(f"【分区比较】未知错误: {e}", level="error")
+            exit(1)
+
+    @staticmethod
+    def action_loop(config: dict, progress=no_progress):
+        """
+        执行前先检查配置(见 config_check.py), 有误时在读取任何表格之前退出。
+        选项 profile 为 true 时记录每个动作和规则的耗时, 报告写入 log/(见 profiler.py)。
+        选项 preview 为 true 时 export 不写出 xlsx, 返回 {文件名: DataFrame} 供程序内查看; 否则返回 None。
+        选项 export_threads 大于 0 时 export 在该数量的后台线程中写入, 之后的动作不等待, 全部动作结束后等待写完
+        """
+        config_check.validate(config)
+        options = config.get("options", {})
+        use_cache = Logic.apply_cache_options(options)
+        previews = {} if options.get("preview", False) else None
+        exports = ExportPool(options["export_threads"]) \
+            if options.get("export_threads", 0) > 0 and previews is None else None
+        if previews is not None or exports is not None:
+            # export 把表收集到 options["previews"] 中或交给 options["export_submit"] 写入,
+            # 各种执行方式都把 options 传给 run_action
+            config = {**config, "options": {**options, "previews": previews,
+                                            "export_submit": exports.submit if exports else None}}
+        try:
+            with profiler.run("action_loop", options.get("profile", False)):
+                if options.get("chunksize", 0) > 0 or options.get("workers", 0) > 0:
+                    if options.get("action_cache", False):
+                        log("【结果缓存】action_cache 只在顺序执行时有效, 已忽略", level='warning')
+                    if options.get("chunksize", 0) > 0:
+                        Logic.action_loop_stream(config, options["chunksize"], use_cache, progress)
+                    else:
+                        Logic.action_loop_parallel(config, options["workers"], use_cache, progress)
+                else:
+                    Logic.action_loop_sequential(config, use_cache, progress)
+        finally:
+            if exports is not None:
+                exports.wait()
+        return previews
+
+    @staticmethod
+    def action_loop_sequential(config: dict, use_cache=True, progress=no_progress):
+        options = config.get("options", {})
+        steps = Logic.get_actions(config)
+        files = Logic.get_files(config)
+        total, done = len(files) + len(steps), 0
+        copy_free = options.get("copy_free", False)
+        inplace_count, saved = 0, 0
+        # 结果缓存: 输入表格和命中缓存的动作结果在被使用时才读取
+        results = Logic.apply_action_cache_options(options, use_cache)
+
         df_dict = {}
-        for k, v in config["files"].items():
-            df_dict[v["symbol"]] = read_excel(v["path"])
+        for path, sheets in files.items():
+            progress(done, total, f"读取{os.path.basename(path)}")
+            if results is not None:
+                for symbol, sheet in sheets.items():
+                    results.add_file(symbol, path, sheet)
+            else:
+                df_dict.update(Logic.read_files(path, sheets, use_cache, options.get("sheet_processes"),
+                                                options.get("compact", False)))
+            done += 1
+
+        # 根据配置文件中的动作处理 DataFrame
+        for i, (action_code, details) in enumerate(steps):
+            progress(done, total, f"{action_code} {details.get('df', '')}")
+            done += 1
+            if results is not None:
+                key = results.key(Logic.action_name(action_code), details)
+                if results.restore(key, Logic.action_name(action_code), details, df_dict):
+                    continue
+                results.materialize(details, df_dict)
+            inplace = copy_free and Logic.is_owned(details, steps[i + 1:], df_dict)
+            nbytes = Logic.run_action(action_code, details, df_dict, options, inplace)
+            if nbytes:
+                inplace_count, saved = inplace_count + 1, saved + nbytes
+            if results is not None:
+                results.store(key, Logic.action_name(action_code), details, df_dict)
+            if copy_free:
+                Logic.drop_dead(steps[i + 1:], df_dict)
+        if copy_free:
+            Logic.log_copy_free(inplace_count, saved)
+        if results is not None:
+            results.summary()
+        progress(total, total, "完成")
+
+    @staticmethod
+    def is_used_later(symbol: str, later_steps: list):
+        """symbol 的当前值是否会被之后的动作读取(在被重新赋值之前)"""
+        for _, details in later_steps:
+            input, output = inteprete(details["df"])
+            if symbol in input:
+                return True
+            if symbol in output:
+                return False
+        return False
+
+    @staticmethod
+    def is_owned(details: dict, later_steps: list, df_dict: dict):
+        """动作的输入表之后不再被读取, 并且没有其他符号指向同一个表时, 动作可以就地修改它"""
+        input, output = inteprete(details["df"])
+        symbol = input[0]
+        if symbol not in df_dict:
+            return False
+        if symbol not in output and Logic.is_used_later(symbol, later_steps):
+            return False
+        return sum(df is df_dict[symbol] for df in df_dict.values()) == 1
+
+    @staticmethod
+    def drop_dead(later_steps: list, df_dict: dict):
+        """释放之后不再被读取的表"""
+        for symbol in [s for s in df_dict if not Logic.is_used_later(s, later_steps)]:
+            del df_dict[symbol]
+
+    @staticmethod
+    def log_copy_free(inplace_count: int, saved: int):
+        log(f"【免复制】原地执行 {inplace_count} 个动作, 节省复制 {scheduler.format_bytes(saved)}", level='info')
+
+    @staticmethod
+    def apply_cache_options(options: dict):
+        """应用缓存相关选项, 返回是否使用缓存"""
+        if "cache_max_mb" in options:
+            cache.set_max_bytes(int(options["cache_max_mb"] * 1024 * 1024))
+        return not options.get("bypass_cache", False)
+
+    @staticmethod
+    def apply_action_cache_options(options: dict, use_cache=True):
+        """应用结果缓存相关选项, 启用时返回 action_cache.Results, 否则返回 None"""
+        if not options.get("action_cache", False):
+            return None
+        if "action_cache_max_mb" in options:
+            action_cache.set_max_bytes(int(options["action_cache_max_mb"] * 1024 * 1024))
+        compact_types = options.get("compact", False)
+        return action_cache.Results(partial(Logic.read_files, use_cache=use_cache, compact_types=compact_types),
+                                    "compact" if compact_types else "")
 
+    @staticmethod
+    def get_files(config: dict):
+        """
+        展开配置中的 files, 返回 {路径: {符号: 工作表}}, 同一个文件的工作表归为一组, 只打开一次。
+        符号为字符串时读取第一个工作表(工作表记为 0); 为 {工作表名: 符号} 时读取其中的每个工作表,
+        其中键 "*" 表示其余的全部工作表, 它的值是符号前缀, 符号为 前缀 + 工作表名
+        """
+        files = {}
+        for v in config["files"].values():
+            sheets = files.setdefault(v["path"], {})
+            if isinstance(v["symbol"], str):
+                sheets[v["symbol"]] = 0
+                continue
+            named = {sheet: symbol for sheet, symbol in v["symbol"].items() if sheet != "*"}
+            for sheet, symbol in named.items():
+                sheets[symbol] = sheet
+            if "*" in v["symbol"]:
+                for sheet in excel_sheet_info(v["path"]):
+                    if sheet not in named:
+                        sheets[f"{v['symbol']['*']}{sheet}"] = sheet
+        return files
+
+    @staticmethod
+    def read_files(path: str, sheets: dict, use_cache=True, processes=None, compact_types=False):
+        """
+        读取一个文件中的工作表, sheets 为 {符号: 工作表}, 返回 {符号: DataFrame}。
+        compact_types 为 True 时压缩列类型(见 compact.py), 并记录每个表压缩前后的内存占用
+        """
+        with profiler.span(f"读取 {os.path.basename(path)}", "read", sheets=list(sheets.values())) as record:
+            dfs = read_excel_sheets(path, list(sheets.values()), use_cache, processes)
+            df_dict, used = {}, set()
+            for symbol, sheet in sheets.items():
+                # 同一个工作表绑定到多个符号时各自一份, export 会就地修改输入表
+                df_dict[symbol] = dfs[sheet].copy() if sheet in used else dfs[sheet]
+                used.add(sheet)
+                if compact_types:
+                    df_dict[symbol] = compact.compact_frame(symbol, df_dict[symbol])
+            if record is not None:
+                record.args["outputs"] = {symbol: profiler.shape(df) for symbol, df in df_dict.items()}
+        return df_dict
+
+    @staticmethod
+    def estimate_input_sizes(files: dict, use_cache=True):
+        """估计各输入表读入后的字节数: 已缓存的取缓存文件的大小, 否则按文件大小和工作表 xml 的占比估计"""
+        input_sizes = {}
+        for path, sheets in files.items():
+            info = excel_sheet_info(path)
+            names, total = list(info), sum(info.values())
+            for symbol, sheet in sheets.items():
+                size = cache.cached_size(path, sheet) if use_cache else None
+                if size is None:
+                    name = names[sheet] if isinstance(sheet, int) and sheet < len(names) else sheet
+                    share = info.get(name, 0) / total if total else 1 / max(len(names), 1)
+                    size = int(os.path.getsize(path) * scheduler.XLSX_EXPANSION * share)
+                input_sizes[symbol] = size
+        return input_sizes
+
+    @staticmethod
+    def get_actions(config: dict):
+        """按编号顺序展开所有动作, 返回 [(action_code, details), ...]"""
         actions_list = sorted(config['actions'].items(), key=lambda x: int(x[0]))
+        return [(action_code, details) for _, actions in actions_list for action_code, details in actions.items()]
 
-        # 根据配置文件中的动作处理 DataFrame
-        for _, actions in actions_list:
-            for action_code, details in actions.items():
-                if action_code == "1" or action_code == "fill":
-                    # 示例：找到重复组，并补充相应列的信息（具体逻辑需要根据需求定制）
-                    by, log_columns = details['by'], details['log_columns']
-                    input, output = inteprete(details['df'])
-                    df_dict[output[0]] = fill(df_dict[input[0]], by, log_columns)
-                elif action_code == "2" or action_code == "eq_sum":
-                    # 示例：找到重复组，再根据判等列判断两行是否相等，若相等则删除，累加列进行累加
-                    by, eq, sum1, log_columns = details['by'], details['eq'], \
-                                                details['sum'], details['log_columns']
-                    input, output = inteprete(details['df'])
-                    df_dict[output[0]] = eq_sum(df_dict[input[0]], by, eq, sum1, log_columns)
-                elif action_code == "3" or action_code == "rm_row":
-                    # 筛选某列的值，移除相应的行
-                    rm_rules, log_columns = details['rm_rules'], details['log_columns']
-                    input, output = inteprete(details['df'])
-                    df_dict[output[0]] = rm_row(df_dict[input[0]], rm_rules, log_columns)
-                elif action_code == "4" or action_code == "add_row":
-                    # 根据某列的值进行筛选，通过规则增加行
-                    add_rules, log_columns = details['add_rules'], details['log_columns']
-                    input, output = inteprete(details['df'])
-                    df_dict[output[0]] = add_row(df_dict[input[0]], add_rules, log_columns)
-                elif action_code == "5" or action_code == "alter_val":
-                    # 根据改列值规则，进行某列的筛选和改值
-                    alter_rules, log_columns = details['alter_rules'], details['log_columns']
-                    input, output = inteprete(details['df'])
-                    df_dict[output[0]] = alter_val(df_dict[input[0]], alter_rules, log_columns)
-                elif action_code == "6" or action_code == "split":
-                    # 分仓
-                    split_rules, extract, log_columns, name = details["split_rules"], \
-                        details["extract"], details["log_columns"], details["name"]
-                    input, output = inteprete(details['df'])
-                    df_dict[output[0]], df_dict[output[1]] = split(df_dict[input[0]], split_rules, extract, log_columns, name)
-                elif action_code == "7" or action_code == "format":
-                    # 格式化表
-                    format_rules, columns, log_columns, name = details["format_rules"], \
-                        details["columns"], details["log_columns"], details["name"]
-                    input, output = inteprete(details['df'])
-                    df_dict[output[0]] = format(df_dict[input[0]], format_rules, columns, log_columns, name)
-                elif action_code == "8" or action_code == "add_col":
-                    # 增加某列
-                    add_rules, log_columns, name = details["add_rules"], details["log_columns"], details["name"]
-                    input, output = inteprete(details['df'])
-                    df_dict[output[0]] = add_col(df_dict[input[0]], add_rules, log_columns, name)
-                elif action_code == "9" or action_code == "export":
-                    # 导出表格
-                    export_dtype, name, suffix, count_cols = details["export_dtype"], \
-                        details["name"], details["suffix"], details["count_cols"]
-                    input, output = inteprete(details['df'])
-                    export(df_dict[input[0]], export_dtype, name, suffix, count_cols)
-                elif action_code == "10" or action_code == "concat_df":
-                    # 合并表格
-                    axis = details["axis"]  # 横向: 1  纵向: 0
-                    input, output = inteprete(details["df"])
-                    input = [df_dict[i] for i in input]
-                    df_dict[output[0]] = concat_df(input, axis)
\ No newline at end of file
+    @staticmethod
+    def action_name(action_code: str):
+        """动作代码可以是编号或名字, 统一返回名字"""
+        return config_check.action_name(action_code)
+
+    @staticmethod
+    def run_action(action_code: str, details: dict, df_dict: dict, options=None, inplace=False):
+        """
+        执行一个动作, 从 df_dict 中取输入, 并将输出写回 df_dict; options 为配置文件中的选项。
+        inplace 为 True 时允许动作就地修改输入表(由调用者保证输入表不再被使用),
+        返回因此省下的复制字节数, 动作不支持就地修改时返回 0。
+        剖析时(profiler.run)记录动作的耗时和输入、输出表的行列数。
+        """
+        if not profiler.active():
+            return Logic.dispatch_action(action_code, details, df_dict, options, inplace)
+        input, output = inteprete(details['df'])
+        with profiler.span(f"{Logic.action_name(action_code)} {details['df']}", "action",
+                           inputs={i: profiler.shape(df_dict.get(i)) for i in input}) as record:
+            saved = Logic.dispatch_action(action_code, details, df_dict, options, inplace)
+            record.args["outputs"] = {i: profiler.shape(df_dict.get(i)) for i in output if i != "None"}
+            record.args["inplace"] = bool(saved)
+        return saved
+
+    @staticmethod
+    def dispatch_action(action_code: str, details: dict, df_dict: dict, options=None, inplace=False):
+        """按动作代码调用 tool.py 中的动作, 参数和返回值同 run_action"""
+        options = options if options else {}
+        saved = 0
+        if inplace and Logic.action_name(action_code) in INPLACE_ACTIONS:
+            saved = int(df_dict[inteprete(details['df'])[0][0]].memory_usage(deep=False).sum())
+        else:
+            inplace = False
+        if action_code == "1" or action_code == "fill":
+            # 示例：找到重复组，并补充相应列的信息（具体逻辑需要根据需求定制）
+            by, log_columns = details['by'], details['log_columns']
+            input, output = inteprete(details['df'])
+            df_dict[output[0]] = fill(df_dict[input[0]], by, log_columns, inplace)
+        elif action_code == "2" or action_code == "eq_sum":
+            # 示例：找到重复组，再根据判等列判断两行是否相等，若相等则删除，累加列进行累加
+            by, eq, sum1, log_columns = details['by'], details['eq'], \
+                                        details['sum'], details['log_columns']
+            input, output = inteprete(details['df'])
+            df_dict[output[0]] = eq_sum(df_dict[input[0]], by, eq, sum1, log_columns, inplace)
+        elif action_code == "3" or action_code == "rm_row":
+            # 筛选某列的值，移除相应的行
+            rm_rules, log_columns = details['rm_rules'], details['log_columns']
+            input, output = inteprete(details['df'])
+            df_dict[output[0]] = rm_row(df_dict[input[0]], rm_rules, log_columns)
+        elif action_code == "4" or action_code == "add_row":
+            # 根据某列的值进行筛选，通过规则增加行
+            add_rules, log_columns = details['add_rules'], details['log_columns']
+            input, output = inteprete(details['df'])
+            df_dict[output[0]] = add_row(df_dict[input[0]], add_rules, log_columns)
+        elif action_code == "5" or action_code == "alter_val":
+            # 根据改列值规则，进行某列的筛选和改值
+            alter_rules, log_columns = details['alter_rules'], details['log_columns']
+            input, output = inteprete(details['df'])
+            df_dict[output[0]] = alter_val(df_dict[input[0]], alter_rules, log_columns, inplace)
+        elif action_code == "6" or action_code == "split":
+            # 分仓
+            split_rules, extract, log_columns, name = details["split_rules"], \
+                details["extract"], details["log_columns"], details["name"]
+            input, output = inteprete(details['df'])
+            df_dict[output[0]], df_dict[output[1]] = split(df_dict[input[0]], split_rules, extract, log_columns, name, inplace)
+        elif action_code == "7" or action_code == "format":
+            # 格式化表
+            format_rules, columns, log_columns, name = details["format_rules"], \
+                details["columns"], details["log_columns"], details["name"]
+            input, output = inteprete(details['df'])
+            df_dict[output[0]] = format(df_dict[input[0]], format_rules, columns, log_columns, name)
+        elif action_code == "8" or action_code == "add_col":
+            # 增加某列
+            add_rules, log_columns, name = details["add_rules"], details["log_columns"], details["name"]
+            input, output = inteprete(details['df'])
+            df_dict[output[0]] = add_col(df_dict[input[0]], add_rules, log_columns, name, inplace)
+        elif action_code == "9" or action_code == "export":
+            # 导出表格
+            export_dtype, name, suffix, count_cols = details["export_dtype"], \
+                details["name"], details["suffix"], details["count_cols"]
+            input, output = inteprete(details['df'])
+            export(df_dict[input[0]], export_dtype, name, suffix, count_cols, options.get("stream_write", False),
+                   details.get("format", options.get("export_format", "xlsx")), options.get("previews"),
+                   options.get("export_submit"))
+        elif action_code == "10" or action_code == "concat_df":
+            # 合并表格
+            axis = details["axis"]  # 横向: 1  纵向: 0
+            input, output = inteprete(details["df"])
+            input = [df_dict[i] for i in input]
+            df_dict[output[0]] = concat_df(input, axis)
+        return saved
+
+    @staticmethod
+    def action_loop_parallel(config: dict, workers: int, use_cache=True, progress=no_progress):
+        """
+        按动作签名构建数据流图, 在 workers 个线程中并行执行互不依赖的分支,
+        中间表在最后一个使用者执行完后立即释放。执行前打印执行计划和估计的内存峰值。
+        免复制模式下, 输入版本只有一个使用者的动作就地修改输入。
+        """
+        options = config.get("options", {})
+        copy_free = options.get("copy_free", False)
+        files = Logic.get_files(config)
+        nodes = scheduler.build_plan(files, Logic.get_actions(config), Logic.action_name)
+        counts = scheduler.consumer_counts(nodes)
+        saved = []
+
+        input_sizes = Logic.estimate_input_sizes(files, use_cache)
+        log(scheduler.describe_plan(nodes, input_sizes, workers, Logic.action_name), level='info')
+
+        def execute(node, inputs):
+            if node.action_code == "load":
+                return Logic.read_files(node.details["path"], node.details["sheets"], use_cache,
+                                        options.get("sheet_processes"), options.get("compact", False))
+            df_dict = dict(inputs)
+            inplace = copy_free and len(node.inputs) == 1 and counts[node.inputs[0]] == 1
+            nbytes = Logic.run_action(node.action_code, node.details, df_dict, options, inplace)
+            if nbytes:
+                saved.append(nbytes)
+            return {key[0]: df_dict[key[0]] for key in node.outputs}
+
+        done = [0]
+
+        def on_done(node):
+            done[0] += 1
+            progress(done[0], len(nodes), f"{node.label()} 已完成")
+
+        progress(0, len(nodes), "开始执行")
+        # 线程池中的动作记录到本线程的剖析中
+        scheduler.run_plan(nodes, profiler.bind(execute), workers, on_done)
+        if copy_free:
+            Logic.log_copy_free(len(saved), sum(saved))
+
+    @staticmethod
+    def action_loop_stream(config: dict, chunksize: int, use_cache=True, progress=no_progress):
+        """
+        分块流式执行。连续的逐行动作(ROW_LOCAL_ACTIONS)组成一段, 段内按块依次执行,
+        只有段后还要用到的表才会被收集并拼接; 其余动作(fill, eq_sum, concat_df, export)
+        需要整表, 作为屏障在执行前把输入完整读入。
+        注意: add_row 在每块的末尾追加新行, 因此新行的位置与整表执行时不同。
+        """
+        # 逐个工作表分块读取, 所以这里每个工作表单独打开文件
+        files = {symbol: (path, sheet) for path, sheets in Logic.get_files(config).items()
+                 for symbol, sheet in sheets.items()}
+        df_dict = {}
+        steps = Logic.get_actions(config)
+
+        def load(symbol):
+            if symbol not in df_dict and symbol in files:
+                df_dict[symbol] = read_excel(*files[symbol], use_cache=use_cache)
+
+        i = 0
+        while i < len(steps):
+            if Logic.action_name(steps[i][0]) not in ROW_LOCAL_ACTIONS:
+                # 屏障: 需要整表的动作
+                progress(i, len(steps), f"{steps[i][0]} {steps[i][1]['df']}")
+                for symbol in inteprete(steps[i][1]["df"])[0]:
+                    load(symbol)
+                Logic.run_action(steps[i][0], steps[i][1], df_dict, config.get("options"))
+                i += 1
+                continue
+
+            j = i
+            while j < len(steps) and Logic.action_name(steps[j][0]) in ROW_LOCAL_ACTIONS:
+                j += 1
+            Logic.run_segment(steps[i:j], steps[j:], df_dict, files, chunksize, use_cache,
+                              partial(progress, i, len(steps)), config.get("options"))
+            i = j
+        progress(len(steps), len(steps), "完成")
+
+    @staticmethod
+    def run_segment(segment: list, later_steps: list, df_dict: dict, files: dict, chunksize: int, use_cache=True,
+                    progress=partial(no_progress, 0, 0), options=None):
+        """按块执行一段逐行动作, 将段后还会用到的表拼接后写回 df_dict"""
+        used_later = {symbol for _, details in later_steps for symbol in inteprete(details["df"])[0]}
+
+        # 逐行动作都只有一个输入, 按输入追溯到段外的源表, 每个源表对应一条动作链
+        chains, root_of = {}, {}
+        for action_code, details in segment:
+            input, output = inteprete(details["df"])
+            root = root_of.get(input[0], input[0])
+            chains.setdefault(root, []).append((action_code, details))
+            for symbol in output:
+                root_of[symbol] = root
+
+        for root, chain in chains.items():
+            produced = {symbol for _, details in chain for symbol in inteprete(details["df"])[1]}
+            if root in df_dict:
+                # 源表已在内存中(屏障的输出), 按行切片
+                source = df_dict[root]
+                chunks = (source.iloc[k:k + chunksize] for k in range(0, max(source.shape[0], 1), chunksize))
+                keep = produced & used_later
+            else:
+                chunks = read_excel_chunks(files[root][0], chunksize, files[root][1], use_cache)
+                keep = (produced | {root}) & used_later
+            for symbol in produced:
+                df_dict.pop(symbol, None)
+
+            collected = {symbol: [] for symbol in keep}
+            for n, chunk in enumerate(chunks):
+                progress(f"分块执行 {root}: 第{n + 1}块")
+                local = {root: chunk}
+                for action_code, details in chain:
+                    Logic.run_action(action_code, details, local, options)
+                for symbol in keep:
+                    collected[symbol].append(local[symbol])
+
+            for symbol, dfs in collected.items():
+                df = pd.concat(dfs)
+                df_dict[symbol] = df if df.index.is_unique else df.reset_index(drop=True)
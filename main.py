@@ -1,9 +1,31 @@
-from PyQt5.QtWidgets import QApplication
-from qt import MainApp
+import startup
+with startup.stage("import PyQt5"):
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+with startup.stage("import qt"):
+    from qt import MainApp
+from log import setup_logger, log
+import multiprocessing
 import sys
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    mainWin = MainApp()
-    mainWin.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    # 打包后的程序在子进程(分区比较的 processes 选项)中不重新启动界面
+    multiprocessing.freeze_support()
+    # --startup-report: 预热完成后把启动耗时打印到控制台并退出
+    report_only = "--startup-report" in sys.argv
+    with startup.stage("setup_logger"):
+        setup_logger()
+    with startup.stage("QApplication"):
+        app = QApplication(sys.argv)
+    with startup.stage("MainApp"):
+        mainWin = MainApp()
+    with startup.stage("show"):
+        mainWin.show()
+    # 事件循环开始后(窗口已显示)再预热数据处理相关的模块
+    def warm_up():
+        log(f"【启动耗时】窗口已显示, 用时 {startup.time.perf_counter() - startup.START:.3f} 秒", level='info')
+        job = mainWin.warm_up()
+        if report_only:
+            job.signals.finished.connect(lambda _: (print(startup.report()), app.quit()))
+    QTimer.singleShot(0, warm_up)
+    sys.exit(app.exec_())
@@ -20,6 +20,9 @@ def run_pyinstaller():
         'R:me_R',
         '--add-data',
         'config:me_config',
+        # pandas 在写 parquet/feather 时才导入 pyarrow, 分析不到, 需要显式包含
+        '--hidden-import',
+        'pyarrow',
         '--name', exe_name, 
         '--distpath', "dist", 
         'main.py'
@@ -0,0 +1,168 @@
+import heapq
+import os
+import pickle
+import shutil
+import tempfile
+import pandas as pd
+from log import log
+from utils import read_excel_chunks, compare_df
+
+"""
+超出内存的表格比较(out-of-core)。
+
+1. 分块读取两个表格(read_excel_chunks 先溢出原始的行并确定整表的列类型, 各块的类型与一次性读取时相同)
+2. 按排序列的哈希把每块分到 n 个分区, 每个分区一个溢出文件
+3. 逐个(或在多个进程中)比较两表的同一分区: 同一分组的行一定在同一分区, 且保持原有顺序
+4. 各分区的差异表按排序列稳定排序后写入(loop 引擎按分组集合的顺序输出, 并不有序), 归并后分块产出, 直接流式写入 xlsx
+
+任何时候内存中只有一个分块或一对分区。结果与把整表读入内存比较(compare_df)相同。
+"""
+
+SPILL_DIR = "cache/spill"
+
+
+def _dump_all(fpath: str, frames):
+    """把多个 DataFrame 依次 pickle 到同一个文件"""
+    with open(fpath, 'ab') as f:
+        for df in frames:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_all(fpath: str):
+    """依次读出 _dump_all 写入的 DataFrame"""
+    if not os.path.exists(fpath):
+        return
+    with open(fpath, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def _normalize_columns(df: pd.DataFrame, columns=None):
+    """列名去空(与 check_columns_eq 相同), 并按 columns 选取列"""
+    df.columns = df.columns.astype(str).str.strip()
+    return df if columns is None else df[columns]
+
+
+def partition_chunks(fpath: str, sort_columns: list, n_partitions: int, prefix: str, chunksize: int, columns=None,
+                     progress=None):
+    """
+    分块读取表格, 按排序列的哈希写入 n_partitions 个分区文件, 返回 (分区文件路径列表, 行数, 整表的列类型)。
+    read_excel_chunks 产出的各块已是整表的列类型(与一次性读取时相同)
+    """
+    paths = [f"{prefix}_{k}.pkl" for k in range(n_partitions)]
+    rows, dtypes = 0, None
+    for n, chunk in enumerate(read_excel_chunks(fpath, chunksize, use_cache=False)):
+        if progress:
+            progress(f"读取 {os.path.basename(fpath)}: 第{n + 1}块")
+        chunk = _normalize_columns(chunk, columns)
+        rows, dtypes = rows + chunk.shape[0], chunk.dtypes
+        # 与比较时一样规范化排序列, 规范化后相同的值一定分到同一分区
+        keys = chunk[sort_columns].fillna('').astype(str).apply(lambda x: x.str.strip())
+        part = pd.util.hash_pandas_object(keys, index=False).to_numpy() % n_partitions
+        for k in range(n_partitions):
+            mask = part == k
+            if mask.any():
+                _dump_all(paths[k], [chunk[mask]])
+    return paths, rows, dtypes
+
+
+def compare_partition(path1: str, path2: str, sort_columns: list, dtypes1, dtypes2, engine: str,
+                      result_path: str, chunksize: int):
+    """
+    比较一对分区, 差异表分块写入 result_path。可以在子进程中执行。
+    返回 (是否一致, 差异行数, 差异表的列名)
+    """
+    def load(path, dtypes):
+        frames = list(_load_all(path))
+        return pd.concat(frames) if frames else pd.DataFrame({c: pd.Series(dtype=t) for c, t in dtypes.items()})
+
+    df1, df2 = load(path1, dtypes1), load(path2, dtypes2)
+    df_eq, comparison = compare_df(df1, df2, sort_columns, engine)
+    del df1, df2
+    # merge_results 按排序列归并, 各分区必须有序; 稳定排序保持同一分组中行的顺序
+    comparison = comparison.sort_values(by=[f"排序_{i}" for i in sort_columns], kind='stable')
+    for path in (path1, path2):
+        if os.path.exists(path):
+            os.remove(path)
+    _dump_all(result_path, (comparison.iloc[k:k + chunksize] for k in range(0, comparison.shape[0], chunksize)))
+    return df_eq, comparison.shape[0], comparison.columns.tolist()
+
+
+def merge_results(result_paths: list, columns: list, n_keys: int, chunksize: int):
+    """归并各分区已排序的差异表, 产出列为 columns 的分块; 同一分组只会出现在一个分区中"""
+    def rows(path):
+        for chunk in _load_all(path):
+            yield from chunk.reindex(columns=columns).itertuples(index=False, name=None)
+
+    keys = slice(1, 1 + n_keys)  # 第一列是差异标识, 之后是排序列
+    buffer = []
+    for row in heapq.merge(*(rows(path) for path in result_paths), key=lambda row: row[keys]):
+        buffer.append(row)
+        if len(buffer) >= chunksize:
+            yield pd.DataFrame(buffer, columns=columns)
+            buffer = []
+    if buffer:
+        yield pd.DataFrame(buffer, columns=columns)
+
+
+def compare_files(fpath1: str, fpath2: str, sort_columns: list, columns: list, write, n_partitions=16, processes=0,
+                  engine="merge", chunksize=50000, progress=lambda done, total, msg="": None):
+    """
+    分区比较两个表格文件。
+    columns: 参与比较的列(两表共有的列, 列名已去空), 排序列必须在其中
+    write(df_eq, chunks): 比较完成后调用, chunks 为差异表的分块(与 compare_df 返回的差异表拼接后相同),
+                          只能在 write 中迭代, 返回值作为本函数的返回值
+    processes: 大于 0 时在多个进程中比较各分区
+    """
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    spill_dir = tempfile.mkdtemp(prefix="compare_", dir=SPILL_DIR)
+    try:
+        tables = []
+        for i, fpath in enumerate((fpath1, fpath2)):
+            progress(i, 4, f"读取表{i + 1}并分区")
+            paths, rows, dtypes = partition_chunks(fpath, sort_columns, n_partitions,
+                                                   os.path.join(spill_dir, f"t{i + 1}_p"), chunksize, columns,
+                                                   lambda msg: progress(i, 4, msg))
+            tables.append((paths, dtypes))
+            log(f"【分区比较】表{i + 1} '{fpath}' 行数={rows}, 分区数={n_partitions}", level='info')
+
+        (paths1, dtypes1), (paths2, dtypes2) = tables
+        result_paths = [os.path.join(spill_dir, f"r_{k}.pkl") for k in range(n_partitions)]
+        args = [(paths1[k], paths2[k], sort_columns, dtypes1, dtypes2, engine, result_paths[k], chunksize)
+                for k in range(n_partitions)]
+        results = []
+        if processes > 0:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [pool.submit(compare_partition, *a) for a in args]
+                try:
+                    for done, future in enumerate(as_completed(futures)):
+                        progress(2, 4, f"比较分区 {done}/{n_partitions}")
+                        results.append(future.result())
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        else:
+            for k, a in enumerate(args):
+                progress(2, 4, f"比较分区 {k}/{n_partitions}")
+                results.append(compare_partition(*a))
+
+        df_eq = all(r[0] for r in results)
+        n_rows = sum(r[1] for r in results)
+        present = {c for r in results for c in r[2]}
+        other_columns = [i for i in columns if i not in sort_columns]
+        result_columns = ['差异标识'] + [f"排序_{i}" for i in sort_columns] + \
+                         [f"差异_{i}" for i in other_columns if f"差异_{i}" in present]
+        log(f"【分区比较】sort_columns={sort_columns}, 差异行数={n_rows}, "
+            f"{'两个表完全一致' if df_eq else '两表格不完全一致'}", level='info')
+
+        progress(3, 4, "输出结果")
+        chunks = merge_results(result_paths, result_columns, len(sort_columns), chunksize)
+        return write(df_eq, chunks)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
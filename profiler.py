@@ -0,0 +1,282 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from log import log
+
+"""
+动作和比较的性能剖析(选项 profile)。
+
+profiler.run 包住一次 action_loop 或表格比较, 期间:
+- span: 记录一段代码(一个动作、一次读取、一次比较)的耗时、CPU 时间、内存峰值的增量(tracemalloc)和附加信息
+- phase: 在当前 span 中按顺序划分阶段(比较的各阶段、动作中的每条规则), 开始下一个阶段时结束上一个,
+         phase(None) 或所在的 span 结束时结束最后一个
+结束时在 log/ 下写入 JSON 报告(profile_时间.json, 包括每个动作和每条规则的耗时)
+和 Chrome trace 格式的时间线(trace_时间.json, 可以在 chrome://tracing 或 https://ui.perfetto.dev 中打开)。
+
+进行中的 run 属于开始它的线程, 界面中同时执行的多个任务各自记录, 互不混合; 交给线程池的任务用 bind 包装后
+记录到提交它的线程的 run 中。没有进行中的 run 时以上函数什么都不做, 只用于记录的参数可以先用 active() 判断再计算。
+tracemalloc 会使执行变慢; 并行执行(workers)或同时执行多个任务时各线程共用一个内存峰值, 此时内存增量仅供参考。
+"""
+
+LOG_DIR = "log"
+
+_lock = threading.Lock()
+_local = threading.local()  # 每个线程中进行中的 run 和未结束的记录(栈)
+_tracers = 0  # 开启了 tracemalloc 且尚未结束的 run 的数量
+
+
+class Record:
+    """一个 span 或 phase 的记录"""
+    __slots__ = ("name", "category", "args", "parent", "tid", "start", "cpu_start", "mem_start", "peak",
+                 "wall", "cpu", "peak_delta", "phase", "is_phase")
+
+    def __init__(self, name, category, args, parent, is_phase=False):
+        self.name, self.category, self.args, self.parent = name, category, args, parent
+        self.tid = threading.get_ident()
+        self.phase = None  # 当前的阶段
+        self.is_phase = is_phase
+        self.wall = self.cpu = self.peak_delta = None
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                # 上一层之前的峰值先保存下来, 再从当前占用开始记录本层的峰值
+                parent.peak = max(parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.mem_start, self.peak = current, current
+        else:
+            self.mem_start, self.peak = 0, 0
+        self.start, self.cpu_start = time.perf_counter(), time.thread_time()
+
+    def finish(self):
+        self.wall = time.perf_counter() - self.start
+        self.cpu = time.thread_time() - self.cpu_start
+        if tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, self.peak)
+        self.peak_delta = max(self.peak - self.mem_start, 0)
+
+
+class Run:
+    def __init__(self, name):
+        self.name = name
+        self.records = []
+        self.started = datetime.now()
+        self.origin = time.perf_counter()
+        self.threads = {}  # 线程 -> 时间线中的序号
+
+
+def _current():
+    return getattr(_local, "run", None)
+
+
+def active():
+    """当前线程中是否有进行中的 run"""
+    return _current() is not None
+
+
+def bind(fn):
+    """返回在当前线程的 run 中执行 fn 的函数, 用于把任务交给线程池; 没有进行中的 run 时返回 fn 本身"""
+    current = _current()
+    if current is None:
+        return fn
+
+    def call(*args, **kwargs):
+        previous = _current(), getattr(_local, "stack", None)
+        _local.run, _local.stack = current, []
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.run, _local.stack = previous
+    return call
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _begin(name, category, args, is_phase=False):
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    record = Record(name, category, args, parent, is_phase)
+    current = _current()
+    with _lock:
+        current.records.append(record)
+        current.threads.setdefault(record.tid, len(current.threads))
+    stack.append(record)
+    return record
+
+
+def _end(record):
+    if record.phase is not None:
+        _end(record.phase)
+        record.phase = None
+    record.finish()
+    stack = _stack()
+    if stack and stack[-1] is record:
+        stack.pop()
+
+
+@contextmanager
+def span(name, category="span", **args):
+    """记录一段代码, 返回的记录可以在结束前通过 record.args 补充信息; 没有进行中的 run 时返回 None"""
+    if not active():
+        yield None
+        return
+    record = _begin(name, category, args)
+    try:
+        yield record
+    finally:
+        _end(record)
+
+
+def phase(name, category="phase", **args):
+    """结束当前 span 中的上一个阶段, 开始名为 name 的阶段; name 为 None 时只结束上一个阶段"""
+    if not active():
+        return
+    stack = _stack()
+    owner = stack[-1] if stack else None
+    if owner is not None and owner.is_phase:
+        # 栈顶是上一个阶段, 阶段属于它的上一层
+        owner = owner.parent
+    if owner is not None and owner.phase is not None:
+        _end(owner.phase)
+        owner.phase = None
+    if name is not None:
+        record = _begin(name, category, args, is_phase=True)
+        if owner is not None:
+            owner.phase = record
+
+
+def annotate(**args):
+    """
+    给当前线程中最内层的记录补充信息(例如规则匹配的行数)。
+    参数在调用前就已计算, 需要计算的参数先用 active() 判断: if profiler.active(): profiler.annotate(...)
+    """
+    if not active():
+        return
+    stack = _stack()
+    if stack:
+        stack[-1].args.update(args)
+
+
+def shape(df):
+    """用于记录的表的形状"""
+    return list(df.shape) if hasattr(df, "shape") else None
+
+
+@contextmanager
+def run(name, enabled=True):
+    """剖析一次执行, 结束后写入报告; enabled 为 False 或当前线程中已有进行中的 run 时什么都不做"""
+    global _tracers
+    if not enabled or active():
+        yield
+        return
+    with _lock:
+        # 同时进行的 run 共用 tracemalloc, 最后一个结束时停止
+        if _tracers == 0 and tracemalloc.is_tracing():
+            tracing = False  # 由其他代码开启, 不停止
+        else:
+            tracing = True
+            if _tracers == 0:
+                tracemalloc.start()
+            _tracers += 1
+    current = Run(name)
+    _local.run, _local.stack = current, []
+    try:
+        with span(name, "run"):
+            yield
+    finally:
+        _local.run, _local.stack = None, []
+        if tracing:
+            with _lock:
+                _tracers -= 1
+                if _tracers == 0:
+                    tracemalloc.stop()
+        try:
+            write_report(current)
+        except Exception as e:
+            log(f"【性能剖析】写入报告失败: {e}", level='warning')
+
+
+def _to_dict(record, origin, index):
+    return {
+        "name": record.name,
+        "category": record.category,
+        "parent": index.get(id(record.parent)),
+        "thread": record.tid,
+        "start_s": round(record.start - origin, 6),
+        "wall_s": round(record.wall, 6) if record.wall is not None else None,
+        "cpu_s": round(record.cpu, 6) if record.cpu is not None else None,
+        "peak_delta_mb": round(record.peak_delta / 1024 ** 2, 3) if record.peak_delta is not None else None,
+        "args": record.args,
+    }
+
+
+def build_report(current: Run):
+    """报告: 全部记录(按开始时间), 以及按耗时排列的动作和规则"""
+    records = sorted(current.records, key=lambda r: r.start)
+    index = {id(r): i for i, r in enumerate(records)}
+    items = [_to_dict(r, current.origin, index) for r in records]
+    for item in items:
+        item["parent_name"] = items[item["parent"]]["name"] if item["parent"] is not None else None
+    finished = [item for item in items if item["wall_s"] is not None]
+    by_wall = lambda item: -item["wall_s"]
+    return {
+        "name": current.name,
+        "started": current.started.isoformat(timespec="seconds"),
+        "wall_s": next((item["wall_s"] for item in items if item["category"] == "run"), None),
+        "actions": sorted((item for item in finished if item["category"] == "action"), key=by_wall),
+        "rules": sorted((item for item in finished if item["category"] == "rule"), key=by_wall),
+        "records": items,
+    }
+
+
+def build_trace(current: Run):
+    """Chrome trace 格式: 每条记录一个完整事件(ph='X'), 时间单位为微秒"""
+    pid = os.getpid()
+    events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": n, "args": {"name": f"线程{n}"}}
+              for n in current.threads.values()]
+    for r in current.records:
+        if r.wall is None:
+            continue
+        events.append({
+            "name": r.name, "cat": r.category, "ph": "X", "pid": pid, "tid": current.threads[r.tid],
+            "ts": round((r.start - current.origin) * 1e6, 1), "dur": round(r.wall * 1e6, 1),
+            "args": {**r.args, "cpu_ms": round(r.cpu * 1000, 3), "peak_delta_mb": round(r.peak_delta / 1024 ** 2, 3)},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def summary(report: dict, top=10):
+    lines = [f"【性能剖析】{report['name']} 总耗时 {report['wall_s']:.3f}s"]
+    for title, key in (("动作", "actions"), ("规则", "rules")):
+        items = report[key][:top]
+        if items:
+            lines.append(f"耗时最多的{title}:")
+        for item in items:
+            where = f" ({item['parent_name']})" if key == "rules" else ""
+            lines.append(f"  {item['wall_s']:9.3f}s  CPU {item['cpu_s']:8.3f}s  内存 +{item['peak_delta_mb']:.1f} MB  "
+                         f"{item['name']}{where}")
+    return "\n".join(lines)
+
+
+def write_report(current: Run):
+    os.makedirs(LOG_DIR, exist_ok=True)
+    stamp = current.started.strftime("%Y%m%d_%H%M%S_%f")[:-3]
+    report = build_report(current)
+    report_path = os.path.join(LOG_DIR, f"profile_{stamp}.json")
+    trace_path = os.path.join(LOG_DIR, f"trace_{stamp}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1, default=str)
+    with open(trace_path, "w", encoding="utf-8") as f:
+        json.dump(build_trace(current), f, ensure_ascii=False, default=str)
+    log(f"{summary(report)}\n报告: '{report_path}', 时间线: '{trace_path}'", level='info')
+    return report_path, trace_path
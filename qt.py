@@ -1,14 +1,89 @@
 from PyQt5.QtWidgets import QMainWindow, QAction, QStackedWidget, \
     QWidget, QVBoxLayout, QLabel, QPushButton, QFileDialog, QHBoxLayout, QLineEdit, \
-        QCheckBox, QMessageBox, QDialog, QGridLayout, QScrollArea
-from PyQt5.QtCore import QTimer, Qt
+        QCheckBox, QMessageBox, QDialog, QGridLayout, QScrollArea, QProgressBar
+from PyQt5.QtCore import QTimer, Qt, QObject, QRunnable, QThreadPool, pyqtSignal
 from PyQt5.QtGui import QIcon, QPainter, QPixmap
-from utils import read_json, read_excel, check_columns_eq, \
-    export_multiple_df, get_basename
+from config_check import read_config, describe
+from log import log
+from sys import exit
 import os
+import copy
+import time
+import threading
 from functools import partial
 
-from logic import Logic
+import startup
+
+# 数据处理相关的模块(logic, utils 及 pandas 等)在后台任务中才导入, 窗口可以先显示出来
+
+
+def write_compare_result(col_eq, df_diff_col, out_path, stream, df_eq, comparison):
+    """写出比较结果并返回提示信息; comparison 可以是 DataFrame, stream 为 True 时也可以是分块的可迭代对象"""
+    from utils import export_multiple_df
+    if col_eq and df_eq:
+        return f"两表: 列完全相同，数据完全相同"
+    elif col_eq and not df_eq:
+        export_multiple_df([comparison], out_path, ["差异表"], stream)
+        return f"两表: 列完全相同，数据不完全相同\n请查看 \"{out_path}\"\nsheet_name=\"差异表\""
+    elif not col_eq and not df_eq:
+        export_multiple_df([comparison, df_diff_col], out_path, ["差异表", "列差异表"], stream)
+        return f"两表: 列不完全相同，相同列的数据不完全相同\n请查看 \"{out_path}\"\nsheet_name=\"差异表,列差异表\""
+    else:
+        export_multiple_df([df_diff_col], out_path, ["列差异表"], stream)
+        return f"两表: 列不完全相同，相同列的数据完全相同\n请查看 \"{out_path}\"\nsheet_name=\"列差异表\""
+
+
+def preview_compare_result(col_eq, df_diff_col, df_eq, comparison):
+    """选项 preview: 不写出结果, 返回 (提示信息, {表名: DataFrame}), 表在程序内的查看器中打开"""
+    frames = {}
+    if not df_eq:
+        frames["差异表"] = comparison
+    if not col_eq:
+        frames["列差异表"] = df_diff_col
+    columns = "列完全相同，" if col_eq else "列不完全相同，相同列的"
+    return f"两表: {columns}数据{'完全相同' if df_eq else '不完全相同'}", frames
+
+
+class JobSignals(QObject):
+    progress = pyqtSignal(int, int, str)  # 已完成数, 总数, 说明
+    finished = pyqtSignal(object)  # 任务的返回值
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class Job(QRunnable):
+    """在线程池中执行 func(progress), 通过信号把进度和结果交回界面线程"""
+    def __init__(self, func):
+        super().__init__()
+        self.func = func
+        self.signals = JobSignals()
+        self.cancel_event = threading.Event()
+
+    def progress(self, done, total, msg=""):
+        # 在两个动作之间被调用, 用户取消后在这里停止
+        if self.cancel_event.is_set():
+            from logic import Cancelled
+            raise Cancelled()
+        self.signals.progress.emit(done, total, msg)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            self.progress(0, 0, "开始")
+            result = self.func(self.progress)
+        except SystemExit:
+            self.signals.failed.emit("执行失败, 详见 log 目录下的日志")
+        except Exception as e:
+            from logic import Cancelled
+            if isinstance(e, Cancelled):
+                self.signals.cancelled.emit()
+            else:
+                self.signals.failed.emit(f"{e}")
+        else:
+            self.signals.finished.emit(result)
+
 
 class MainApp(QMainWindow):
     def __init__(self):
@@ -19,10 +94,32 @@ class MainApp(QMainWindow):
         self.setWindowOpacity(0.99)
         self.font = self.font()
         self.font.setPointSize(14)
+
+        # 后台任务: 每个功能页同一时间只有一个任务, 不同功能页的任务可以同时执行或排队
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.jobs = {}
+        self.job_widgets = {}
+        self.viewers = []  # 打开的结果查看器
+        self.job_timer = QTimer(self)
+        self.job_timer.timeout.connect(self.refresh_job_status)
+        self.job_timer.start(1000)
+
+        # 背景图只读取一次, 缩放后的图按窗口大小缓存
+        self.background = QPixmap("R/background.png")
+        self.scaled_background = None
         
         self.readConfig()
         self.initUI()
         self.adjust_font_size()
+
+    def warm_up(self):
+        """窗口显示后在线程池中预先导入数据处理相关的模块, 完成后记录启动耗时"""
+        job = Job(lambda progress: startup.warm_up())
+        job.signals.finished.connect(lambda _: log(startup.report(), level='info'))
+        job.signals.failed.connect(lambda msg: log(f"预先导入模块失败: {msg}", level='warning'))
+        self.pool.start(job)
+        return job
     
     def adjust_font_size(self):
         self.setFont(self.font)
@@ -31,16 +128,25 @@ class MainApp(QMainWindow):
 
     def paintEvent(self, event):
         painter = QPainter(self)
-        pixmap = QPixmap("R/background.png")
-        scaled_pixmap = pixmap.scaled(self.size(), Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
-        painter.drawPixmap(self.rect(), scaled_pixmap)
+        if self.scaled_background is None or self.scaled_background.size() != self.size():
+            self.scaled_background = self.background.scaled(self.size(), Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        painter.drawPixmap(self.rect(), self.scaled_background)
     
     def readConfig(self):
-        config = read_json("config/config.jsonc")
+        """读取并检查配置, 文件未修改时使用缓存的结果(见 config_check.py); action_loop 配置有误时不能执行"""
+        config, errors = read_config("config/config.jsonc")
+        if errors:
+            log(f"【检查配置】'config/config.jsonc' 有误:\n{describe(errors)}", level='error')
+            exit(1)
         for func_name, func_details in config.items():
-            sub_config = read_json(func_details["config"])
+            sub_config, errors = read_config(func_details["config"])
+            if errors and func_details["func"] == "action_loop":
+                log(f"【检查配置】功能 '{func_name}' 的配置 '{func_details['config']}' 有误:\n{describe(errors)}",
+                    level='warning')
+            config[func_name]["errors"] = errors if func_details["func"] == "action_loop" else []
             config[func_name]["files"] = {fname: {"symbol": symbol, "path": ""}  for fname, symbol in sub_config["files"].items()}
             config[func_name]["actions"] = sub_config["actions"]
+            config[func_name]["options"] = sub_config.get("options", {})
             config[func_name]["index"] = 0
             del config[func_name]["config"]
         # 帮助
@@ -142,6 +248,9 @@ class MainApp(QMainWindow):
         self.config[func_name]["files"][fname]["path"] = fpath
         output_widge.setText(fpath)
     
+    def set_option(self, func_name, key, value):
+        self.config[func_name]["options"][key] = value
+
     def check_file_paths(self, fpaths_dict, none_path=""):
         for fname, fpath_dict in fpaths_dict.items():
             fpath = fpath_dict["path"]
@@ -153,14 +262,118 @@ class MainApp(QMainWindow):
                 return False
         return True
 
+    def start_job(self, func_name, func, on_finished):
+        """在后台执行 func(progress), 完成后在界面线程中调用 on_finished(返回值)"""
+        if func_name in self.jobs:
+            self.warning(f"\"{func_name}\" 正在执行")
+            return
+        job = Job(func)
+        job.signals.progress.connect(partial(self.on_job_progress, func_name))
+        job.signals.finished.connect(partial(self.on_job_finished, func_name, on_finished))
+        job.signals.failed.connect(partial(self.on_job_failed, func_name))
+        job.signals.cancelled.connect(partial(self.on_job_cancelled, func_name))
+        self.jobs[func_name] = job
+
+        widgets = self.job_widgets[func_name]
+        widgets.update(start=None, done=0, total=0, msg="排队中")
+        widgets["confirm"].setEnabled(False)
+        widgets["cancel"].setEnabled(True)
+        widgets["bar"].setRange(0, 0)
+        self.refresh_job_status()
+        self.pool.start(job)
+
+    def cancel_job(self, func_name):
+        if func_name in self.jobs:
+            self.jobs[func_name].cancel()
+            self.job_widgets[func_name]["msg"] = "正在取消(当前动作完成后停止)"
+            self.refresh_job_status()
+
+    def on_job_progress(self, func_name, done, total, msg):
+        widgets = self.job_widgets[func_name]
+        if widgets["start"] is None:
+            widgets["start"] = time.monotonic()
+        widgets.update(done=done, total=total, msg=msg)
+        widgets["bar"].setRange(0, total)
+        widgets["bar"].setValue(done)
+        self.refresh_job_status()
+
+    def refresh_job_status(self):
+        for func_name in self.jobs:
+            widgets = self.job_widgets[func_name]
+            if widgets["start"] is None:
+                widgets["status"].setText(widgets["msg"])
+                continue
+            elapsed = time.monotonic() - widgets["start"]
+            done, total = widgets["done"], widgets["total"]
+            eta = f"{elapsed / done * (total - done):.0f}s" if done > 0 and total > 0 else "--"
+            widgets["status"].setText(f"已用 {elapsed:.0f}s, 预计剩余 {eta}  {widgets['msg']}")
+
+    def end_job(self, func_name, msg):
+        self.jobs.pop(func_name, None)
+        widgets = self.job_widgets[func_name]
+        widgets["confirm"].setEnabled(True)
+        widgets["cancel"].setEnabled(False)
+        widgets["bar"].setRange(0, 1)
+        widgets["bar"].setValue(1 if msg == "已完成" else 0)
+        widgets["status"].setText(msg)
+
+    def on_job_finished(self, func_name, on_finished, result):
+        self.end_job(func_name, "已完成")
+        on_finished(result)
+
+    def on_job_failed(self, func_name, msg):
+        self.end_job(func_name, "失败")
+        self.warning(f"发生未知错误: {msg}", disappear=False)
+
+    def on_job_cancelled(self, func_name):
+        self.end_job(func_name, "已取消")
+
+    def run_in_background(self, func, on_finished):
+        """在后台执行 func(progress), 不占用功能页的任务(例如查看器中的导出)"""
+        job = Job(func)
+        job.signals.finished.connect(on_finished)
+        job.signals.failed.connect(lambda msg: self.warning(f"发生未知错误: {msg}", disappear=False))
+        self.pool.start(job)
+
+    def show_results(self, title, frames: dict, options: dict):
+        """在程序内的查看器中打开结果表(见 viewer.py)"""
+        from viewer import ResultViewer
+        viewer = ResultViewer(title, frames, self.run_in_background, stream=options.get("stream_write", False),
+                              parent=self)
+        viewer.setFont(self.font)
+        viewer.finished.connect(lambda _: self.viewers.remove(viewer))
+        self.viewers.append(viewer)
+        viewer.show()
+
+    def closeEvent(self, event):
+        # 取消所有任务, 等待正在执行的动作结束后再退出
+        self.pool.clear()
+        for job in self.jobs.values():
+            job.cancel()
+        self.pool.waitForDone()
+        super().closeEvent(event)
+
     def confirm_actionloop(self, func_name):
+        if self.config[func_name]["errors"]:
+            self.warning(f"配置有误, 请修改后重新启动:\n{describe(self.config[func_name]['errors'], 5)}", False)
+            return
         # 检查路径是否有效
         if self.check_file_paths(self.config[func_name]["files"]):
-            try:
-                Logic.action_loop(self.config[func_name])
-                self.tip(f"\"{func_name}\" 已完成,请查看 data 目录", False)
-            except Exception as e:
-                self.warning(f"发生未知错误: {e}", disappear=False)
+            config = copy.deepcopy(self.config[func_name])
+
+            def action_loop(progress):
+                from logic import Logic
+                return Logic.action_loop(config, progress)
+
+            def on_finished(previews):
+                if previews:
+                    self.show_results(func_name, previews, config["options"])
+                elif previews is not None:
+                    self.tip(f"\"{func_name}\" 已完成, 没有导出的表", False)
+                else:
+                    self.tip(f"\"{func_name}\" 已完成,请查看 data 目录", False)
+
+            self.start_job(func_name, action_loop, on_finished)
     
     def get_select_files_layout(self, func_name, confirm_callback):
         layout = QVBoxLayout()
@@ -180,11 +393,37 @@ class MainApp(QMainWindow):
             
             layout.addLayout(file_line_layout)
         
+        # 添加"不使用缓存"选项
+        options = self.config[func_name]["options"]
+        bypass_cache = QCheckBox("不使用缓存(重新解析表格)")
+        bypass_cache.setChecked(options.get("bypass_cache", False))
+        bypass_cache.toggled.connect(partial(self.set_option, func_name, "bypass_cache"))
+        layout.addWidget(bypass_cache)
+        # 添加"在程序中查看结果"选项
+        preview = QCheckBox("在程序中查看结果(不写出 xlsx)")
+        preview.setChecked(options.get("preview", False))
+        preview.toggled.connect(partial(self.set_option, func_name, "preview"))
+        layout.addWidget(preview)
+
         # 添加确认按钮
         confirm_button = QPushButton("确认")
         confirm_button.clicked.connect(confirm_callback)
         layout.addWidget(confirm_button)
 
+        # 添加进度条、状态和取消按钮
+        job_layout = QHBoxLayout()
+        progress_bar = QProgressBar()
+        cancel_button = QPushButton("取消")
+        cancel_button.setEnabled(False)
+        cancel_button.clicked.connect(partial(self.cancel_job, func_name))
+        job_layout.addWidget(progress_bar)
+        job_layout.addWidget(cancel_button)
+        layout.addLayout(job_layout)
+        status_label = QLabel("")
+        layout.addWidget(status_label)
+        self.job_widgets[func_name] = {"confirm": confirm_button, "cancel": cancel_button,
+                                       "bar": progress_bar, "status": status_label}
+
         return layout
 
     def create_actionloop_page(self, func_name):
@@ -212,15 +451,33 @@ class MainApp(QMainWindow):
 
         df1_path = self.config[func_name]["files"]["表1"]["path"]
         df2_path = self.config[func_name]["files"]["表2"]["path"]
-        out_path = f"data/差异表_{get_basename(df1_path)}_{get_basename(df2_path)}.xlsx"
 
-        # 根据 path 读取相关文件
-        df1 = read_excel(df1_path)
-        df2 = read_excel(df2_path)
+        # 在后台根据 path 读取相关文件, 并检查列是否相同
+        options = copy.deepcopy(self.config[func_name]["options"])
+
+        def read(progress):
+            from logic import Logic
+            from utils import read_excel, read_excel_header, check_columns_eq, get_basename
+            use_cache = Logic.apply_cache_options(options)
+            if options.get("partitions", 0) > 0:
+                # 分区比较: 这里只读取列名, 比较时再分块读取数据
+                progress(0, 2, "读取列名")
+                df1, df2 = read_excel_header(df1_path), read_excel_header(df2_path)
+            else:
+                progress(0, 2, "读取表1")
+                df1 = read_excel(df1_path, use_cache=use_cache)
+                progress(1, 2, "读取表2")
+                df2 = read_excel(df2_path, use_cache=use_cache)
+                if options.get("compact", False):
+                    from compact import compact_frame
+                    df1, df2 = compact_frame("表1", df1), compact_frame("表2", df2)
+            out_path = f"data/差异表_{get_basename(df1_path)}_{get_basename(df2_path)}.xlsx"
+            return out_path, check_columns_eq(df1, df2, [get_basename(df1_path, True), get_basename(df2_path, True)])
+
+        self.start_job(func_name, read, partial(self.select_compare_columns, func_name, df1_path, df2_path, options))
 
-        # 检查列是否相同
-        col_eq, df_diff_col, df1, df2 = check_columns_eq(df1, df2, 
-            [get_basename(df1_path, True), get_basename(df2_path, True)])
+    def select_compare_columns(self, func_name, df1_path, df2_path, options, result):
+        out_path, (col_eq, df_diff_col, df1, df2) = result
 
         # 选择 排序列
         msg = f"两表的所有列的列名能一一对应" if col_eq else f"两表的所有列的列名不能一一对应,因此仅比较能一一对应的列"
@@ -228,25 +485,32 @@ class MainApp(QMainWindow):
         if selected_cols == []:
             return
 
-        # 比较
-        try:
-            df_eq, comparison = Logic.compare(df1, df2, selected_cols)
-        except Exception as e:
-            self.warning(f"发生未知错误: {e}", disappear=False)
-    
-        # 输出结果
-        disappear = False
-        if col_eq and df_eq:
-            self.tip(f"两表: 列完全相同，数据完全相同", disappear)
-        elif col_eq and not df_eq:
-            export_multiple_df([comparison], out_path, ["差异表"])
-            self.tip(f"两表: 列完全相同，数据不完全相同\n请查看 \"{out_path}\"\nsheet_name=\"差异表\"", disappear)
-        elif not col_eq and not df_eq:
-            export_multiple_df([comparison, df_diff_col], out_path, ["差异表", "列差异表"])
-            self.tip(f"两表: 列不完全相同，相同列的数据不完全相同\n请查看 \"{out_path}\"\nsheet_name=\"差异表,列差异表\"", disappear)
-        else:
-            export_multiple_df([df_diff_col], out_path, ["列差异表"])
-            self.tip(f"两表: 列不完全相同，相同列的数据完全相同\n请查看 \"{out_path}\"\nsheet_name=\"列差异表\"", disappear)
+        # 在后台比较并输出结果
+        def compare(progress):
+            from logic import Logic
+            if options.get("partitions", 0) > 0:
+                # 分区比较的差异表是分块产出的, 只能流式写入
+                write = partial(write_compare_result, col_eq, df_diff_col, out_path, True)
+                return Logic.compare_files(df1_path, df2_path, selected_cols, df1.columns.tolist(), write,
+                                           options, progress)
+            df_eq, comparison = Logic.compare(df1, df2, selected_cols, options.get("engine", "merge"), progress,
+                                              options.get("profile", False))
+            if options.get("preview", False):
+                return preview_compare_result(col_eq, df_diff_col, df_eq, comparison)
+            progress(1, 1, "输出结果")
+            return write_compare_result(col_eq, df_diff_col, out_path, options.get("stream_write", False),
+                                        df_eq, comparison)
+
+        def on_finished(result):
+            if isinstance(result, str):
+                self.tip(result, False)
+                return
+            msg, frames = result
+            if frames:
+                self.show_results(os.path.splitext(os.path.basename(out_path))[0], frames, options)
+            self.tip(msg, not frames)
+
+        self.start_job(func_name, compare, on_finished)
     
     def create_compare_page(self, func_name):
         page = QWidget()
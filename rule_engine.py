@@ -0,0 +1,262 @@
+import re
+import threading
+import weakref
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+"""
+正则规则的编译与匹配, 以及分组编号。
+
+每个正则只编译一次; 匹配时先对列做因子化(codes, uniques), 只在去重后的值上执行正则,
+再通过 codes 映射回每一行。因子化的结果按 (DataFrame, 列名) 缓存, 在列被修改前
+可以被后续规则和动作复用。
+
+按一组列分组时(fill, eq_sum, export 的计数), 每行的分组编号按 (DataFrame, 列名组) 缓存,
+同样在这些列被修改前被后续动作复用。
+"""
+
+_lock = threading.Lock()
+# id(df) -> (weakref(df), {列名: ColumnFactor}, {列名元组: GroupIndex})
+_frames = {}
+
+
+@lru_cache(maxsize=None)
+def compile_pattern(regex: str):
+    """编译正则(忽略大小写), 同一个正则只编译一次"""
+    return re.compile(regex, flags=re.IGNORECASE)
+
+
+class ColumnFactor:
+    """列的因子化结果, 以及每个正则在去重值上的匹配结果"""
+    def __init__(self, codes: np.ndarray, uniques: np.ndarray):
+        self.codes = codes
+        self.uniques = uniques
+        self.results = {}
+        # 与 astype(str).str.contains(regex, na=False) 一致: 缺失值不匹配, 只在字符串上执行正则
+        self.is_str = np.fromiter((isinstance(v, str) for v in uniques), dtype=bool, count=len(uniques))
+        self.strings = uniques[self.is_str].tolist()
+
+    def take(self, rows):
+        """取部分行, 共享去重值和匹配结果"""
+        factor = ColumnFactor.__new__(ColumnFactor)
+        factor.__dict__.update(self.__dict__)
+        factor.codes = self.codes[rows]
+        return factor
+
+    def search(self, regex: str):
+        result = self.results.get(regex)
+        if result is None:
+            pattern = compile_pattern(regex)
+            result = np.zeros(len(self.uniques), dtype=bool)
+            result[self.is_str] = np.fromiter(map(bool, map(pattern.search, self.strings)),
+                                              dtype=bool, count=len(self.strings))
+            self.results[regex] = result
+        return result[self.codes]
+
+
+def factorize(series: pd.Series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # 分类列已经因子化: 直接使用类别编号, 缺失值(编号 -1)对应末尾的 NaN, 不匹配任何正则
+        codes = series.cat.codes.to_numpy().astype(np.intp)
+        codes[codes < 0] = len(series.cat.categories)
+        uniques = np.append(series.cat.categories.astype(str).to_numpy(dtype=object), np.nan)
+        return ColumnFactor(codes, uniques)
+    if series.dtype == object:
+        # object 列可能混有 1 和 1.0 这类相等但字符串不同的值, 先转字符串再因子化
+        series = series.astype(str)
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    uniques = pd.Series(uniques).astype(str).to_numpy(dtype=object)
+    return ColumnFactor(codes, uniques)
+
+
+def _entry_of(df: pd.DataFrame, create=True):
+    """返回 df 的 ({列名: ColumnFactor}, {列名元组: GroupIndex}), 没有缓存且 create 为 False 时返回 None"""
+    key = id(df)
+    item = _frames.get(key)
+    if item is not None and item[0]() is df:
+        return item[1:]
+    if not create:
+        return None
+    item = (weakref.ref(df, lambda _, key=key: _frames.pop(key, None)), {}, {})
+    _frames[key] = item
+    return item[1:]
+
+
+def _columns_of(df: pd.DataFrame, create=True):
+    entry = _entry_of(df, create)
+    return None if entry is None else entry[0]
+
+
+def get_factor(df: pd.DataFrame, column: str):
+    with _lock:
+        columns = _columns_of(df)
+        factor = columns.get(column)
+    if factor is None:
+        factor = factorize(df[column])
+        with _lock:
+            columns[column] = factor
+    return factor
+
+
+class GroupIndex:
+    """
+    按一组列分组的每行编号, 与 duplicated / drop_duplicates 一致: 缺失值也作为一个值参与分组,
+    编号按各组第一次出现的顺序从 0 开始。na 标记键中有缺失值的行, groupby 默认不包含这些行
+    """
+    def __init__(self, codes: np.ndarray, na: np.ndarray):
+        self.codes = codes
+        self.na = na
+        self.ngroups = int(codes.max()) + 1 if len(codes) else 0
+        self._first = self._counts = self._order = None
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, columns: list):
+        n = df.shape[0]
+        codes, size = np.zeros(n, dtype=np.int64), 1
+        na = np.zeros(n, dtype=bool)
+        for column in columns:
+            column_codes, uniques = pd.factorize(df[column], use_na_sentinel=True)
+            column_na = column_codes < 0
+            column_codes = column_codes.astype(np.int64)
+            column_codes[column_na] = len(uniques)  # 缺失值作为最后一个值
+            na |= column_na
+            if size * (len(uniques) + 1) >= 2 ** 62:
+                # 组合编号可能溢出, 先压缩为连续编号
+                codes = pd.factorize(codes)[0].astype(np.int64)
+                size = int(codes.max()) + 1 if n else 1
+            codes = codes * (len(uniques) + 1) + column_codes
+            size *= len(uniques) + 1
+        # 重新编号: 按第一次出现的顺序连续编号
+        return cls(pd.factorize(codes)[0].astype(np.intp), na)
+
+    def take(self, rows):
+        """取部分行(布尔数组或位置数组), 重新编号"""
+        codes = self.codes[rows]
+        return GroupIndex(pd.factorize(codes)[0].astype(np.intp), self.na[rows])
+
+    @property
+    def first(self):
+        """每组第一次出现的行"""
+        if self._first is None:
+            seen = np.maximum.accumulate(self.codes) if len(self.codes) else self.codes
+            self._first = np.ones(len(self.codes), dtype=bool)
+            self._first[1:] = self.codes[1:] > seen[:-1]
+        return self._first
+
+    @property
+    def counts(self):
+        """每组的行数"""
+        if self._counts is None:
+            self._counts = np.bincount(self.codes, minlength=self.ngroups)
+        return self._counts
+
+    @property
+    def order(self):
+        """按组排列的行号, 同一组的行保持原有顺序"""
+        if self._order is None:
+            self._order = np.argsort(self.codes, kind='stable')
+        return self._order
+
+    def duplicated(self, keep='first'):
+        """等价于 df.duplicated(subset=columns, keep=keep), keep 为 'first' 或 False"""
+        if keep is False:
+            return self.counts[self.codes] > 1
+        return ~self.first
+
+    def keys(self):
+        """
+        用作 groupby 的键: 键中有缺失值的行为 NaN, 与按列 groupby(dropna=True) 的分组相同。
+        返回数组而不是 Series: 以 Series 为键时 pandas 会检查它是否为列名, 大表上很慢
+        """
+        return np.where(self.na, np.nan, self.codes)
+
+    def fill_source(self, missing: np.ndarray):
+        """
+        逐组 ffill().bfill() 的向量化实现: missing 为某列每行是否缺失,
+        返回每行取值的行号(不需要或无法填充时为自身)。键中有缺失值的行不分组, 保持原值
+        """
+        n = len(self.codes)
+        order = self.order
+        codes = self.codes[order]
+        pos = np.arange(n)
+        start = np.ones(n, dtype=bool)
+        start[1:] = codes[1:] != codes[:-1]
+        group_start = np.maximum.accumulate(np.where(start, pos, 0))
+        end = np.ones(n, dtype=bool)
+        end[:-1] = start[1:]
+        group_end = np.minimum.accumulate(np.where(end, pos, n)[::-1])[::-1]
+
+        na = self.na[order]
+        valid = ~missing[order] & ~na
+        prev = np.maximum.accumulate(np.where(valid, pos, -1))
+        nxt = np.minimum.accumulate(np.where(valid, pos, n)[::-1])[::-1]
+        source = np.where(prev >= group_start, prev, np.where(nxt <= group_end, nxt, pos))
+        source[na] = pos[na]
+
+        result = np.empty(n, dtype=np.intp)
+        result[order] = order[source]
+        return result
+
+
+def group_index(df: pd.DataFrame, columns: list) -> GroupIndex:
+    """df 按 columns 分组的编号, 在这些列被修改(invalidate)前复用"""
+    key = tuple(columns)
+    with _lock:
+        groups = _entry_of(df)[1]
+        index = groups.get(key)
+    if index is None:
+        index = GroupIndex.build(df, columns)
+        with _lock:
+            groups[key] = index
+    return index
+
+
+def match(df: pd.DataFrame, column: str, regex: str) -> pd.Series:
+    """等价于 df[column].astype(str).str.contains(regex, regex=True, na=False, flags=re.IGNORECASE)"""
+    return pd.Series(get_factor(df, column).search(regex), index=df.index)
+
+
+def carry(src: pd.DataFrame, dst: pd.DataFrame, rows=None):
+    """
+    把 src 的因子化缓存转给 dst。dst 的列内容与 src 相同,
+    rows 为 None 表示行也相同, 否则为从 src 中选取行的布尔数组或位置数组。
+    """
+    if src is dst and rows is None:
+        return
+    with _lock:
+        src_entry = _entry_of(src, create=False)
+        if src_entry is None or not any(src_entry):
+            return
+        src_columns, src_groups = src_entry
+        dst_columns, dst_groups = _entry_of(dst)
+        for column, factor in src_columns.items():
+            if column in dst.columns:
+                dst_columns[column] = factor if rows is None else factor.take(np.asarray(rows))
+        for columns, index in src_groups.items():
+            if all(column in dst.columns for column in columns):
+                dst_groups[columns] = index if rows is None else index.take(np.asarray(rows))
+
+
+def invalidate(df: pd.DataFrame, columns=None):
+    """df 的列被修改后调用, columns 为 None 表示所有列"""
+    with _lock:
+        entry = _entry_of(df, create=False)
+        if entry is None:
+            return
+        df_columns, df_groups = entry
+        if columns is None:
+            df_columns.clear()
+            df_groups.clear()
+        else:
+            columns = set(columns)
+            for column in columns:
+                df_columns.pop(column, None)
+            for key in [key for key in df_groups if columns.intersection(key)]:
+                del df_groups[key]
+
+
+def clear():
+    """清空所有因子化缓存"""
+    with _lock:
+        _frames.clear()
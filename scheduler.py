@@ -0,0 +1,207 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils import inteprete
+from log import log
+
+"""
+根据动作的输入输出签名("a,b->c")构建数据流图(DAG), 在线程池中并行执行互不依赖的分支,
+并在每个中间表的最后一个使用者执行完后立即释放它。
+
+同一个符号可以被多次赋值("df->df"), 所以图中的数据以 (符号, 版本) 区分。
+export 会就地修改输入表的列类型, 因此把它视为对输入的一次写入: 它要等之前读取该版本的
+动作都执行完, 之后读取该符号的动作也要等它执行完, 保证结果与顺序执行一致。
+"""
+
+# 未缓存的 xlsx 解析成 DataFrame 后, 内存占用约为文件大小的倍数(估计值)
+XLSX_EXPANSION = 8
+
+
+class Node:
+    def __init__(self, index: int, action_code: str, details: dict, inputs: list, outputs: list):
+        self.index = index
+        self.action_code = action_code
+        self.details = details
+        self.inputs = inputs  # [(符号, 版本), ...]
+        self.outputs = outputs  # [(符号, 版本), ...]
+        self.deps = set()  # 依赖的节点编号
+
+    def label(self):
+        if self.action_code == "load":
+            return f"读取 {','.join(key[0] for key in self.outputs)} <- {self.details['path']}"
+        return f"{self.action_code} {self.details['df']}"
+
+
+def build_plan(files: dict, steps: list, action_name) -> list:
+    """
+    files: {路径: {符号: 工作表}}(见 Logic.get_files), 每个文件一个读取节点, 输出它的全部工作表
+    steps: [(action_code, details), ...](按执行顺序)
+    action_name: 将动作代码转换为动作名字的函数
+    """
+    nodes = []
+    version = {}  # 符号 -> 当前版本
+    producer = {}  # 版本 -> 产生它的节点编号
+    readers = defaultdict(list)  # 版本 -> 读取它的节点编号
+
+    def new_version(symbol, node):
+        key = (symbol, version[symbol][1] + 1 if symbol in version else 0)
+        version[symbol] = key
+        producer[key] = node.index
+        return key
+
+    for path, sheets in files.items():
+        node = Node(len(nodes), "load", {"path": path, "sheets": sheets}, [], [])
+        node.outputs = [new_version(symbol, node) for symbol in sheets]
+        nodes.append(node)
+
+    for action_code, details in steps:
+        input, output = inteprete(details["df"])
+        input = [i for i in input if i != "None"]
+        for symbol in input:
+            if symbol not in version:
+                raise ValueError(f"动作 {action_code} '{details['df']}' 的输入 '{symbol}' 未定义")
+        node = Node(len(nodes), action_code, details, [version[i] for i in input], [])
+        for key in node.inputs:
+            node.deps.add(producer[key])
+            if action_name(action_code) == "export":
+                node.deps.update(readers[key])
+            readers[key].append(node.index)
+        if action_name(action_code) == "export":
+            # 就地修改输入, 产生输入符号的新版本
+            node.outputs = [new_version(symbol, node) for symbol in input]
+        else:
+            node.outputs = [new_version(symbol, node) for symbol in output if symbol != "None"]
+        nodes.append(node)
+
+    return nodes
+
+
+def consumer_counts(nodes: list):
+    counts = defaultdict(int)
+    for node in nodes:
+        for key in node.inputs:
+            counts[key] += 1
+    return counts
+
+
+def estimate_peak(nodes: list, input_sizes: dict, action_name):
+    """
+    按顺序执行时估计每个版本的大小和内存峰值。
+    input_sizes: {符号: 字节数}; concat_df 的输出按输入之和估计, 其余动作的输出按输入大小估计。
+    返回 (峰值字节数, {版本: 字节数})
+    """
+    sizes = {}
+    counts = consumer_counts(nodes)
+    moved = set()  # 被 export 就地修改、由新版本继续持有的版本
+    live, peak = 0, 0
+    for node in nodes:
+        is_export = action_name(node.action_code) == "export"
+        if node.action_code == "load":
+            output_sizes = [input_sizes.get(key[0], 0) for key in node.outputs]
+        elif action_name(node.action_code) == "concat_df":
+            output_sizes = [sum(sizes[key] for key in node.inputs)] * len(node.outputs)
+        else:
+            output_sizes = [max([sizes[key] for key in node.inputs], default=0)] * len(node.outputs)
+        for key, size in zip(node.outputs, output_sizes):
+            sizes[key] = size
+            if not is_export:
+                live += size
+        if is_export:
+            moved.update(node.inputs)
+        peak = max(peak, live)
+        for key in node.inputs:
+            counts[key] -= 1
+        for key in node.inputs + node.outputs:
+            if counts[key] == 0:
+                counts[key] = -1  # 已释放
+                if key not in moved:
+                    live -= sizes[key]
+    return peak, sizes
+
+
+def format_bytes(n: int):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+
+def describe_plan(nodes: list, input_sizes: dict, workers: int, action_name):
+    """返回执行计划的文本"""
+    peak, sizes = estimate_peak(nodes, input_sizes, action_name)
+    counts = consumer_counts(nodes)
+    last_user = {}
+    for node in nodes:
+        for key in node.inputs:
+            last_user[key] = node.index
+    lines = [f"【执行计划】节点数={len(nodes)}, 线程数={workers}, 估计内存峰值={format_bytes(peak)}(按顺序执行估计, 并行时可能更高)"]
+    for node in nodes:
+        deps = ",".join(str(i + 1) for i in sorted(node.deps)) or "无"
+        frees = [f"{k[0]}@{k[1]}" for k in node.inputs if last_user[k] == node.index] + \
+                [f"{k[0]}@{k[1]}" for k in node.outputs if counts[k] == 0]
+        outputs = ",".join(f"{k[0]}@{k[1]}" for k in node.outputs) or "无"
+        lines.append(f"  [{node.index + 1}] {node.label()}  依赖=[{deps}]  输出={outputs}"
+                     f"(估计 {format_bytes(sum(sizes[k] for k in node.outputs))})"
+                     f"  释放=[{','.join(frees) or '无'}]")
+    return "\n".join(lines)
+
+
+def run_plan(nodes: list, execute, workers: int, on_done=None):
+    """
+    在线程池中执行计划。execute(node, inputs: {符号: DataFrame}) 返回 {符号: DataFrame}。
+    每个版本在最后一个使用者执行完后释放; 每个节点完成后调用 on_done(node)。
+    出错(包括 on_done 抛出异常)时不再提交新节点, 等待正在执行的节点结束后抛出异常。
+    """
+    frames = {}
+    counts = consumer_counts(nodes)
+    remaining = {node.index: len(node.deps) for node in nodes}
+    dependents = defaultdict(list)
+    for node in nodes:
+        for dep in node.deps:
+            dependents[dep].append(node.index)
+
+    def release(key):
+        if counts[key] == 0:
+            frames.pop(key, None)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+
+        def submit(node):
+            inputs = {key[0]: frames[key] for key in node.inputs}
+            running[pool.submit(execute, node, inputs)] = node
+
+        for node in nodes:
+            if remaining[node.index] == 0:
+                submit(node)
+
+        error = None
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                try:
+                    outputs = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                for key in node.outputs:
+                    frames[key] = outputs[key[0]]
+                for key in node.inputs:
+                    counts[key] -= 1
+                    release(key)
+                for key in node.outputs:
+                    release(key)
+                if on_done is not None and error is None:
+                    try:
+                        on_done(node)
+                    except Exception as e:
+                        error = e
+                if error is None:
+                    for index in dependents[node.index]:
+                        remaining[index] -= 1
+                        if remaining[index] == 0:
+                            submit(nodes[index])
+        if error is not None:
+            raise error
+
+    log(f"【执行计划】全部 {len(nodes)} 个节点执行完成", level='info')
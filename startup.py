@@ -0,0 +1,44 @@
+import importlib
+import time
+
+"""
+启动耗时统计。main.py 最先导入本模块, 记录启动的各个阶段和各模块的导入耗时。
+数据处理相关的模块(pandas, numpy, openpyxl 等)不在启动时导入, 窗口显示后由后台线程预热(warm_up)。
+完整的导入树可以用 python -X importtime main.py 查看。
+"""
+
+START = time.perf_counter()
+records = []  # [(名称, 秒数), ...]
+
+# 数据处理相关的模块, 按依赖顺序导入, 每项的耗时不含之前已导入的模块
+DATA_MODULES = ["numpy", "pandas", "openpyxl", "cache", "utils", "rule_engine", "tool", "scheduler", "logic", "viewer"]
+
+
+class stage:
+    """with stage("名称"): ... 记录一个启动阶段的耗时"""
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        records.append((self.name, time.perf_counter() - self.start))
+
+
+def timed_import(name: str):
+    with stage(f"import {name}"):
+        return importlib.import_module(name)
+
+
+def warm_up():
+    """导入数据处理相关的模块, 已导入的模块不重复计时"""
+    for name in DATA_MODULES:
+        timed_import(name)
+
+
+def report() -> str:
+    lines = [f"【启动耗时】从启动到现在共 {time.perf_counter() - START:.3f} 秒"]
+    lines += [f"  {name:<28} {seconds * 1000:>8.1f} ms" for name, seconds in records]
+    return "\n".join(lines)
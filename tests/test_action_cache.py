@@ -0,0 +1,20 @@
+import os
+import pandas as pd
+import action_cache
+
+
+def test_pending_result_survives_eviction(tmp_path, monkeypatch):
+    monkeypatch.setattr(action_cache, "CACHE_DIR", str(tmp_path))
+    old, new = pd.DataFrame({"a": range(1000)}), pd.DataFrame({"b": range(1000)})
+    action_cache.save("old", old, {"label": "old"})
+    os.utime(action_cache.cache_file("old"), (0, 0))  # 最久未使用
+    # 磁盘预算只够一个结果
+    monkeypatch.setattr(action_cache, "MAX_BYTES", os.path.getsize(action_cache.cache_file("old")) + 100)
+
+    results = action_cache.Results(read=None)
+    df_dict = {}
+    assert results.restore("old", "rm_row", {"df": "x->y"}, df_dict)
+    # 命中的结果还未读取时写入新的结果, 不应清理命中的结果
+    results.store("new", "rm_row", {"df": "x->z"}, {"z": new})
+    results.materialize({"df": "y->None"}, df_dict)
+    pd.testing.assert_frame_equal(df_dict["y"], old)
@@ -0,0 +1,97 @@
+import pandas as pd
+import pytest
+import compact
+from logic import Logic
+
+
+@pytest.fixture
+def workbook(tmp_path, monkeypatch):
+    """在临时目录中写入输入表格, 并切换到该目录(读取缓存、日志和导出都在其中)"""
+    monkeypatch.chdir(tmp_path)
+    df = pd.DataFrame({
+        "单号": ["A1", "A1", "A2", "A3", "A3", "A4"] * 5,
+        "品名": ["水桶", "花盆", "喷壶", "铲子", "水桶", "花盆"] * 5,
+        # 整数形式的大数值(2.5 使该列读入为浮点), 降为 float32 后转为字符串会变成 1e+08
+        "数量": [100000000.0, 250000000.0, 2.5, 16777216.0, 5.0, 300000000.0] * 5,
+        "城市": ["广州", None, "深圳", None, "上海"] * 6,
+    })
+    df.to_excel(tmp_path / "in.xlsx", index=False)
+    return "in.xlsx"
+
+
+def run(path: str, actions: dict, **options):
+    """执行 action_loop, 返回导出的表 {文件名: DataFrame}"""
+    config = {"files": {"表": {"symbol": "df", "path": path}}, "actions": actions,
+              "options": {"bypass_cache": True, "preview": True, **options}}
+    return Logic.action_loop(config)
+
+
+def assert_same_exports(expected: dict, actual: dict):
+    """导出的值相同(分类列还原后比较, 不比较类型); 并行执行时 export 的先后不确定"""
+    assert sorted(actual) == sorted(expected)
+    for name, df in expected.items():
+        pd.testing.assert_frame_equal(compact.expand(actual[name]).reset_index(drop=True),
+                                      compact.expand(df).reset_index(drop=True), check_dtype=False)
+
+
+def test_compact_keeps_large_float_strings(workbook):
+    actions = {
+        "1": {"format": {"df": "df->f", "format_rules": {"concat": [["x", "品名", "数量"]]},
+                         "columns": ["单号", "x"], "log_columns": [], "name": "f"}},
+        "2": {"export": {"df": "df->None", "export_dtype": {"str": ["数量"]}, "name": "D", "suffix": "",
+                         "count_cols": []}},
+        "3": {"export": {"df": "f->None", "export_dtype": {}, "name": "F", "suffix": "", "count_cols": []}},
+    }
+    plain = run(workbook, actions)
+    assert_same_exports(plain, run(workbook, actions, compact=True))
+    assert "100000000.0" in plain[next(k for k in plain if " D " in k)]["数量"].tolist()
+
+
+# 覆盖各类动作; 不含 add_row: 分块执行时新行追加在每块的末尾, 位置与整表执行不同
+ACTIONS = {
+    "1": {"rm_row": {"df": "df->df", "rm_rules": [{"品名": "铲子"}], "log_columns": ["单号"]}},
+    "2": {"alter_val": {"df": "df->df", "alter_rules": {"品名": {"喷壶": {"城市": "杭州"}}}, "log_columns": ["单号"]},
+          "add_col": {"df": "df->df", "add_rules": {"仓库": {"WH1": [{"品名": "水桶"}], "WH2": [{"城市": "广州"}]}},
+                      "log_columns": ["单号"], "name": "c"}},
+    "3": {"split": {"df": "df->a,b", "split_rules": [{"仓库": "WH1"}], "extract": True, "log_columns": ["单号"],
+                    "name": "s"}},
+    "4": {"format": {"df": "a->fa", "format_rules": {"copy": [["订单", "单号"]], "constant": [["来源", "表"]],
+                                                     "concat": [["说明", "品名", "城市"]]},
+                     "columns": ["订单", "来源", "说明", "备注"], "log_columns": [], "name": "f"},
+          "fill": {"df": "b->bf", "by": ["单号"], "log_columns": ["单号"]}},
+    "5": {"eq_sum": {"df": "bf->e", "by": ["单号"], "eq": ["品名"], "sum": ["数量"], "log_columns": ["单号"]}},
+    "6": {"concat_df": {"df": "e,fa->g", "axis": 0}},
+    "7": {"export": {"df": "fa->None", "export_dtype": {}, "name": "A", "suffix": "", "count_cols": []}},
+    "8": {"export": {"df": "e->None", "export_dtype": {"str": ["数量"]}, "name": "E", "suffix": "",
+                     "count_cols": ["单号"]}},
+    "9": {"export": {"df": "g->None", "export_dtype": {}, "name": "G", "suffix": "", "count_cols": []}},
+}
+
+
+@pytest.mark.parametrize("options", [
+    {"chunksize": 7},
+    {"workers": 2},
+    {"copy_free": True},
+    {"compact": True},
+    {"workers": 2, "copy_free": True, "compact": True},
+], ids=lambda options: ",".join(options))
+def test_execution_modes_match_sequential(workbook, options):
+    expected = run(workbook, ACTIONS)
+    assert len(expected) == 3
+    assert_same_exports(expected, run(workbook, ACTIONS, **options))
+
+
+def test_chunked_types_match_whole_sheet(tmp_path, monkeypatch):
+    # 第一块(10 行)只有整数形式的浮点数, 单独推断时为整数; 整表中为浮点数
+    monkeypatch.chdir(tmp_path)
+    pd.DataFrame({"单号": [f"A{i}" for i in range(15)], "数量": [5.0] * 10 + [2.5] * 5}).to_excel("in.xlsx", index=False)
+    actions = {
+        "1": {"rm_row": {"df": "df->df", "rm_rules": [{"数量": r"^5\.0$", "单号": "A9"}], "log_columns": ["单号"]}},
+        "2": {"format": {"df": "df->f", "format_rules": {"concat": [["x", "单号", "数量"]]},
+                         "columns": ["x"], "log_columns": [], "name": "f"}},
+        "3": {"export": {"df": "f->None", "export_dtype": {}, "name": "F", "suffix": "", "count_cols": []}},
+    }
+    expected = run("in.xlsx", actions)
+    assert next(iter(expected.values()))["x"].tolist()[:2] == ["A0 5.0", "A1 5.0"]
+    assert next(iter(expected.values())).shape[0] == 14
+    assert_same_exports(expected, run("in.xlsx", actions, chunksize=10))
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils import compare_df
+
+
+def normalized(comparison: pd.DataFrame):
+    """
+    差异表的值按字符串比较(两个引擎的缺失值和类型可能不同);
+    loop 引擎按集合遍历分组, 行的顺序和差异列出现的顺序不确定
+    """
+    comparison = comparison.fillna('').astype(str)
+    comparison = comparison[comparison.columns[:1].tolist() + sorted(comparison.columns[1:])]
+    return comparison.sort_values(by=comparison.columns.tolist(), kind='stable').reset_index(drop=True)
+
+
+def assert_same_result(df1, df2, sort_columns):
+    eq_loop, loop = compare_df(df1, df2, sort_columns, engine="loop")
+    eq_merge, merge = compare_df(df1, df2, sort_columns, engine="merge")
+    assert eq_merge == eq_loop
+    if not eq_loop:
+        # 完全一致时 loop 引擎返回的是未筛选的比较表, 只比较结论
+        pd.testing.assert_frame_equal(normalized(merge), normalized(loop), check_dtype=False)
+    return eq_merge
+
+
+def test_int_vs_float_column():
+    # 整数 1 与浮点 1.0 的字符串不同, 两个引擎都应报告差异
+    df1 = pd.DataFrame({"k": ["a", "b"], "v": [1, 2]})
+    df2 = pd.DataFrame({"k": ["a", "b"], "v": [1.0, 2.0]})
+    assert assert_same_result(df1, df2, ["k"]) is False
+
+
+def test_int_vs_float_sort_column():
+    df1 = pd.DataFrame({"k": [1, 2], "v": ["x", "y"]})
+    df2 = pd.DataFrame({"k": [1.0, 2.0], "v": ["x", "y"]})
+    assert assert_same_result(df1, df2, ["k"]) is False
+
+
+def random_frames(seed: int, n=200):
+    """两个相近的随机表: 重复的键, 缺失值, 首尾空白, 整数列与浮点列"""
+    rng = np.random.default_rng(seed)
+    keys = rng.choice(["a", " a", "b ", "c", "d"], n)
+    df1 = pd.DataFrame({
+        "k1": keys,
+        "k2": rng.integers(0, 40, n),
+        "s": rng.choice(["x", " x", "y", None, ""], n),
+        "f": np.where(rng.random(n) < 0.2, np.nan, rng.integers(0, 3, n).astype(float)),
+        "i": rng.integers(0, 3, n),
+    })
+    # 删除、重复和修改少量的行, 多数分组在两表中相同
+    df2 = df1[rng.random(n) > 0.05]
+    df2 = pd.concat([df2, df1.sample(n=n // 30, random_state=seed)]).reset_index(drop=True)
+    changed = rng.random(df2.shape[0]) < 0.05
+    df2.loc[changed, "s"] = rng.choice(["x ", "z", None], changed.sum())
+    if seed % 2:
+        # 表2 的整数列读入为浮点
+        df2["i"] = df2["i"].astype(float)
+    return df1, df2
+
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("sort_columns", [["k1"], ["k1", "k2"]])
+def test_merge_matches_loop_on_random_frames(seed, sort_columns):
+    df1, df2 = random_frames(seed)
+    assert_same_result(df1, df2, sort_columns)
+    assert assert_same_result(df1, df1.copy(), sort_columns) is True
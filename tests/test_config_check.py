@@ -0,0 +1,24 @@
+import config_check
+
+
+def export_config(fmt):
+    return {"files": {"表": "df"},
+            "actions": {"1": {"export": {"df": "df->None", "export_dtype": {}, "name": "A", "suffix": "",
+                                         "count_cols": [], "format": fmt}}}}
+
+
+def test_arrow_formats_require_pyarrow(monkeypatch):
+    monkeypatch.setattr(config_check, "has_pyarrow", lambda: False)
+    assert config_check.check_action_loop(export_config("csv")) == []
+    errors = config_check.check_action_loop(export_config("parquet"))
+    assert len(errors) == 1 and "pyarrow" in errors[0]
+    config = {**export_config("xlsx"), "options": {"export_format": "feather"}}
+    assert len(config_check.check_action_loop(config)) == 1
+
+    monkeypatch.setattr(config_check, "has_pyarrow", lambda: True)
+    assert config_check.check_action_loop(export_config("parquet")) == []
+
+
+def test_unknown_export_format():
+    errors = config_check.check_action_loop(export_config("xls"))
+    assert len(errors) == 1 and "'xls'" in errors[0]
@@ -0,0 +1,38 @@
+import logging
+import os
+import pandas as pd
+import pytest
+import log
+
+
+@pytest.fixture
+def level():
+    """设置日志级别, 结束后恢复(setLevel 会清除 isEnabledFor 的缓存)"""
+    old = log.logger.level
+    yield log.logger.setLevel
+    log.logger.setLevel(old)
+
+
+def test_log_df_rows_file_and_prune(tmp_path, monkeypatch, level):
+    monkeypatch.setattr(log, "LOG_ROWS_DIR", str(tmp_path))
+    level(logging.INFO)
+    df = pd.DataFrame({"a": range(log.LOG_MAX_ROWS + 1)})
+    for _ in range(3):
+        log.log_df(df)
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 3
+    assert all(f"_{os.getpid()}_" in name for name in files)
+    pd.testing.assert_frame_equal(pd.read_pickle(tmp_path / files[0]), df)
+
+    for age, name in enumerate(files):
+        os.utime(tmp_path / name, (age, age))
+    log.prune_rows_files(keep=1)
+    assert os.listdir(tmp_path) == [files[-1]]
+
+
+def test_log_df_skipped_when_level_disabled(tmp_path, monkeypatch, level):
+    monkeypatch.setattr(log, "LOG_ROWS_DIR", str(tmp_path))
+    level(logging.WARNING)
+    log.log_df(pd.DataFrame({"a": range(log.LOG_MAX_ROWS + 1)}), level='info')
+    assert not log.log_enabled('info')
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+import partition
+from utils import compare_df
+
+
+def frames(seed=0, n=300):
+    rng = np.random.default_rng(seed)
+    df1 = pd.DataFrame({"单号": rng.choice([f"D{i}" for i in range(40)], n),
+                        "品名": rng.choice(["水桶", "花盆", "喷壶"], n),
+                        "数量": rng.integers(0, 5, n)})
+    df2 = df1.sample(frac=0.9, random_state=seed).reset_index(drop=True)
+    df2.loc[rng.random(df2.shape[0]) < 0.1, "数量"] = 9
+    return df1, df2
+
+
+@pytest.mark.parametrize("engine", ["merge", "loop"])
+def test_partitioned_result_matches_compare_df(tmp_path, monkeypatch, engine):
+    monkeypatch.setattr(partition, "SPILL_DIR", str(tmp_path / "spill"))
+    df1, df2 = frames()
+    df1.to_excel(tmp_path / "1.xlsx", index=False)
+    df2.to_excel(tmp_path / "2.xlsx", index=False)
+    sort_columns = ["单号", "品名"]
+
+    def write(df_eq, chunks):
+        return df_eq, pd.concat(list(chunks), ignore_index=True)
+
+    df_eq, result = partition.compare_files(str(tmp_path / "1.xlsx"), str(tmp_path / "2.xlsx"), sort_columns,
+                                            df1.columns.tolist(), write, n_partitions=4, engine=engine,
+                                            chunksize=50)
+    expected_eq, expected = compare_df(df1, df2, sort_columns, engine="merge")
+    assert df_eq == expected_eq
+    pd.testing.assert_frame_equal(result.fillna('').astype(str),
+                                  expected.fillna('').astype(str).reset_index(drop=True), check_dtype=False)
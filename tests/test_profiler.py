@@ -0,0 +1,45 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import profiler
+
+
+@pytest.fixture
+def reports(monkeypatch):
+    """收集写入的报告 {run 的名字: 记录的名字列表}, 不写文件"""
+    result = {}
+    monkeypatch.setattr(profiler, "write_report",
+                        lambda current: result.__setitem__(current.name, [r.name for r in current.records]))
+    return result
+
+
+def test_concurrent_runs_do_not_mix(reports):
+    barrier = threading.Barrier(2)
+
+    def job(name):
+        with profiler.run(name):
+            barrier.wait()
+            with profiler.span(f"{name} span"):
+                barrier.wait()
+
+    threads = [threading.Thread(target=job, args=(name,)) for name in ("a", "b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert reports == {"a": ["a", "a span"], "b": ["b", "b span"]}
+
+
+def test_bind_records_pool_tasks_into_run(reports):
+    def task(n):
+        with profiler.span(f"task {n}"):
+            return profiler.active()
+
+    with profiler.run("main"):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            assert all(pool.map(profiler.bind(task), range(3)))
+        # 未包装的任务不在 run 中
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            assert pool.submit(task, 9).result() is False
+    assert sorted(reports["main"]) == ["main", "task 0", "task 1", "task 2"]
+    assert not profiler.active()
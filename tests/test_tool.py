@@ -0,0 +1,21 @@
+import pandas as pd
+import tool
+
+RULES = {"copy": [["x", "a"]], "constant": [["k", 1]], "concat": [["c", "a", "b"]]}
+
+
+def test_format_empty_input_has_object_columns():
+    df = pd.DataFrame({"a": pd.Series([], dtype="int64"), "b": pd.Series([], dtype="str")})
+    result = tool.format(df, RULES, ["x", "k", "c", "y"], [], "f")
+    assert result.columns.tolist() == ["x", "k", "c", "y"]
+    assert result.shape[0] == 0
+    assert (result.dtypes == object).all()
+
+
+def test_format_builds_columns():
+    df = pd.DataFrame({"a": [1, 2], "b": [" u", None]})
+    result = tool.format(df, RULES, ["x", "k", "c", "y"], [], "f")
+    assert result["x"].tolist() == [1, 2]
+    assert result["k"].tolist() == [1, 1]
+    assert result["c"].tolist() == ["1  u", "2"]
+    assert result["y"].isna().all()
@@ -1,54 +1,83 @@
+import json
+import os
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from log import log, log_df
-import re
+from log import log, log_df, log_enabled
 from datetime import datetime
-from utils import write_excel, set_df_dtype
+from utils import write_table, set_df_dtype
+import rule_engine
+import compact
+import profiler
 
 """根据排序列列表，筛选重复行，用重复行的数据补充缺失值信息"""
-def fill(df: pd.DataFrame, by: list, log_columns: list):
-    df_t = df.copy()
+def fill(df: pd.DataFrame, by: list, log_columns: list, inplace=False):
+    """inplace 为 True 时直接修改 df, 由调用者保证 df 不再被其他地方使用"""
+    df_t = df if inplace else df.copy()
+    rule_engine.carry(df, df_t)
 
     # 检查排序列是否存在且不为空
     for col in by:
         if col not in df.columns or df[col].isnull().all():
             log(f"排序列 '{col}' 不存在或包含空值.", level='warning')
     
-    duplicate_mask = df_t.duplicated(subset=by, keep=False)  # 包括第一次出现的
-    duplicate_first = duplicate_mask & (~df_t.duplicated(subset=by, keep='first'))  # 仅用作日志
+    index = rule_engine.group_index(df_t, by)
+    duplicate_mask = index.duplicated(keep=False)  # 包括第一次出现的
+    log_rows = log_enabled('info')
+    df_before = df_t.loc[duplicate_mask, log_columns] if log_rows else None  # 仅用作日志, 只保留受影响的行和列
     
-    other = list(set(df_t.columns.tolist()) - set(by))
-    df_t[other] = df_t.groupby(by)[other].transform(lambda df_group: df_group.ffill().bfill())
+    # 逐组向前、向后填充(向量化): 只处理重复组中有缺失值的列, 按行号取值, 列类型(包括分类列)不变;
+    # 排序列中有缺失值的行不属于任何组, 保持原值
+    other = [column for column in df_t.columns if column not in by]
+    filled = []
+    for column in other:
+        missing = df_t[column].isna().to_numpy()
+        if (missing & duplicate_mask).any():
+            source = index.fill_source(missing)
+            df_t[column] = df_t[column].take(source).set_axis(df_t.index)
+            filled.append(column)
+    rule_engine.invalidate(df_t, filled)
     
-    # 打印日志
-    log_df(df.loc[duplicate_mask, log_columns], f"【重复组缺失值】按照排序列 '{by}' 筛选的重复组: 数量={sum(duplicate_first)}", level='info')
-    log_df(df_t.loc[duplicate_mask, log_columns], f"【重复组缺失值】补充缺失值后: ", level='info')
+    # 打印日志(日志级别未启用时不取出这些行)
+    if log_rows:
+        log_df(df_before, f"【重复组缺失值】按照排序列 '{by}' 筛选的重复组: 数量={(index.counts > 1).sum()}", level='info')
+        log_df(df_t.loc[duplicate_mask, log_columns], f"【重复组缺失值】补充缺失值后: ", level='info')
     return df_t
 
 
 """根据排序列找到重复组，并根据判等列判断两行是否相等。如果相等，则删除其中一个，并累加指定的列"""
-def eq_sum(df: pd.DataFrame, by: list, eq: list, sum1: list, log_columns: list):
-    """log_columns 仅用作打印日志"""
-    df_t = df.copy()
+def eq_sum(df: pd.DataFrame, by: list, eq: list, sum1: list, log_columns: list, inplace=False):
+    """log_columns 仅用作打印日志; inplace 为 True 时直接修改 df"""
+    df_t = df if inplace else df.copy()
+    rule_engine.carry(df, df_t)
 
     # 检查排序列是否存在且不为空
     for col in by:
         if col not in df.columns or df[col].isnull().all():
             log(f"排序列 '{col}' 不存在或包含空值.", level='warning')
     
-    # 累加
-    # [sum] 取出 sum 列的所有分组 -> DataFrameGroupBy 
+    # 删除(累加不改变 by 和 eq 列, 可以先计算)
+    index = rule_engine.group_index(df_t, by + eq)
+    duplicates_non_first = index.duplicated(keep='first')
+    duplicates_first = index.duplicated(keep=False) & ~duplicates_non_first
+    log_rows = log_enabled('info')
+    df_removed = df_t.loc[duplicates_non_first, log_columns] if log_rows else None  # 仅用作日志, 只保留受影响的行和列
+
+    # 累加(降位的数值列先还原为 64 位, 避免溢出)
+    compact.widen(df_t, sum1)
+    # [sum] 按分组编号取出 sum 列的所有分组 -> DataFrameGroupBy 
     # .transform('sum') 对分组进行变换操作 -> DataFrame
-    df_t[sum1] = df_t.groupby(by + eq)[sum1].transform('sum')  
-
-    # 删除
-    duplicates_non_first = df_t.duplicated(subset=by + eq, keep='first')
-    duplicates_first = df_t.duplicated(subset=by + eq, keep=False) & (~duplicates_non_first)
+    df_t[sum1] = df_t[sum1].groupby(index.keys()).transform('sum')
+    rule_engine.invalidate(df_t, sum1)
 
-    # 打印日志
-    log_df(df.loc[duplicates_non_first, log_columns], f"【删除重复行 & 累加】 by={by} eq={eq} sum={sum1}, 要删除的行: 数量={sum(duplicates_non_first)}", level='info')
-    log_df(df_t.loc[duplicates_first, log_columns], f"【删除重复行 & 累加】 by={by} eq={eq} sum={sum1}, 保留的行: 数量={sum(duplicates_first)}", level='info')
+    # 打印日志(日志级别未启用时不取出这些行)
+    if log_rows:
+        log_df(df_removed, f"【删除重复行 & 累加】 by={by} eq={eq} sum={sum1}, 要删除的行: 数量={duplicates_non_first.sum()}", level='info')
+        log_df(df_t.loc[duplicates_first, log_columns], f"【删除重复行 & 累加】 by={by} eq={eq} sum={sum1}, 保留的行: 数量={duplicates_first.sum()}", level='info')
 
-    return df_t[~duplicates_non_first]
+    df_result = df_t[~duplicates_non_first]
+    rule_engine.carry(df_t, df_result, ~duplicates_non_first)
+    return df_result
 
 
 """筛选某列的值，移除符合条件的行，并且可以使用正则表达式进行筛选"""
@@ -56,28 +85,37 @@ def rm_row(df: pd.DataFrame, rm_rules: list[dict[str: str]], log_columns: list[s
     """log_columns 仅用作打印日志
     [{}, {}]
     """
-    df_t = df.copy()
-
-    mask = pd.Series(False, index=df_t.index)
+    mask = pd.Series(False, index=df.index)
 
     for rule in rm_rules:
-        mask0 = pd.Series(True, index=df_t.index)
+        profiler.phase(_rule_name(rule), "rule")
+        mask0 = pd.Series(True, index=df.index)
         for column, regex in rule.items():
             # 并
-            mask0 &= df_t[column].astype(str).str.contains(regex, regex=True, na=False, flags=re.IGNORECASE)
+            mask0 &= rule_engine.match(df, column, regex)
         mask |= mask0
+        if profiler.active():
+            profiler.annotate(matched=int(mask0.sum()))
+    profiler.phase(None)
     
-    df_t = df_t[~mask]
+    df_t = df[~mask]  # 布尔索引已返回新表(写时复制), 不再复制
+    rule_engine.carry(df, df_t, ~mask)
 
-    # 打印日志
+    # 打印日志(日志级别未启用时不取出这些行)
     if mask.any():
-        log_df(df.loc[mask, log_columns], f"【删除行】根据如下规则 '{rm_rules}' 要删除的行: ", level='info')
+        if log_enabled('info'):
+            log_df(df.loc[mask, log_columns], f"【删除行】根据如下规则 '{rm_rules}' 要删除的行: ", level='info')
     else:
         log("【删除行】根据规则 '{rm_rules}' 没筛选出要删除的行")
 
     return df_t
 
 
+def _rule_name(rule: dict):
+    """规则在性能剖析报告中的名称"""
+    return " & ".join(f"{column}={value}" for column, value in rule.items()) or "(全部)"
+
+
 """根据某列的值进行筛选，通过规则增加行。"""
 def add_row(df: pd.DataFrame, add_rules: dict[str: dict[str: list[dict[str: str]]]], log_columns: list[str]) -> pd.DataFrame:
     """
@@ -88,78 +126,137 @@ def add_row(df: pd.DataFrame, add_rules: dict[str: dict[str: list[dict[str: str]
     :param log_columns: 用于打印日志的列名列表
     :return: 增加行后的 DataFrame
     """
-    df_t = df.copy()
-
-    # 创建一个空 DataFrame 用于存储新增的行
-    new_rows = pd.DataFrame(columns=df_t.columns)
-    matched_rows_4log = pd.DataFrame(columns=df_t.columns)
-    
-    # 遍历规则
-    def alter_row(row, alter_rule: dict):
-        for new_col, new_val in alter_rule.items():
-            row[new_col] = new_val
-        return row
-
+    # df 不会被修改, 新行拼接时才产生新表, 无需复制
+    # 先收集每个模板匹配的行号, 一次取出全部新行, 再逐列批量填入各模板的值, 最后只拼接一次
+    matched_positions = []  # 仅用作日志
+    templates = []  # [(匹配的行号, 新行的值), ...], 顺序与逐条规则追加时相同
     for column, rules in add_rules.items():
         for value, new_row_data_list in rules.items():
             # 筛选出符合条件的行
-            mask = df_t[column].astype(str).str.contains(value, regex=True, na=False, flags=re.IGNORECASE)
-            if mask.any():
-                matched_rows = df_t[mask]
-                matched_rows_4log = pd.concat([matched_rows_4log, matched_rows], ignore_index=True, axis=0)
-                
-                # 为每个匹配的行生成新行
+            profiler.phase(f"{column}={value}", "rule")
+            positions = np.flatnonzero(rule_engine.match(df, column, value).to_numpy())
+            if profiler.active():
+                profiler.annotate(matched=len(positions))
+            if len(positions):
+                matched_positions.append(positions)
                 for new_row_data in new_row_data_list:
-                    new_matched_rows = matched_rows.apply(alter_row, alter_rule=new_row_data, axis=1)
-                    new_rows = pd.concat([new_rows, new_matched_rows], ignore_index=True)
-    
-    # 打印新增的行的日志信息
-    if not new_rows.empty:
-        log_df(matched_rows_4log[log_columns], f"【增加行】根据 '{add_rules}' 匹配到的行: 数量={matched_rows_4log.shape[0]}", level='info')
-        log_df(new_rows[log_columns], f"【增加行】新增的行: 数量={new_rows.shape[0]}", level='info')
-    else:
+                    templates.append((positions, new_row_data))
+    profiler.phase(None)
+
+    if not templates:
         log(f"【增加行】根据 '{add_rules}' 匹配到的行: 数量=0", level='info')
-    
+        return df.copy()
+
+    # 为每个匹配的行生成新行: 每个模板对应 new_rows 中连续的一段
+    new_rows = df.take(np.concatenate([positions for positions, _ in templates])).reset_index(drop=True)
+    segment = np.repeat(np.arange(len(templates)), [len(positions) for positions, _ in templates])  # 每个新行的模板
+    for new_col in dict.fromkeys(new_col for _, new_row_data in templates for new_col in new_row_data):
+        # 所有设置该列的模板的值放在一列中, 一起推断类型; 再按每个新行的模板取值
+        used = [i for i, (_, new_row_data) in enumerate(templates) if new_col in new_row_data]
+        values = pd.Series([templates[i][1][new_col] for i in used])
+        lookup = np.full(len(templates), -1)
+        lookup[used] = np.arange(len(used))
+        which = lookup[segment]
+        is_set = which >= 0
+        column = values.take(which[is_set]).set_axis(np.flatnonzero(is_set))
+        if not is_set.all():
+            # 其余新行保留原值, 原表没有该列时为空
+            if new_col in new_rows.columns:
+                column = pd.concat([new_rows[new_col][~is_set], column]).sort_index()
+            else:
+                column = column.reindex(new_rows.index)
+        new_rows[new_col] = column
+
     # 将新行追加到原始 DataFrame 中
-    df_t = pd.concat([df_t, new_rows], ignore_index=True)
-    
+    df_t = pd.concat([df, new_rows], ignore_index=True)
+    compact.restore(df_t, df)
+
+    # 打印新增的行的日志信息
+    matched_rows_4log = df.take(np.concatenate(matched_positions))
+    log_df(matched_rows_4log[log_columns], f"【增加行】根据 '{add_rules}' 匹配到的行: 数量={matched_rows_4log.shape[0]}", level='info')
+    log_df(df_t.iloc[df.shape[0]:][log_columns], f"【增加行】新增的行: 数量={new_rows.shape[0]}", level='info')
+
     return df_t
 
 
 """根据改列值规则，进行某列的筛选和改值。"""
-def alter_val(df: pd.DataFrame, alter_rules: dict[str: dict[str: str]], log_columns: list[str]):
+def alter_val(df: pd.DataFrame, alter_rules: dict[str: dict[str: str]], log_columns: list[str], inplace=False):
     '''{'MSKU': {'原MSKU': {'品名': '新品名', 'MSKU': '新MSKU'}}},
-    log_columns仅为日志输出
+    log_columns仅为日志输出; inplace 为 True 时直接修改 df
     '''
-    df_t = df.copy()
-
-    def alter_row(row, alter_rule: dict):
-        for new_col, new_val in alter_rule.items():
-            row[new_col] = new_val
-        return row
-
-    mask_total = pd.Series(False, index=df_t.index)  # 仅作日志使用
-    columns_altered = list(set(k3 for v1 in alter_rules.values() for v2 in v1.values() for k3 in v2.keys()))  # 仅作日志使用
-    columns_by = list(k for k in alter_rules.keys())  # 仅作日志使用
+    df_t = df if inplace else df.copy()
+    rule_engine.carry(df, df_t)
+
+    columns_by = list(alter_rules.keys())  # 仅作日志使用
+    columns_altered = list(dict.fromkeys(k3 for v1 in alter_rules.values() for v2 in v1.values() for k3 in v2.keys()))
+    for column in columns_altered:
+        if column not in df_t.columns:
+            log(f"【改列值】列 '{column}' 不存在, 忽略对该列的修改", level='warning')
+    columns_altered = [c for c in columns_altered if c in df_t.columns]
+
+    # 改动记录: (行号, 列名, 原值, 新值, 规则), 日志中的修改前的值由它还原, 不需要复制整表
+    changes = []
+    owner = {}  # 列名 -> 每行最后一次修改该列的规则序号(-1 表示未修改), 用于检查冲突
+    conflicts = {}  # (列名, 先前的规则, 后来的规则) -> 行数
+    labels = []
+    mask_total = np.zeros(df_t.shape[0], dtype=bool)  # 仅作日志使用
 
     for column, rules in alter_rules.items():
         for value, alter_row_data_dict in rules.items():
             # 筛选出符合条件的行
-            mask = df_t[column].astype(str).str.contains(value, regex=True, na=False, flags=re.IGNORECASE)
-
-            if mask.any():
-                mask_total |= mask
-                matched_rows = df_t[mask]
-                df_t[mask] = matched_rows.apply(alter_row, alter_rule=alter_row_data_dict, axis=1)
+            profiler.phase(f"{column}={value}", "rule")
+            mask = rule_engine.match(df_t, column, value).to_numpy()
+            if profiler.active():
+                profiler.annotate(matched=int(mask.sum()))
+            if not mask.any():
+                continue
+            rule = len(labels)
+            labels.append(f"{column}={value}")
+            positions = np.flatnonzero(mask)
+            mask_total |= mask
+
+            # 逐列批量写入, 其余列(可能是压缩过的类型)保持不变
+            for new_col, new_val in alter_row_data_dict.items():
+                if new_col not in df_t.columns:
+                    continue
+                previous = owner.setdefault(new_col, np.full(df_t.shape[0], -1))[positions]
+                for earlier in np.unique(previous[previous >= 0]):
+                    key = (new_col, labels[earlier], labels[rule])
+                    conflicts[key] = conflicts.get(key, 0) + int((previous == earlier).sum())
+                owner[new_col][positions] = rule
+                changes.append((positions, new_col, df_t[new_col].iloc[positions].to_numpy(dtype=object), new_val))
+
+                compact.accept(df_t, new_col, [new_val])
+                try:
+                    df_t.loc[mask, new_col] = new_val
+                except (TypeError, ValueError):
+                    # 新值与列的类型不兼容(例如向整数列写入文本), 转为 object 列后写入
+                    df_t[new_col] = df_t[new_col].astype(object)
+                    df_t.loc[mask, new_col] = new_val
+            rule_engine.invalidate(df_t, alter_row_data_dict.keys())
+    profiler.phase(None)
+
+    # 同一行的同一列被多条规则修改时, 后面的规则生效
+    for (new_col, earlier, later), count in conflicts.items():
+        log(f"【改列值】规则冲突: 列 '{new_col}' 有 {count} 行先被规则 '{earlier}' 修改, 又被规则 '{later}' 修改, "
+            f"以规则 '{later}' 为准", level='warning')
 
     # 打印日志
     if mask_total.any():
-        df_by = df.loc[mask_total, columns_by]
-        df_static = df.loc[mask_total, list(set(log_columns) - set(columns_altered) - set(columns_by))]
-        df_before = df.loc[mask_total, columns_altered].copy().rename(columns=lambda x: f"before_{x}")
-        df_after = df_t.loc[mask_total, columns_altered].copy().rename(columns=lambda x: f"after_{x}")
+        rows = np.flatnonzero(mask_total)
+        columns_before = list(dict.fromkeys(columns_by + columns_altered))
+        # 修改前的值: 先取当前值, 再按改动记录从后往前还原, 每个位置最终为第一次修改前的值
+        before = {c: df_t[c].to_numpy(dtype=object)[rows] for c in columns_before}
+        for positions, new_col, old_values, _ in reversed(changes):
+            before[new_col][np.searchsorted(rows, positions)] = old_values
+        index = df_t.index[rows]
+        df_by = pd.DataFrame({c: before[c] for c in columns_by}, index=index)
+        df_before = pd.DataFrame({f"before_{c}": before[c] for c in columns_altered}, index=index)
+        df_after = df_t.iloc[rows][columns_altered].rename(columns=lambda x: f"after_{x}")
+        df_static = df_t.iloc[rows][[c for c in log_columns if c not in columns_altered and c not in columns_by]]
         df_comparison = pd.concat([df_by, df_before, df_after, df_static], axis=1)
-        log_df(df_comparison, f"【改列值】根据改值规则 '{alter_rules}', 修改如下: 行数={df_comparison.shape[0]}")
+        log_df(df_comparison, f"【改列值】根据改值规则 '{alter_rules}', 修改如下: 行数={df_comparison.shape[0]}, "
+                              f"改动={sum(len(c[0]) for c in changes)}")
     else:
         log(f"【改列值】根据改值规则 '{alter_rules}', 修改如下: 行数=0")
 
@@ -167,29 +264,71 @@ def alter_val(df: pd.DataFrame, alter_rules: dict[str: dict[str: str]], log_colu
 
 
 """分仓"""
-def split(df: pd.DataFrame, split_rules: list[dict[str: str]], extract: bool, log_columns: list, name: str):
-    '''  split_rules: [{'品名': '', 'MSKU': ''}, {'其他列': ''}]  '''
-    df_t = df.copy()
+def split(df: pd.DataFrame, split_rules: list[dict[str: str]], extract: bool, log_columns: list, name: str, inplace=False):
+    '''  split_rules: [{'品名': '', 'MSKU': ''}, {'其他列': ''}]
+    inplace 为 True 时, extract 为 False 的第二个输出就是 df 本身
+    '''
+    # extract 时两个输出都是按行选取产生的新表, 无需复制
+    df_t = df if inplace or extract else df.copy()
+    rule_engine.carry(df, df_t)
 
     mask0 = pd.Series(False, index=df_t.index)
     for rule in split_rules:
+        profiler.phase(_rule_name(rule), "rule")
         mask1 = pd.Series(True, index=df_t.index)
         for column, value in rule.items():
-            mask2 = df_t[column].astype(str).str.contains(value, regex=True, na=False, flags=re.IGNORECASE)
+            mask2 = rule_engine.match(df_t, column, value)
             mask1 &= mask2
 
         mask0 |= mask1
+        if profiler.active():
+            profiler.annotate(matched=int(mask1.sum()))
+    profiler.phase(None)
     
     # 打印日志
-    log_df(df_t.loc[mask0, log_columns], f"【分割: {name}】规则='{split_rules}' extract={extract} 数量={sum(mask0)}")
+    log_df(df_t.loc[mask0, log_columns], f"【分割: {name}】规则='{split_rules}' extract={extract} 数量={mask0.sum()}")
     
+    df_matched = df_t[mask0]
+    rule_engine.carry(df_t, df_matched, mask0)
     if extract:
-        return df_t[mask0].copy(), df_t[~mask0]
+        df_rest = df_t[~mask0]
+        rule_engine.carry(df_t, df_rest, ~mask0)
+        return df_matched, df_rest
     else:
-        return df_t[mask0].copy(), df_t
+        return df_matched, df_t
     
 
 """格式化表"""
+@lru_cache(maxsize=128)
+def _format_plan(format_rules_json: str, columns: tuple):
+    """
+    把格式化规则编译为构造新表的计划: ((列名, 构造方式), ...), 按新表的列顺序排列。
+    构造方式为 ('copy', 原列名), ('constant', 值), ('concat', (原列名, ...)) 或 None(空列);
+    后面的规则覆盖前面的规则, 不在 columns 中的列按第一次出现的顺序追加在末尾。
+    规则以 json 字符串为键缓存, 同一个配置只编译一次
+    """
+    plan = dict.fromkeys(columns)
+    for action_t, list1 in json.loads(format_rules_json).items():
+        action = action_t.lower()
+        if action == 'copy':
+            for column, source in list1:
+                plan[column] = ('copy', source)
+        elif action == 'constant':
+            for column, value in list1:
+                plan[column] = ('constant', value)
+        elif action == 'concat':
+            for list2 in list1:
+                plan[list2[0]] = ('concat', tuple(list2[1:]))
+    return tuple(plan.items())
+
+
+def _format_text(s: pd.Series) -> np.ndarray:
+    """拼接用的文本: 与 fillna("").astype('str') 相同, 返回 object 数组以便逐元素相加"""
+    if isinstance(s.dtype, pd.StringDtype):
+        return s.to_numpy(dtype=object, na_value='')
+    return compact.expand(s.to_frame()).iloc[:, 0].fillna("").astype('str').to_numpy(dtype=object)
+
+
 def format(df: pd.DataFrame, format_rules: dict, columns: list, log_columns: list, name: str):
     ''' {'copy': [['城市', '其他列'], ],
          'constant': [['城市', '其他列']],
@@ -197,27 +336,29 @@ def format(df: pd.DataFrame, format_rules: dict, columns: list, log_columns: lis
          'None': [['城市', , ]]
          } 
     '''
-    df_t = pd.DataFrame(columns=columns, index=df.index)
-
-    if not df.empty:
-        for action_t, list1 in format_rules.items():
-            action = action_t.lower()
-            if action == 'copy':
-                columns1, columns2 = [v[0] for v in list1], [v[1] for v in list1]
-                df_t[columns1] = df[columns2]
-            elif action == 'constant':
-                columns1, columns2 = [v[0] for v in list1], [v[1] for v in list1]
-                df_t[columns1] = columns2
-                # for column, value in zip(columns, list2):
-                #     df_t[column] = value
-            elif action == 'concat':
-                for list2 in list1:
-                    column, columns_cat = list2[0], list2[1:]
-                    df_t[column] = df[columns_cat].fillna("").astype('str').apply(lambda x: ' '.join(x).strip(), axis=1)
-            elif action == 'None':
-                continue
+    if df.empty:
+        # 空表不应用规则, 结果为 columns 的空列(object 类型), 与按计划构造的列类型无关
+        df_t = pd.DataFrame(columns=columns, index=df.index, dtype=object)
+    else:
+        plan = _format_plan(json.dumps(format_rules, ensure_ascii=False), tuple(columns))
+
+        # 按计划构造每一列, 最后一次性构造新表: 复制的列直接引用原列(写时复制, 不复制数据),
+        # 常量列广播为整列, 拼接的列按列做向量化的字符串拼接
+        data = {}
+        for column, step in plan:
+            if step is None:
+                data[column] = pd.Series(np.nan, index=df.index, dtype=object)
+            elif step[0] == 'copy':
+                data[column] = df[step[1]]
+            elif step[0] == 'constant':
+                data[column] = pd.Series(step[1], index=df.index)
             else:
-                continue
+                text = None
+                for source in step[1]:
+                    part = _format_text(df[source])
+                    text = part if text is None else text + ' ' + part
+                data[column] = pd.Series(text, index=df.index, dtype='str').str.strip()
+        df_t = pd.DataFrame(data, index=df.index)
     
     # 打印日志
     log(f"【格式化构造新表: {name}】行数={df_t.shape[0]}, 列数={df_t.shape[1]}")
@@ -225,19 +366,42 @@ def format(df: pd.DataFrame, format_rules: dict, columns: list, log_columns: lis
     return df_t
 
 
-def export(df: pd.DataFrame, export_dtype: dict, name: str, suffix: str, count_cols: list):
+def export(df: pd.DataFrame, export_dtype: dict, name: str, suffix: str, count_cols: list, stream=False,
+           fmt="xlsx", previews=None, submit=None):
+    """
+    fmt 为导出的格式(xlsx, csv, parquet, feather, 见 write_table), 也是文件的扩展名;
+    stream 为 True 时流式写入 xlsx, 内存占用与行数无关。
+    previews 不为 None 时不写出, 而是以文件名(不含扩展名)为键把表的副本放入 previews, 供程序内查看。
+    submit 不为 None 时用 submit(函数, *参数) 在后台写入表的副本, 不等待写完
+    """
     today = datetime.now().strftime('%m.%d')
     today = '.'.join([i.lstrip('0 ') for i in today.split('.')])
-    count = df[count_cols].drop_duplicates().shape[0] if count_cols != [] else df.shape[0]
-    fpath = f"data/{today} {name} {count}单{suffix}.xlsx"
+    count = rule_engine.group_index(df, count_cols).ngroups if count_cols != [] else df.shape[0]
+    fpath = f"data/{today} {name} {count}单{suffix}.{fmt}"
 
+    # 就地设置列类型, 之后的动作也使用设置后的类型
     set_df_dtype(df, export_dtype, name)
-    write_excel(df, fpath)
+    rule_engine.invalidate(df, [column for columns in export_dtype.values() for column in columns])
+    if previews is not None:
+        # 副本: 免复制模式下之后的动作可能就地修改 df
+        previews[os.path.splitext(os.path.basename(fpath))[0]] = df.copy()
+        log(f"【写表: {name}】未写出 '{fpath}', 在程序中查看, 行数={df.shape[0]}")
+        return
+    if submit is not None:
+        # 同上, 写入副本
+        submit(_write, df.copy(), fpath, fmt, stream, name)
+        log(f"【写表: {name}】在后台写入 '{fpath}'")
+        return
+    _write(df, fpath, fmt, stream, name)
+
+
+def _write(df: pd.DataFrame, fpath: str, fmt: str, stream: bool, name: str):
+    write_table(df, fpath, fmt, stream)
     log(f"【写表: {name}】已写入 '{fpath}'")
 
 
 """增加或填充一列"""
-def add_col(df: pd.DataFrame, add_rules: dict, log_columns: list, name: str):
+def add_col(df: pd.DataFrame, add_rules: dict, log_columns: list, name: str, inplace=False):
     '''
     add_rules: {'仓库代码/Warehouse Code': 
         {
@@ -247,8 +411,10 @@ def add_col(df: pd.DataFrame, add_rules: dict, log_columns: list, name: str):
             ]
         }
     }
+    inplace 为 True 时直接修改 df
     '''
-    df_t = df.copy()
+    df_t = df if inplace else df.copy()
+    rule_engine.carry(df, df_t)
 
     for add_column, dict1 in add_rules.items():
         if add_column not in df_t.columns:
@@ -258,20 +424,25 @@ def add_col(df: pd.DataFrame, add_rules: dict, log_columns: list, name: str):
             mask2 = pd.Series(False, index=df_t.index)
 
             for and_dict in list2:
+                profiler.phase(f"{add_column}<-{add_value}: {_rule_name(and_dict)}", "rule")
                 mask1 = pd.Series(True, index=df_t.index)
 
                 for by_column, by_value in and_dict.items():
-                    mask0 = df_t[by_column].astype(str).str.contains(by_value, regex=True, na=False, flags=re.IGNORECASE)
+                    mask0 = rule_engine.match(df_t, by_column, by_value)
                     # and 和
                     mask1 &= mask0
                 
                 mask2 |= mask1 
-                
+                if profiler.active():
+                    profiler.annotate(matched=int(mask1.sum()))
+            profiler.phase(None)
             
             # 改值
             mask2 &= pd.isna(df_t[add_column])
             if mask2.any():
+                compact.accept(df_t, add_column, [add_value])
                 df_t.loc[mask2, [add_column]] = add_value
+                rule_engine.invalidate(df_t, [add_column])
         
         # 检查 add_column 列是否还有空值
         log(f"【增加或补充一列: {name}】增加的列={add_column}, 空值数量={df_t[add_column].isna().sum()}", level='info')
@@ -282,6 +453,9 @@ def add_col(df: pd.DataFrame, add_rules: dict, log_columns: list, name: str):
 def concat_df(input: list[pd.DataFrame], axis: str):
     axis = 1 if axis == "横向" else 0
     df = pd.concat(input, axis=axis)
+    if axis == 0:
+        # 各表的分类列类别不同时拼接结果为普通列, 重新压缩
+        compact.restore(df, input[0])
     log(f"【拼接两个表格】axis={axis}, 行数={df.shape[0]},列数={df.shape[1]}")
     return df
 
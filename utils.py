@@ -1,40 +1,312 @@
-import json5 as json
 import pandas as pd
-from log import log
+import numpy as np
+from log import log, apply_pd_settings
+from jsonc import read_json
+import cache
+import compact
+import profiler
+from config_check import EXPORT_FORMATS
 from sys import exit
 import os
+from itertools import chain
 
-"""加载并解析JSONC配置文件"""
-def read_json(fpath)->dict:
+# 分块读取时溢出文件的目录
+SPILL_DIR = "cache/spill"
+
+# pandas 输出设置: 日志中完整打印表格
+apply_pd_settings()
+
+"""读取Excel文件"""
+def read_excel(fpath, sheet_name=None, use_cache=True):
+    """use_cache 为 False 时跳过磁盘缓存, 直接解析文件"""
     try:
-        with open(fpath, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            log(f"读取文件 '{fpath}': \n{data}", level='info')
-            return data
+        sheet_name = sheet_name if sheet_name else 0
+        df = cache.load(fpath, sheet_name) if use_cache else None
+        if df is not None:
+            log(f'读取表格(缓存) {fpath}, 行数={df.shape[0]}, 列数={df.shape[1]}', level='info')
+            return df
+        df = pd.read_excel(fpath, engine='openpyxl', sheet_name=sheet_name)
+        log(f'读取表格 {fpath}, 行数={df.shape[0]}, 列数={df.shape[1]}', level='info')
+        if use_cache:
+            cache.save(fpath, df, sheet_name)
+        return df
     except FileNotFoundError:
         log(f"文件 '{fpath}' 未找到。", level='error')
         exit(1)
-    except Exception as e:
-        log(f"文件 '{fpath}' 不是有效的JSON5格式。详细信息如下：{e}", level='error')
+
+
+"""读取Excel文件的列名(不读取数据)"""
+def read_excel_header(fpath, sheet_name=None):
+    try:
+        return pd.read_excel(fpath, engine='openpyxl', sheet_name=sheet_name if sheet_name else 0, nrows=0)
+    except FileNotFoundError:
+        log(f"文件 '{fpath}' 未找到。", level='error')
         exit(1)
 
 
-"""读取Excel文件"""
-def read_excel(fpath, sheet_name=None):
+"""读取工作簿中各工作表的名字和大小(不解析数据)"""
+def excel_sheet_info(fpath):
+    """
+    返回 {工作表名: 解压后的 xml 字节数}, 按工作表的顺序排列。
+    直接读取 zip 中的 workbook.xml, 不像 openpyxl 打开工作簿那样先解析共享字符串; 无法解析时退回 openpyxl, 字节数记为 0
+    """
+    import zipfile
+    import posixpath
+    from xml.etree import ElementTree
+    main_ns = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    rel_ns = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
     try:
-        sheet_name = sheet_name if sheet_name else 0
-        df = pd.read_excel(fpath, engine='openpyxl', sheet_name=sheet_name)
-        log(f'读取表格 {fpath}, 行数={df.shape[0]}, 列数={df.shape[1]}', level='info')
+        with zipfile.ZipFile(fpath) as archive:
+            rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+            targets = {rel.get("Id"): rel.get("Target") for rel in rels}
+            info = {}
+            for sheet in ElementTree.fromstring(archive.read("xl/workbook.xml")).iter(f"{main_ns}sheet"):
+                target = targets[sheet.get(f"{rel_ns}id")]
+                path = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+                info[sheet.get("name")] = archive.getinfo(path).file_size
+            return info
+    except FileNotFoundError:
+        log(f"文件 '{fpath}' 未找到。", level='error')
+        exit(1)
+    except Exception:
+        from openpyxl import load_workbook
+        wb = load_workbook(fpath, read_only=True)
+        try:
+            return {name: 0 for name in wb.sheetnames}
+        finally:
+            wb.close()
+
+
+# 解压后的 xml 超过该字节数的工作表(约 2 万行)在子进程中解析, 解析时间远大于启动进程的时间
+PARALLEL_SHEET_BYTES = 4 * 1024 ** 2
+
+
+def _parse_sheet(fpath, sheet_name):
+    """在子进程中解析一个工作表"""
+    return pd.read_excel(fpath, engine='openpyxl', sheet_name=sheet_name)
+
+
+"""一次打开工作簿, 读取多个工作表"""
+def read_excel_sheets(fpath, sheets: list, use_cache=True, processes=None):
+    """
+    返回 {工作表: DataFrame}, sheets 中可以是工作表名或序号, 结果与逐个 read_excel 相同。
+    工作簿只打开一次; 未缓存的大工作表(见 PARALLEL_SHEET_BYTES)有多个时在子进程中并行解析,
+    processes 为最大进程数, 默认为 CPU 核数, 小于 2 时不使用子进程。
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    sheets = list(dict.fromkeys(sheets))
+    result = {}
+    for sheet in sheets:
+        df = cache.load(fpath, sheet) if use_cache else None
+        if df is not None:
+            log(f'读取表格(缓存) {fpath} [{sheet}], 行数={df.shape[0]}, 列数={df.shape[1]}', level='info')
+            result[sheet] = df
+    missing = [sheet for sheet in sheets if sheet not in result]
+    if not missing:
+        return result
+
+    info = excel_sheet_info(fpath)
+    names = list(info)
+    unknown = [sheet for sheet in missing if (sheet >= len(names) if isinstance(sheet, int) else sheet not in info)]
+    if unknown:
+        log(f"文件 '{fpath}' 中没有工作表 {unknown}, 现有工作表: {names}", level='error')
+        exit(1)
+    large = [sheet for sheet in missing if info[names[sheet] if isinstance(sheet, int) else sheet] >= PARALLEL_SHEET_BYTES]
+    processes = (os.cpu_count() or 1) if processes is None else processes
+    parallel = large if processes > 1 and len(large) > 1 else []
+
+    pool = ProcessPoolExecutor(max_workers=min(processes, len(parallel)), mp_context=multiprocessing.get_context("spawn")) \
+        if parallel else None
+    try:
+        futures = {sheet: pool.submit(_parse_sheet, fpath, sheet) for sheet in parallel}
+        # 子进程解析大工作表的同时, 在本进程中解析其余工作表
+        local = [sheet for sheet in missing if sheet not in futures]
+        if local:
+            with pd.ExcelFile(fpath, engine='openpyxl') as xl:
+                for sheet in local:
+                    result[sheet] = xl.parse(sheet)
+        for sheet, future in futures.items():
+            result[sheet] = future.result()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    for sheet in missing:
+        df = result[sheet]
+        log(f'读取表格 {fpath} [{sheet}], 行数={df.shape[0]}, 列数={df.shape[1]}'
+            f'{", 子进程解析" if sheet in parallel else ""}', level='info')
+        if use_cache:
+            cache.save(fpath, df, sheet)
+    return {sheet: result[sheet] for sheet in sheets}
+
+
+"""按固定行数分块读取Excel文件"""
+def read_excel_chunks(fpath, chunksize: int, sheet_name=None, use_cache=True):
+    """
+    逐块读取Excel文件，每次产出一个不超过 chunksize 行的 DataFrame。
+
+    单元格的转换方式与 pd.read_excel(engine='openpyxl') 相同, 每列的类型也与一次性读取整表时相同:
+    各块单独推断的类型可能不同(例如前一块只有整数形式的 5.0 时推断为整数, 转为字符串是 '5' 而不是 '5.0'),
+    所以先读完整表, 把各块原始的行写入溢出文件(SPILL_DIR)并按各块的类型确定整列的类型(unify_dtypes),
+    再逐块读回并转换为整列的类型。只有一块时不溢出。
+    每块的行索引接续上一块，所以拼接后的结果与一次性读取的行索引一致。
+    末尾的空行会被丢弃，表格中没有数据行时产出一个只有列名的空表。
+    命中磁盘缓存时直接对缓存的表切片。
+    """
+    df = cache.load(fpath, sheet_name if sheet_name else 0) if use_cache else None
+    if df is not None:
+        log(f'分块读取表格(缓存) {fpath}, 行数={df.shape[0]}, 列数={df.shape[1]}, 每块行数={chunksize}', level='info')
+        for k in range(0, max(df.shape[0], 1), chunksize):
+            yield df.iloc[k:k + chunksize]
+        return
+
+    import pickle
+    import tempfile
+    from pandas.io.parsers import TextParser
+
+    def to_df(header, rows, start, dtype=None):
+        df = TextParser([header] + rows, header=0, skip_blank_lines=False, dtype=dtype).read()
+        df.index = pd.RangeIndex(start, start + len(rows))
         return df
+
+    chunks = _excel_row_chunks(fpath, chunksize, sheet_name)
+    header, rows, start = next(chunks)
+    second = next(chunks, None)
+    if second is None:
+        yield to_df(header, rows, start)
+        return
+
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    fd, spill_path = tempfile.mkstemp(prefix="chunks_", suffix=".pkl", dir=SPILL_DIR)
+    try:
+        # 第一遍: 原始的行写入溢出文件, 记录每块推断的类型
+        types = []
+        with os.fdopen(fd, 'wb') as f:
+            for _, rows, start in chain([(header, rows, start), second], chunks):
+                types.append(column_types(to_df(header, rows, start), rows))
+                pickle.dump((rows, start), f, protocol=pickle.HIGHEST_PROTOCOL)
+        dtypes = unify_dtypes(types)
+        # 第二遍: 整列为 object 或字符串的列按原始的值读取(与整表读取时相同), 再转换为整列的类型
+        names = to_df(header, [], 0).columns
+        as_object = {names[i]: object for i, dtype in enumerate(dtypes)
+                     if dtype == object or isinstance(dtype, pd.StringDtype)}
+        with open(spill_path, 'rb') as f:
+            for _ in types:
+                rows, start = pickle.load(f)
+                yield cast_chunk(to_df(header, rows, start, as_object or None), dtypes)
+    finally:
+        os.remove(spill_path)
+
+
+def _excel_row_chunks(fpath, chunksize: int, sheet_name=None):
+    """
+    逐块产出 (列名, 行, 起始行号), 行为转换后的单元格的值(与 pd.read_excel 相同: 空单元格为空串,
+    整数形式的浮点数为整数)。末尾的空行会被丢弃, 没有数据行时产出一个空块
+    """
+    from openpyxl import load_workbook
+
+    def convert(value):
+        if value is None:
+            return ""
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    try:
+        wb = load_workbook(fpath, read_only=True, data_only=True)
     except FileNotFoundError:
         log(f"文件 '{fpath}' 未找到。", level='error')
         exit(1)
+    try:
+        ws = wb.worksheets[sheet_name or 0] if isinstance(sheet_name, int) or not sheet_name else wb[sheet_name]
+        ws.reset_dimensions()
+        rows_iter = ws.iter_rows(values_only=True)
+        header = [convert(v) for v in next(rows_iter, ())]
+        while header and header[-1] == "":
+            header.pop()
+        width = len(header)
+
+        rows, blank_rows, start = [], [], 0
+        for row in rows_iter:
+            row = [convert(v) for v in row[:width]]
+            row += [""] * (width - len(row))
+            if all(v == "" for v in row):
+                # 暂存空行, 后面还有数据时才保留(与 read_excel 丢弃末尾空行一致)
+                blank_rows.append(row)
+                continue
+            rows += blank_rows + [row]
+            blank_rows = []
+            while len(rows) >= chunksize:
+                yield header, rows[:chunksize], start
+                rows, start = rows[chunksize:], start + chunksize
+        if rows or start == 0:
+            yield header, rows, start
+        log(f'分块读取表格 {fpath}, 行数={start + len(rows)}, 列数={width}, 每块行数={chunksize}', level='info')
+    finally:
+        wb.close()
+
+
+def column_types(df: pd.DataFrame, rows: list):
+    """
+    每列的 (类型, 是否全为缺失值, 是否有缺失值, 是否由文字转换为数值), 用于 unify_dtypes。
+    rows 为 df 的原始的行: 全是数字形式的文字(例如单号 '0123')的列会被推断为数值
+    """
+    result = []
+    for i in range(df.shape[1]):
+        dtype = df.dtypes.iloc[i]
+        na = df.iloc[:, i].isna().to_numpy()
+        from_text = dtype.kind in 'iuf' and not na.all() and all(isinstance(row[i], str) for row in rows)
+        result.append((dtype, bool(na.all()), bool(na.any()), from_text))
+    return result
+
+
+def unify_dtypes(types: list):
+    """
+    由各块的 column_types 确定整列的类型, 与对整列推断的结果相同:
+    全为缺失值的块不影响类型; 数值(包括布尔)列有浮点数或缺失值时为 float64, 否则为整数(全为布尔时为 bool);
+    各块都是同一种字符串或日期类型时为该类型; 全是文字的列中只有部分块是数字形式时为字符串; 其余情况为 object
+    """
+    dtypes = []
+    for column in zip(*types):
+        present = [dtype for dtype, all_na, _, _ in column if not all_na]
+        has_na = any(any_na for _, _, any_na, _ in column)
+        kinds = {dtype.kind for dtype in present}
+        strings = [dtype for dtype in present if isinstance(dtype, pd.StringDtype)]
+        if strings and all(isinstance(dtype, pd.StringDtype) or from_text
+                           for dtype, all_na, _, from_text in column if not all_na):
+            dtype = strings[0]
+        elif not present:
+            dtype = np.dtype(np.float64)
+        elif kinds <= set('iufb'):
+            if kinds == {'b'} and not has_na:
+                dtype = np.dtype(bool)
+            elif 'f' in kinds or has_na:
+                dtype = np.dtype(np.float64)
+            else:
+                dtype = np.result_type(*[d for d in present if d.kind != 'b'])
+        elif len(set(present)) == 1:
+            dtype = present[0]
+        else:
+            dtype = np.dtype(object)
+        dtypes.append(dtype)
+    return dtypes
+
+
+def cast_chunk(df: pd.DataFrame, dtypes: list):
+    """把一块的列转换为整列的类型(unify_dtypes 的结果); 整列为字符串或 object 的列应按原始的值读取"""
+    changed = {df.columns[i]: dtype for i, dtype in enumerate(dtypes) if df.dtypes.iloc[i] != dtype}
+    return df.astype(changed) if changed else df
 
 
 """写入Excel文件"""
-def write_excel(df: pd.DataFrame, fpath: str):
+def write_excel(df: pd.DataFrame, fpath: str, stream=False):
+    """stream 为 True 时用流式写入(write_excel_stream), 内存占用与行数无关"""
     try:
-        df.to_excel(fpath, index=False, engine='openpyxl')
+        if stream:
+            write_excel_stream([df], fpath)
+        else:
+            df.to_excel(fpath, index=False, engine='openpyxl')
         log(f"DataFrame成功写入到 {fpath}, 行数={df.shape[0]}, 列数={df.shape[1]}", level='info')
     except FileNotFoundError:
         log(f"指定的路径 '{fpath}' 不存在或无法访问。", level='error')
@@ -49,6 +321,104 @@ def write_excel(df: pd.DataFrame, fpath: str):
         log(f"未知错误: {e}", level='error')
 
 
+"""按格式写入表格(export 动作)"""
+def write_table(df: pd.DataFrame, fpath: str, fmt="xlsx", stream=False):
+    """
+    fmt 为 xlsx 时同 write_excel; csv 用 utf-8-sig 编码, Excel 可以直接打开;
+    parquet 和 feather 需要 pyarrow, 写入前转换 pyarrow 不支持的列(见 arrow_frame)
+    """
+    if fmt == "xlsx":
+        write_excel(df, fpath, stream)
+        return
+    try:
+        if fmt == "csv":
+            df.to_csv(fpath, index=False, encoding='utf-8-sig')
+        elif fmt == "parquet":
+            arrow_frame(df).to_parquet(fpath, index=False)
+        elif fmt == "feather":
+            arrow_frame(df).to_feather(fpath)
+        else:
+            log(f"未知的导出格式 '{fmt}', 可选: {', '.join(EXPORT_FORMATS)}", level='error')
+            return
+        log(f"DataFrame成功写入到 {fpath}, 行数={df.shape[0]}, 列数={df.shape[1]}", level='info')
+    except FileNotFoundError:
+        log(f"指定的路径 '{fpath}' 不存在或无法访问。", level='error')
+    except PermissionError:
+        log(f"没有权限将文件写入到 '{fpath}' 或文件正在被其他程序使用。", level='error')
+    except ImportError as e:
+        log(f"错误：写入 {fmt} 需要安装 'pyarrow'。{e}", level='error')
+    except Exception as e:
+        log(f"未知错误: {e}", level='error')
+
+
+def arrow_frame(df: pd.DataFrame):
+    """
+    parquet 和 feather 的每列只能有一种类型: 混合了数字和文字等类型的 object 列转为字符串(缺失值保持为空);
+    分类列(选项 compact)还原为普通列, 读取时的类型与不压缩时相同; 列名转为字符串, 索引重置为默认索引。
+    不需要转换时返回 df 本身
+    """
+    df = compact.expand(df)
+    positions = [i for i, t in enumerate(df.dtypes) if t == object and
+                 pd.api.types.infer_dtype(df.iloc[:, i], skipna=True) in ('mixed', 'mixed-integer')]
+    if not positions and all(isinstance(c, str) for c in df.columns) and \
+            isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1:
+        return df
+    result = df.reset_index(drop=True)
+    for i in positions:
+        s = result.iloc[:, i]
+        result.isetitem(i, s.where(s.isna(), s.astype(str)))
+    result.columns = [str(c) for c in result.columns]
+    return result
+
+
+"""流式写入Excel文件"""
+def write_excel_stream(sheets: list, fpath: str, sheet_names=None, chunksize=10000):
+    """
+    用 openpyxl 的 write_only 模式写入, 行数据在产生时直接写入工作表的 XML 临时文件,
+    不在内存中构建单元格对象; 字符串写入共享字符串表并去重。
+
+    参数:
+    sheets (list): 每个元素是一个工作表的内容, 可以是 DataFrame, 也可以是产出 DataFrame 分块的可迭代对象
+                   (各分块列名相同, 以第一个分块的列名作为表头)。
+    sheet_names (list): 工作表名, 默认为 Sheet1, Sheet2, ...
+    chunksize (int): DataFrame 按该行数分块转换, 控制转换时的内存占用。
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, Border, Side, Alignment
+
+    if sheet_names is None:
+        sheet_names = [f"Sheet{i+1}" for i in range(len(sheets))]
+    assert len(sheets) == len(sheet_names), "【流式写入】sheets 和 sheet_names 长度不一"
+
+    # 表头样式与 DataFrame.to_excel 一致
+    side = Side(style='thin')
+    header_font, header_border = Font(bold=True), Border(left=side, right=side, top=side, bottom=side)
+    header_alignment = Alignment(horizontal='center', vertical='top')
+
+    wb = Workbook(write_only=True)
+    for sheet, sheet_name in zip(sheets, sheet_names):
+        ws = wb.create_sheet(title=sheet_name)
+        chunks = [sheet] if isinstance(sheet, pd.DataFrame) else sheet
+        header_written = False
+        for chunk in chunks:
+            if not header_written:
+                header = []
+                for column in chunk.columns:
+                    cell = WriteOnlyCell(ws, value=str(column))
+                    cell.font, cell.border, cell.alignment = header_font, header_border, header_alignment
+                    header.append(cell)
+                ws.append(header)
+                header_written = True
+            for k in range(0, chunk.shape[0], chunksize):
+                part = chunk.iloc[k:k + chunksize].astype(object)
+                # 缺失值写成空单元格
+                part = part.where(part.notna(), None)
+                for row in part.itertuples(index=False, name=None):
+                    ws.append(row)
+    wb.save(fpath)
+
+
 """设置DataFrame中列的数据类型"""
 def set_df_dtype(df: pd.DataFrame, dtype: dict, name = '表的名字'):
     """
@@ -118,36 +488,68 @@ def check_rows_eq(df1: pd.DataFrame, df2: pd.DataFrame):
     return True
 
 
-def compare_df(df1: pd.DataFrame, df2: pd.DataFrame, sort_columns: list):
+def compare_df(df1: pd.DataFrame, df2: pd.DataFrame, sort_columns: list, engine: str = "merge", progress=None):
+    """
+    比较两个表格，返回 (是否完全一致, 差异表)。
+
+    参数:
+    engine (str): 比较引擎。"merge"(默认) 先用行哈希找出有差异的分组, 只对这些分组做向量化的合并比较，
+                  "loop" 为旧的逐组逐行比较，保留用于核对结果。
+    progress: 进度回调 progress(已完成数, 总数, 说明), loop 引擎按分组调用, merge 引擎按阶段调用。
+    """
+    progress = progress if progress else (lambda done, total, msg="": None)
+    if engine not in ("loop", "merge"):
+        raise ValueError(f"未知的比较引擎: {engine}")
+    # 剖析时(profiler.run)记录比较各阶段的耗时: 规范化、排序、分组、比较、生成差异表
+    with profiler.span(f"compare_df {engine}", "compare", inputs=[profiler.shape(df1), profiler.shape(df2)],
+                       sort_columns=sort_columns) as record:
+        if engine == "loop":
+            df_eq, comparison = compare_df_loop(df1, df2, sort_columns, progress)
+        else:
+            df_eq, comparison = compare_df_hashed(df1, df2, sort_columns, progress)
+        if record is not None:
+            record.args["output"] = profiler.shape(comparison)
+    return df_eq, comparison
+
+
+def compare_df_loop(df1: pd.DataFrame, df2: pd.DataFrame, sort_columns: list, progress=lambda done, total, msg="": None):
     # 列名映射
     other_columns_dict = {i: f"差异_{i}" for i in df1.columns if i not in sort_columns}
     sort_columns_dict = {i: f"排序_{i}" for i in sort_columns}
 
     # 处理缺失值并转换为字符串类型
-    df1 = df1.fillna('').astype(str).apply(lambda x: x.str.strip())
-    df2 = df2.fillna('').astype(str).apply(lambda x: x.str.strip())
+    profiler.phase("normalize")
+    df1 = compact.expand(df1).fillna('').astype(str).apply(lambda x: x.str.strip())
+    df2 = compact.expand(df2).fillna('').astype(str).apply(lambda x: x.str.strip())
 
-    # 对两个DataFrame按照排序列进行排序
-    df1 = df1.sort_values(by=sort_columns).reset_index(drop=True)
-    df2 = df2.sort_values(by=sort_columns).reset_index(drop=True)
+    # 对两个DataFrame按照排序列进行排序(稳定排序, 使组内的配对顺序确定)
+    profiler.phase("sort")
+    df1 = df1.sort_values(by=sort_columns, kind='stable').reset_index(drop=True)
+    df2 = df2.sort_values(by=sort_columns, kind='stable').reset_index(drop=True)
 
     # 分组
-    df1_g = df1.groupby(by=sort_columns)
-    df2_g = df2.groupby(by=sort_columns)
+    profiler.phase("group")
+    # 按列表分组时键总是元组; 直接遍历分组, 不使用 .groups(pandas 4 中按单列分组的键会改变)
+    df1_g = dict(list(df1.groupby(by=sort_columns)))
+    df2_g = dict(list(df2.groupby(by=sort_columns)))
     # 获取所有唯一的分组键
-    all_keys = set(df1_g.groups.keys()).union(set(df2_g.groups.keys()))
+    all_keys = set(df1_g.keys()).union(set(df2_g.keys()))
 
     # 创建一个新的DataFrame用于存储比较结果
     comparison = pd.DataFrame(columns=['差异标识']+list(sort_columns_dict.values()), index=range(df1.shape[0]+df2.shape[0])).astype('str')
     comparison['差异状态'] = False
     comparison['差异标识'] = ''
 
+    profiler.phase("diff")
     c_idx = 0
+    step = max(1, len(all_keys) // 100)
     # 遍历所有分组键
-    for key in all_keys:
+    for n, key in enumerate(all_keys):
+        if n % step == 0:
+            progress(n, len(all_keys), f"比较分组 {n}/{len(all_keys)}")
         # 获取 df1 和 df2 中对应的分组
-        df1_group = df1_g.get_group(key if isinstance(key, (list, tuple, set)) else (key,)) if key in df1_g.groups else pd.DataFrame()
-        df2_group = df2_g.get_group(key if isinstance(key, (list, tuple, set)) else (key,)) if key in df2_g.groups else pd.DataFrame()
+        df1_group = df1_g.get(key, pd.DataFrame())
+        df2_group = df2_g.get(key, pd.DataFrame())
 
         # 双方的数量相同
         if df1_group.shape[0] == df2_group.shape[0] and df1_group.shape[0] != 0:
@@ -210,6 +612,7 @@ def compare_df(df1: pd.DataFrame, df2: pd.DataFrame, sort_columns: list):
                     # 更新 c_idx
                     c_idx += 1
     
+    profiler.phase("build")
     if comparison['差异状态'].any():
         comparison = comparison[comparison['差异状态']]
         comparison = comparison.drop(['差异状态'], axis=1)
@@ -220,17 +623,200 @@ def compare_df(df1: pd.DataFrame, df2: pd.DataFrame, sort_columns: list):
         return True, comparison
 
 
+def compare_df_merge(df1: pd.DataFrame, df2: pd.DataFrame, sort_columns: list, progress=lambda done, total, msg="": None):
+    """
+    向量化的比较引擎，分类结果与 compare_df_loop 相同:
+    - 两表中某分组的行数相同: 按组内顺序逐行配对，不相等的行标识为 "比较:表1<->表2"
+    - 某分组仅存在于一个表中: "独有:表1" / "独有:表2"
+    - 某分组在两表中的行数不同: "共有:表1" / "共有:表2"
+    """
+    other_columns = [i for i in df1.columns if i not in sort_columns]
+    sort_columns_dict = {i: f"排序_{i}" for i in sort_columns}
+    other_columns_dict = {i: f"差异_{i}" for i in other_columns}
+
+    # 处理缺失值并转换为字符串类型
+    progress(0, 5, "规范化")
+    profiler.phase("normalize")
+    df1 = compact.expand(df1).fillna('').astype(str).apply(lambda x: x.str.strip())
+    df2 = compact.expand(df2).fillna('').astype(str).apply(lambda x: x.str.strip())
+
+    # 对两个DataFrame按照排序列进行排序(稳定排序, 保持组内原有顺序)
+    progress(1, 5, "排序")
+    profiler.phase("sort")
+    df1 = df1.sort_values(by=sort_columns, kind='stable').reset_index(drop=True)
+    df2 = df2.sort_values(by=sort_columns, kind='stable').reset_index(drop=True)
+
+    # 两表一起对排序列编码, 得到分组编号; 再计算组内序号, 以及每个分组在两表中的行数
+    progress(2, 5, "分组")
+    profiler.phase("group")
+    keys = pd.concat([df1[sort_columns], df2[sort_columns]], ignore_index=True)
+    gid = keys.groupby(by=sort_columns, sort=False).ngroup().to_numpy()
+    gid1, gid2 = gid[:df1.shape[0]], gid[df1.shape[0]:]
+    seq1 = pd.Series(gid1).groupby(gid1).cumcount().to_numpy()
+    seq2 = pd.Series(gid2).groupby(gid2).cumcount().to_numpy()
+    n_groups = gid.max() + 1 if gid.size else 0
+    n1, n2 = np.bincount(gid1, minlength=n_groups), np.bincount(gid2, minlength=n_groups)
+    n1_of_1, n2_of_1, n1_of_2, n2_of_2 = n1[gid1], n2[gid1], n1[gid2], n2[gid2]
+
+    def build(df: pd.DataFrame, label: str, diff_values: dict):
+        data = {'差异标识': [label] * df.shape[0]}
+        for i, j in sort_columns_dict.items():
+            data[j] = df[i].to_numpy()
+        for i, j in other_columns_dict.items():
+            data[j] = diff_values[i]
+        return pd.DataFrame(data)
+
+    def keep_nonempty(df: pd.DataFrame):
+        diff_values = {}
+        for i in other_columns:
+            v = df[i].to_numpy(dtype=object)
+            diff_values[i] = np.where(v != '', v, np.nan)
+        return diff_values
+
+    parts = []
+
+    # 行数相同的分组: 按 (分组编号, 组内序号) 合并配对, 整列比较
+    progress(3, 5, "比较")
+    profiler.phase("diff")
+    same_1, same_2 = n1_of_1 == n2_of_1, n1_of_2 == n2_of_2
+    pairs = pd.merge(pd.DataFrame({'分组_': gid1[same_1], '序号_': seq1[same_1], '行1_': np.flatnonzero(same_1)}),
+                     pd.DataFrame({'分组_': gid2[same_2], '序号_': seq2[same_2], '行2_': np.flatnonzero(same_2)}),
+                     on=['分组_', '序号_'], how='inner')
+    rows1, rows2 = df1.iloc[pairs['行1_'].to_numpy()], df2.iloc[pairs['行2_'].to_numpy()]
+    neq_dict = {}
+    neq_any = np.zeros(rows1.shape[0], dtype=bool)
+    for i in other_columns:
+        neq_dict[i] = rows1[i].to_numpy(dtype=object) != rows2[i].to_numpy(dtype=object)
+        neq_any |= neq_dict[i]
+    rows1, rows2 = rows1[neq_any], rows2[neq_any]
+    diff_values = {}
+    for i in other_columns:
+        neq = neq_dict[i][neq_any]
+        v1, v2 = rows1[i].to_numpy(dtype=object), rows2[i].to_numpy(dtype=object)
+        diff_values[i] = np.full(neq.shape, np.nan, dtype=object)
+        diff_values[i][neq] = v1[neq] + ' <-> ' + v2[neq]
+    parts.append(build(rows1, "比较:表1<->表2", diff_values))
+
+    # 仅存在于一个表的分组, 以及两表行数不同的分组
+    progress(4, 5, "生成差异表")
+    profiler.phase("build")
+    only1, only2 = df1[n2_of_1 == 0], df2[n1_of_2 == 0]
+    common1 = df1[(n1_of_1 != n2_of_1) & (n2_of_1 != 0)]
+    common2 = df2[(n1_of_2 != n2_of_2) & (n1_of_2 != 0)]
+    for df, label in ((only1, "独有:表1"), (only2, "独有:表2"), (common1, "共有:表1"), (common2, "共有:表2")):
+        parts.append(build(df, label, keep_nonempty(df)))
+
+    # 一次性拼接, 按排序列排列(同一分组中 "共有:表1" 在 "共有:表2" 之前)
+    comparison = pd.concat(parts, ignore_index=True)
+    comparison = comparison.sort_values(by=list(sort_columns_dict.values()), kind='stable').reset_index(drop=True)
+    # 仅保留出现过差异的列
+    comparison = comparison.drop(columns=[j for j in other_columns_dict.values() if comparison[j].isna().all()])
+
+    if comparison.shape[0] > 0:
+        print(f"【比较两个表格】sort_columns={sort_columns},行数={comparison.shape[0]},列数={comparison.shape[1]} 两表格不完全一致")
+        return False, comparison
+    else:
+        print(f"【比较两个表格】sort_columns={sort_columns},行数={comparison.shape[0]},列数={comparison.shape[1]} 两个表完全一致")
+        return True, comparison
+
+
+# splitmix64 的混合常数
+_MIX1, _MIX2, _SEQ_SEED = np.uint64(0xbf58476d1ce4e5b9), np.uint64(0x94d049bb133111eb), np.uint64(0x9e3779b97f4a7c15)
+
+
+def _mix64(x: np.ndarray):
+    """对 uint64 数组逐个做 splitmix64 混合(乘法溢出按 2^64 取模)"""
+    x = (x ^ (x >> np.uint64(30))) * _MIX1
+    x = (x ^ (x >> np.uint64(27))) * _MIX2
+    return x ^ (x >> np.uint64(31))
+
+
+def hash_rows(df1: pd.DataFrame, df2: pd.DataFrame, columns: list):
+    """
+    返回两表在 columns 上的逐行 64 位哈希 (h1, h2)。
+    取值按比较时的方式规范化(缺失值为空串, 转为字符串并去掉首尾空白), 所以哈希相同等价于规范化后的值相同;
+    两表中类型相同的数值列(整数、浮点、布尔)直接对数值求哈希, 省去转换字符串的开销, 结果与转换后比较一致。
+    类型不同的列在各自的表中分别规范化: 拼接会统一类型(例如整数与浮点拼接后 1 变为 1.0), 与比较时的字符串不同。
+    """
+    h1, h2 = np.zeros(df1.shape[0], dtype=np.uint64), np.zeros(df2.shape[0], dtype=np.uint64)
+    for column in columns:
+        s1, s2 = df1[column], df2[column]
+        if s1.dtype != s2.dtype and s1.dtype.kind == s2.dtype.kind and s1.dtype.kind in 'iu':
+            # 压缩后两表的同一整数列可能降为不同的位数, 整数的字符串与位数无关
+            common = np.promote_types(s1.dtype, s2.dtype)
+            s1, s2 = s1.astype(common), s2.astype(common)
+        if s1.dtype == s2.dtype and s1.dtype.kind in 'iufb':
+            c1 = pd.util.hash_pandas_object(s1, index=False).to_numpy()
+            c2 = pd.util.hash_pandas_object(s2, index=False).to_numpy()
+        else:
+            c1, c2 = _hash_normalized(s1), _hash_normalized(s2)
+        h1, h2 = _mix64(h1 ^ c1), _mix64(h2 ^ c2)  # 与列的顺序有关
+    return h1, h2
+
+
+def _hash_normalized(s: pd.Series):
+    """规范化后的值的哈希。全是字符串的列(包括分类列)只对不同的值做规范化, 其余情况逐个转换"""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        codes, uniques = s.cat.codes.to_numpy(), s.cat.categories
+    else:
+        codes, uniques = pd.factorize(s)
+    if pd.api.types.infer_dtype(uniques, skipna=True) not in ('string', 'empty'):
+        # 混合类型时 factorize 会把 1 和 1.0 视为同一个值, 而它们的字符串不同
+        return pd.util.hash_pandas_object(s.fillna('').astype(str).str.strip(), index=False).to_numpy()
+    uniques = pd.Series(np.append(np.asarray(uniques, dtype=object), ''), dtype=object).str.strip()
+    hashes = pd.util.hash_pandas_object(uniques, index=False).to_numpy()
+    return hashes[codes]  # 缺失值的编号为 -1, 对应末尾的空串
+
+
+"""用行哈希过滤后比较两个表格"""
+def compare_df_hashed(df1: pd.DataFrame, df2: pd.DataFrame, sort_columns: list, progress=lambda done, total, msg="": None):
+    """
+    对每行计算 排序列的哈希(确定分组) 和 其余列的哈希, 再与行在分组内的序号合成该行的摘要;
+    一个分组在两表中一致, 当且仅当它在两表中的行摘要集合相同。
+    - 两表所有行摘要之和(整表摘要)相同且行数相同: 直接返回 "完全一致"
+    - 否则只把行摘要不能在另一表中找到的分组交给 compare_df_merge 逐行比较, 结果与比较整表相同
+    """
+    other_columns = [i for i in df1.columns if i not in sort_columns]
+    progress(0, 1, "计算行哈希")
+    profiler.phase("hash")
+    key1, key2 = hash_rows(df1, df2, sort_columns)
+    value1, value2 = hash_rows(df1, df2, other_columns)
+    # 组内序号: 两个引擎都按原有顺序在组内逐行配对
+    seq1 = pd.Series(key1).groupby(key1).cumcount().to_numpy().astype(np.uint64)
+    seq2 = pd.Series(key2).groupby(key2).cumcount().to_numpy().astype(np.uint64)
+    digest1 = _mix64(key1 ^ _mix64(seq1 + _SEQ_SEED) ^ _mix64(value1))
+    digest2 = _mix64(key2 ^ _mix64(seq2 + _SEQ_SEED) ^ _mix64(value2))
+
+    if df1.shape[0] == df2.shape[0] and digest1.sum() == digest2.sum():
+        print(f"【比较两个表格】sort_columns={sort_columns},行哈希一致, 两个表完全一致")
+        columns = ['差异标识'] + [f"排序_{i}" for i in sort_columns]
+        return True, pd.DataFrame(columns=columns, dtype=object)
+
+    # 有差异的分组: 至少有一行的摘要在另一表中找不到
+    missing1 = ~pd.Series(digest1).isin(digest2).to_numpy()
+    missing2 = ~pd.Series(digest2).isin(digest1).to_numpy()
+    diff_keys = np.union1d(key1[missing1], key2[missing2])
+    rows1, rows2 = np.isin(key1, diff_keys), np.isin(key2, diff_keys)
+    log(f"【比较两个表格】行哈希: 有差异的分组数={diff_keys.size}, "
+        f"逐行比较的行数: 表1={rows1.sum()}/{df1.shape[0]}, 表2={rows2.sum()}/{df2.shape[0]}", level='info')
+    return compare_df_merge(df1[rows1], df2[rows2], sort_columns, progress)
+
+
 def get_basename(fpath: str, extension=False):
     if extension:
         return os.path.basename(fpath)
     return os.path.splitext(os.path.basename(fpath))[0]
     
-def export_multiple_df(dfs: list[pd.DataFrame], fpath, sheet_names=None):
+def export_multiple_df(dfs: list[pd.DataFrame], fpath, sheet_names=None, stream=False):
+    """stream 为 True 时用流式写入(write_excel_stream), 内存占用与行数无关"""
     try:
+        if sheet_names is None:
+            sheet_names = [f"Sheet{i+1}" for i in range(len(dfs))]
+        assert len(dfs) == len(sheet_names), "【导出多个表格】dfs 和 sheetnames 长度不一"
+        if stream:
+            write_excel_stream(dfs, fpath, sheet_names)
+            return
         with pd.ExcelWriter(fpath) as writer:
-            if sheet_names is None:
-                sheet_names = [f"Sheet{i+1}" for i in range(len(dfs))]
-            assert len(dfs) == len(sheet_names), "【导出多个表格】dfs 和 sheetnames 长度不一"
             for df, sheet_name in zip(dfs, sheet_names):
                 df.to_excel(writer, sheet_name=sheet_name, index=False)
     except Exception as e:
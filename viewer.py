@@ -0,0 +1,196 @@
+import re
+import numpy as np
+import pandas as pd
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt5.QtWidgets import QDialog, QTabWidget, QTableView, QWidget, QVBoxLayout, QHBoxLayout, QLabel, \
+    QLineEdit, QComboBox, QPushButton, QFileDialog
+import rule_engine
+from log import log
+
+"""
+程序内的结果查看器(选项 preview): 不写出 xlsx, 直接查看比较的差异表或 action_loop 中 export 的表。
+
+DataFrameModel 是 DataFrame 上的惰性表格模型: 只保存当前显示的行号数组(排序和筛选的结果),
+单元格在显示时才取值, 行随滚动分批加载(fetchMore), 百万行的表也能立即打开。
+排序和筛选都在 DataFrame 的列上向量化执行, 筛选与规则相同: 正则, 忽略大小写(rule_engine.match)。
+"""
+
+# 每次加载的行数
+FETCH_ROWS = 1000
+ALL_COLUMNS = "全部列"
+
+
+def sort_positions(s: pd.Series, ascending=True):
+    """按 s 的值稳定排序, 返回行号; 缺失值排在最后, 混合类型(例如差异表中的文字和数字)按字符串排序"""
+    values = s.reset_index(drop=True)
+    try:
+        result = values.sort_values(ascending=ascending, kind='stable', na_position='last')
+    except TypeError:
+        result = values.astype(str).where(values.notna()).sort_values(ascending=ascending, kind='stable',
+                                                                         na_position='last')
+    return result.index.to_numpy()
+
+
+class DataFrameModel(QAbstractTableModel):
+    """DataFrame 的只读表格模型, 行号为原表中的行号(从 1 开始)"""
+    def __init__(self, df: pd.DataFrame, parent=None):
+        super().__init__(parent)
+        self.df = df
+        self.order = np.arange(df.shape[0])  # 排序后的行号
+        self.mask = None  # 筛选出的行(按原表的行号), None 表示不筛选
+        self.rows = self.order  # 当前显示的行号
+        self.loaded = min(FETCH_ROWS, self.rows.size)
+        self.arrays = {}  # 列号 -> 列的 numpy 数组, 在显示时才转换
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.df.shape[1]
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.loaded < self.rows.size
+
+    def fetchMore(self, parent=QModelIndex()):
+        n = min(FETCH_ROWS, self.rows.size - self.loaded)
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + n - 1)
+        self.loaded += n
+        self.endInsertRows()
+
+    def column_array(self, column: int):
+        array = self.arrays.get(column)
+        if array is None:
+            array = self.arrays[column] = self.df.iloc[:, column].to_numpy()
+        return array
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        value = self.column_array(index.column())[self.rows[index.row()]]
+        return "" if pd.isna(value) else str(value)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return str(self.df.columns[section])
+        return str(self.rows[section] + 1)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """column 小于 0 时恢复原表的顺序"""
+        if column < 0:
+            order_t = np.arange(self.df.shape[0])
+        else:
+            order_t = sort_positions(self.df.iloc[:, column], order == Qt.AscendingOrder)
+        self.order = order_t
+        self.update_rows()
+
+    def set_filter(self, regex: str, columns: list):
+        """筛选 columns 中任意一列匹配 regex 的行, regex 为空时取消筛选"""
+        if not regex:
+            self.mask = None
+        else:
+            mask = np.zeros(self.df.shape[0], dtype=bool)
+            for column in columns:
+                mask |= rule_engine.match(self.df, column, regex).to_numpy()
+            self.mask = mask
+        self.update_rows()
+
+    def update_rows(self):
+        self.beginResetModel()
+        self.rows = self.order if self.mask is None else self.order[self.mask[self.order]]
+        self.loaded = min(FETCH_ROWS, self.rows.size)
+        self.endResetModel()
+
+    def visible_frame(self):
+        """当前显示的行(筛选和排序后)组成的表"""
+        return self.df.iloc[self.rows]
+
+
+class ResultViewer(QDialog):
+    """
+    每个表一页, 可以点击列名排序, 按正则筛选, 并导出筛选后的行。
+    background(func, on_finished) 在后台执行 func(progress), 用于导出
+    """
+    def __init__(self, title: str, frames: dict, background, default_dir="data", stream=False, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.resize(1000, 600)
+        self.title = title
+        self.background = background
+        self.default_dir = default_dir
+        self.stream = stream
+
+        tabs = QTabWidget()
+        for name, df in frames.items():
+            tabs.addTab(self.create_page(name, df), f"{name} ({df.shape[0]}行)")
+        layout = QVBoxLayout()
+        layout.addWidget(tabs)
+        self.setLayout(layout)
+
+    def create_page(self, name: str, df: pd.DataFrame):
+        page = QWidget()
+        model = DataFrameModel(df, page)
+        view = QTableView()
+        view.setModel(model)
+        # 排序指示器初始为空, 打开时保持原表的顺序
+        view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        view.setSortingEnabled(True)
+
+        column_box = QComboBox()
+        column_box.addItems([ALL_COLUMNS] + [str(c) for c in df.columns])
+        pattern = QLineEdit()
+        pattern.setPlaceholderText("正则表达式, 忽略大小写; 为空时显示全部行")
+        filter_button = QPushButton("筛选")
+        export_button = QPushButton("导出筛选结果")
+        status = QLabel()
+
+        def show_status():
+            status.setText(f"显示 {model.rows.size} / {df.shape[0]} 行")
+
+        def apply_filter():
+            regex = pattern.text()
+            try:
+                re.compile(regex, flags=re.IGNORECASE)
+            except re.error as e:
+                status.setText(f"正则有误: {e}")
+                return
+            index = column_box.currentIndex()
+            columns = df.columns.tolist() if index == 0 else [df.columns[index - 1]]
+            model.set_filter(regex, columns)
+            show_status()
+
+        pattern.returnPressed.connect(apply_filter)
+        filter_button.clicked.connect(apply_filter)
+        export_button.clicked.connect(lambda: self.export(name, model.visible_frame(), status))
+        model.modelReset.connect(show_status)
+        show_status()
+
+        tool_layout = QHBoxLayout()
+        tool_layout.addWidget(column_box)
+        tool_layout.addWidget(pattern)
+        tool_layout.addWidget(filter_button)
+        tool_layout.addWidget(export_button)
+        layout = QVBoxLayout()
+        layout.addLayout(tool_layout)
+        layout.addWidget(view)
+        layout.addWidget(status)
+        page.setLayout(layout)
+        return page
+
+    def export(self, name: str, df: pd.DataFrame, status: QLabel):
+        """在后台把筛选(和排序)后的行写入 xlsx"""
+        default_path = f"{self.default_dir}/{self.title}_{name}_筛选.xlsx"
+        fpath, _ = QFileDialog.getSaveFileName(self, "导出筛选结果", default_path, "Excel 文件 (*.xlsx)")
+        if not fpath:
+            return
+
+        def write(progress):
+            from utils import write_excel
+            progress(0, 1, f"导出 {name}")
+            write_excel(df, fpath, self.stream)
+            return fpath
+
+        log(f"【查看结果】导出 '{name}' 的 {df.shape[0]} 行到 '{fpath}'", level='info')
+        status.setText(f"正在导出 {df.shape[0]} 行到 '{fpath}'")
+        self.background(write, lambda path: status.setText(f"已导出 {df.shape[0]} 行到 '{path}'"))